@@ -72,36 +72,48 @@ class ScanControlClient(QObject):
         self.loop = loop
         if self.loop is None:
             self.loop = asyncio.get_event_loop()
+        self._timeAxisEncoded = None      # encoded time axis the cached decode belongs to
+        self._timeAxis = None             # decoded time axis, shared by all pulses until it changes
 
     def _decodeData(self, data):
+        # b64decode allocates the bytes once, frombuffer is a read only view on them (no further copy)
         return numpy.frombuffer(base64.b64decode(data), dtype=numpy.float64)
 
     def _decodeAmpArray(self, data):
 
-        encAmpData = data['amplitude']
-        decAmpData = []
-        for set in encAmpData:
-            decAmpData.append(self._decodeData(set))
-
-        data['amplitude'] = decAmpData
+        # No pooled amplitude buffers: every pulse needs its own array, the device keeps the
+        # latest one (pulseData) and the consumer queues hold pulses for an unbounded time
+        data['amplitude'] = [self._decodeData(set) for set in data['amplitude']]
         return data
 
-    def _onDisplayPulseReady(self,data):
-        data = self._decodeAmpArray(data)
-        if self.scancontrol.timeAxis is not None:
-            decTimeAxis = self._decodeData(self.scancontrol.timeAxis)
-            if len(data['amplitude'][0]) == len(decTimeAxis):
-                data['timeaxis']=decTimeAxis
-                self.scancontrol._invokeSignalCallbacks(-2, [data])
+    def _decodedTimeAxis(self):
 
-    def _onPulseReady(self,data):
+        encTimeAxis = self.scancontrol.timeAxis
+        if encTimeAxis is None:
+            return None
+        if encTimeAxis is not self._timeAxisEncoded:
+            self._timeAxis = self._decodeData(encTimeAxis)
+            self._timeAxisEncoded = encTimeAxis
+        return self._timeAxis
+
+    def _onTimeAxisChanged(self, *args):
+        self._timeAxisEncoded = None
+        self._timeAxis = None
+
+    def _dispatchPulse(self, data, signalIndex):
 
         data = self._decodeAmpArray(data)
-        if self.scancontrol.timeAxis is not None:
-            decTimeAxis = self._decodeData(self.scancontrol.timeAxis)
+        decTimeAxis = self._decodedTimeAxis()
+        if decTimeAxis is not None:
             if len(data['amplitude'][0]) == len(decTimeAxis):
                 data['timeaxis']=decTimeAxis
-                self.scancontrol._invokeSignalCallbacks(-1, [data])
+                self.scancontrol._invokeSignalCallbacks(signalIndex, [data])
+
+    def _onDisplayPulseReady(self,data):
+        self._dispatchPulse(data, -2)
+
+    def _onPulseReady(self,data):
+        self._dispatchPulse(data, -1)
 
     async def _establish_connection(self, webchannel):
         # Wait for initialized
@@ -119,6 +131,10 @@ class ScanControlClient(QObject):
                                                     'decodedPulse', True)
         self.scancontrol.pulseReadyEncoded.connect(self._onPulseReady)
 
+        # re-decode the cached time axis only after ScanControl updates it
+        if hasattr(self.scancontrol, 'timeAxisChanged'):
+            self.scancontrol.timeAxisChanged.connect(self._onTimeAxisChanged)
+
     def exception_handler(self, loop, context):
         print(context)
         print('Exception handler called')
@@ -0,0 +1,129 @@
+import asyncio
+import collections
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PulseQueue:
+
+    """
+        Bounded queue between the ScanControl pulse stream and one consumer.
+
+        Pulses are put synchronously from the webchannel callback and handed to the consumer by a
+        single drain task, so a slow consumer never has more than one call in flight and never
+        stacks up tasks on the event loop. The policy decides what happens when it falls behind:
+
+            'latest'   - keep only the newest pulse (plots, progress bars)
+            'nth'      - pass every nth pulse, and of those only the newest (decimated displays)
+            'lossless' - keep every pulse in order up to maxDepth (averaging, analysis)
+
+        A lossless queue that reaches maxDepth drops its oldest pulse and counts it as an overflow,
+        memory stays bounded even if the consumer stalls.
+    """
+
+    policies = ('latest', 'nth', 'lossless')
+
+    def __init__(self, handler, policy = 'latest', nth = 1, maxDepth = 256, name = None):
+
+        if policy not in self.policies:
+            raise ValueError(f"Unknown pulse queue policy '{policy}', expected one of {self.policies}")
+        self.handler = handler                             # consumer, plain function or coroutine function
+        self.policy = policy
+        self.nth = max(1, int(nth))                        # decimation factor for the 'nth' policy
+        self.maxDepth = maxDepth if policy == 'lossless' else 1
+        self.name = name or getattr(handler, '__qualname__', repr(handler))
+        self.received = 0                                  # pulses offered to the queue
+        self.processed = 0                                 # pulses handed to the consumer
+        self.dropped = 0                                   # pulses discarded by the policy
+        self.overflows = 0                                 # lossless pulses lost to a full queue
+        self.maxSeenDepth = 0                              # high water mark of the queue depth
+        self.enabled = True
+        self._pending = collections.deque()
+        self._drainTask = None
+
+
+    @property
+    def depth(self):
+
+        return len(self._pending)
+
+
+    def put(self, data):
+
+        """
+            Offer a pulse to the consumer according to the queue policy.
+
+            :type data: dict
+            :param data: decoded pulse data from ScanControlClient
+        """
+
+        if not self.enabled:
+            return
+        self.received += 1
+        if self.policy == 'nth' and self.received % self.nth:
+            self.dropped += 1
+            return
+        if len(self._pending) >= self.maxDepth:
+            self._pending.popleft()
+            if self.policy == 'lossless':
+                self.overflows += 1
+                logger.warning(f"Pulse queue '{self.name}' full ({self.maxDepth}), oldest pulse dropped")
+            else:
+                self.dropped += 1
+        self._pending.append(data)
+        self.maxSeenDepth = max(self.maxSeenDepth, len(self._pending))
+        if self._drainTask is None or self._drainTask.done():
+            self._drainTask = asyncio.ensure_future(self._drain())
+
+
+    async def _drain(self):
+
+        while self._pending:
+            data = self._pending.popleft()
+            try:
+                result = self.handler(data)
+                if inspect.isawaitable(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pulse consumer '{self.name}' failed: {e}")
+            self.processed += 1
+
+
+    async def join(self):
+
+        """
+            Wait until the pulses queued so far have been handed to the consumer.
+        """
+
+        while self._drainTask is not None and not self._drainTask.done():
+            await asyncio.shield(self._drainTask)
+
+
+    def clear(self):
+
+        """
+            Discard queued pulses e.g. when acquisition stops.
+        """
+
+        self.dropped += len(self._pending)
+        self._pending.clear()
+
+
+    def stats(self):
+
+        """
+            :return: queue depth and counters
+            :rtype: dict
+        """
+
+        return {'policy': self.policy,
+                'depth': self.depth,
+                'maxDepth': self.maxSeenDepth,
+                'received': self.received,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'overflows': self.overflows}
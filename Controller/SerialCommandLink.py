@@ -0,0 +1,183 @@
+import asyncio
+import collections
+import logging
+from PyQt5.QtCore import QObject, QTextCodec, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+class SerialCommandLink(QObject):
+
+    """
+        Line based command/ response layer on top of a QSerialPort shared by the robots and the
+        temperature sensor.
+
+        Each command registers a future before it is written, so a fast response cannot be missed.
+        The firmware answers commands in order, so responses are matched to commands first in,
+        first out: receive() parses every complete line as soon as readyRead fires and only the
+        oldest pending command may take it. No polling is involved. Lines that do not answer the
+        oldest command (e.g. streamed temperatures) are only emitted by lineReceived. A command
+        whose response does not arrive within its timeout is dropped, whether or not anyone
+        waits for it, so it cannot hold up or take the responses of later commands.
+
+        The port may be shared (e.g. by a robot and the temperature sensor), so a command is
+        always awaited through the future send() returned for it, and each user cancels only
+        its own commands (owner).
+    """
+
+    lineReceived = pyqtSignal(str)                             # every line read from the port
+
+    def __init__(self, serial, timeout = 10, name = "serial"):
+
+        super().__init__()
+        self.serial = serial                                   # QSerialPort, opened by the owner
+        self.timeout = timeout                                 # default seconds to wait for a response
+        self.name = name
+        self.lastMessage = None                                # last line received
+        self._pending = collections.deque()                    # (command, expect, future, deadline, owner) in send order
+        self._codec = QTextCodec.codecForName("UTF-8")
+        self.serial.readyRead.connect(self.receive)
+
+
+    def send(self, command, expect = 'ACK', timeout = None, reply = True, owner = None):
+
+        """
+            Write a command without waiting.
+
+            :type command: str
+            :param command: command without line ending
+            :type expect: str, callable or None
+            :param expect: the response line, a predicate on the line, or None for whatever line comes next
+            :type timeout: float
+            :param timeout: seconds after which the command is dropped if unanswered, the link default if None
+            :type reply: bool
+            :param reply: False for commands the firmware does not answer, nothing is registered
+            :type owner: object
+            :param owner: user of the link the command belongs to, see clear()
+
+            :return: future resolved with the response line, None if no reply is expected
+            :rtype: asyncio.Future
+        """
+
+        self._expire()
+        future = None
+        if reply:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self._pending.append((command, expect, future, loop.time() + (timeout or self.timeout), owner))
+        self.serial.write(f"{command}\n".encode())
+        return future
+
+
+    async def wait(self, future = None, timeout = None):
+
+        """
+            Wait for the response to a command sent with send().
+
+            :type future: asyncio.Future
+            :param future: response future returned by send(), None for a command without reply
+            :type timeout: float
+            :param timeout: seconds, the link default if None
+
+            :return: response line
+            :rtype: str
+        """
+
+        if future is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout = timeout or self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"[{self.name}] no response within {timeout or self.timeout} s")
+            self._discard(future)                              # a late response must not answer the next command
+            raise
+        except asyncio.CancelledError:
+            self._discard(future)
+            raise
+
+
+    async def request(self, command, expect = 'ACK', timeout = None, owner = None):
+
+        """
+            Send a command and wait for its response.
+
+            :raises asyncio.TimeoutError: no matching response within the timeout
+        """
+
+        return await self.wait(self.send(command, expect, timeout, owner = owner), timeout)
+
+
+    def _discard(self, future):
+
+        for entry in list(self._pending):
+            if entry[2] is future:
+                self._pending.remove(entry)
+                logger.warning(f"[{self.name}] dropped pending command '{entry[0]}'")
+        if not future.done():
+            future.cancel()
+
+
+    def _expire(self):
+
+        """
+            Drop commands that were answered elsewhere, cancelled or timed out, waited for or not.
+        """
+
+        if not self._pending:
+            return
+        now = asyncio.get_event_loop().time()
+        for entry in list(self._pending):
+            command, _, future, deadline, _ = entry
+            if future.done() or now > deadline:
+                self._pending.remove(entry)
+                if not future.done():
+                    logger.warning(f"[{self.name}] no response to '{command}', dropped")
+                    future.cancel()
+
+
+    def _matches(self, expect, line):
+
+        if expect is None:
+            return True
+        if callable(expect):
+            return bool(expect(line))
+        return line == expect
+
+
+    def receive(self):
+
+        """
+            Read every complete line from the port and resolve the oldest pending command if the line
+            answers it. Connected to readyRead.
+        """
+
+        while self.serial.canReadLine():
+            line = self._codec.toUnicode(self.serial.readLine()).strip()
+            if not line:
+                continue
+            self.lastMessage = line
+            self._expire()
+            if self._pending:
+                command, expect, future, _, _ = self._pending[0]
+                if self._matches(expect, line):
+                    self._pending.popleft()
+                    future.set_result(line)
+                    logger.debug(f"[{self.name}] '{command}' -> '{line}'")
+            self.lineReceived.emit(line)
+
+
+    def clear(self, owner = None):
+
+        """
+            Cancel pending commands e.g. when the session is stopped.
+
+            :type owner: object
+            :param owner: cancel only the commands sent for this owner, every command if None
+        """
+
+        for entry in list(self._pending):
+            future = entry[2]
+            if owner is None or entry[4] is owner:
+                self._pending.remove(entry)
+                if not future.done():
+                    future.cancel()
@@ -0,0 +1,190 @@
+import collections
+import numpy as np
+
+
+class StreamingAverager:
+
+    """
+        Client side accumulator for raw THz pulses with per sample running statistics.
+
+        Modes:
+            'cumulative'  - Welford running mean and variance of all pulses since reset
+            'exponential' - exponentially weighted mean and variance, weight alpha for the newest pulse
+            'window'      - mean and variance of the last `window` pulses (Welford add/ remove updates)
+
+        All statistics live in arrays allocated once per pulse length, updates are in place.
+    """
+
+    modes = ('cumulative', 'exponential', 'window')
+
+    def __init__(self, mode = 'cumulative', alpha = 0.1, window = 16):
+
+        if mode not in self.modes:
+            raise ValueError(f"Unknown averaging mode '{mode}', expected one of {self.modes}")
+        self.mode = mode
+        self.alpha = alpha                                 # weight of the newest pulse in 'exponential' mode
+        self.window = window                               # pulses averaged in 'window' mode
+        self.N = None                                      # samples per pulse
+        self.count = 0                                     # pulses in the current statistics
+        self.total = 0                                     # pulses received since reset
+        self.mean = None                                   # running mean per sample
+        self._m2 = None                                    # sum of squared deviations (exponential: variance)
+        self._delta = None                                 # scratch array
+        self._ring = None                                  # last pulses in 'window' mode
+        self._ringPos = 0
+
+
+    def reset(self, N = None):
+
+        """
+            Clear the statistics, optionally for a new pulse length.
+        """
+
+        if N is not None and N != self.N:
+            self.N = N
+            self.mean = np.zeros(N)
+            self._m2 = np.zeros(N)
+            self._delta = np.empty(N)
+            self._ring = np.empty((self.window, N)) if self.mode == 'window' else None
+        elif self.mean is not None:
+            self.mean[:] = 0
+            self._m2[:] = 0
+        self.count = 0
+        self.total = 0
+        self._ringPos = 0
+
+
+    def _add(self, x):
+
+        d = self._delta
+        self.count += 1
+        np.subtract(x, self.mean, out = d)
+        self.mean += d/self.count
+        d *= x - self.mean                                 # (x - old mean)*(x - new mean)
+        self._m2 += d
+
+
+    def _remove(self, x):
+
+        d = self._delta
+        self.count -= 1
+        if self.count == 0:
+            self.mean[:] = 0
+            self._m2[:] = 0
+            return
+        np.subtract(x, self.mean, out = d)
+        self.mean -= d/self.count
+        d *= x - self.mean
+        self._m2 -= d
+
+
+    def update(self, amp):
+
+        """
+            Add one raw pulse.
+
+            :type amp: numpy array
+            :param amp: pulse amplitude, a new length restarts the statistics
+        """
+
+        amp = np.asarray(amp, dtype = float)
+        if len(amp) != self.N:
+            self.reset(len(amp))
+        self.total += 1
+        if self.mode == 'cumulative':
+            self._add(amp)
+        elif self.mode == 'window':
+            if self.count == self.window:
+                self._remove(self._ring[self._ringPos])
+            self._ring[self._ringPos] = amp
+            self._ringPos = (self._ringPos + 1) % self.window
+            self._add(amp)
+        else:
+            if self.count == 0:
+                self.mean[:] = amp
+                self._m2[:] = 0
+            else:
+                d = self._delta
+                np.subtract(amp, self.mean, out = d)
+                self.mean += self.alpha*d
+                d *= d
+                d *= self.alpha
+                self._m2 += d
+                self._m2 *= 1 - self.alpha                 # exponentially weighted variance
+            self.count += 1
+
+
+    @property
+    def effectiveCount(self):
+
+        """
+            Number of independent pulses the mean is equivalent to.
+        """
+
+        if self.mode == 'exponential':
+            return min(self.count, (2 - self.alpha)/self.alpha)
+        return self.count
+
+
+    @property
+    def variance(self):
+
+        """
+            Per sample variance of a single pulse.
+        """
+
+        if self.mean is None or self.count < 2:
+            return None
+        if self.mode == 'exponential':
+            return self._m2.copy()
+        return self._m2/(self.count - 1)
+
+
+    @property
+    def std(self):
+
+        variance = self.variance
+        return None if variance is None else np.sqrt(np.maximum(variance, 0))
+
+
+    @property
+    def stderr(self):
+
+        """
+            Per sample standard error of the mean.
+        """
+
+        std = self.std
+        return None if std is None else std/np.sqrt(self.effectiveCount)
+
+
+    def snr(self):
+
+        """
+            Peak amplitude of the mean over the rms standard error of the mean.
+
+            :return: signal to noise ratio, None before two pulses
+            :rtype: float
+        """
+
+        stderr = self.stderr
+        if stderr is None:
+            return None
+        noise = np.sqrt(np.mean(stderr**2))
+        return np.inf if noise == 0 else float(np.max(np.abs(self.mean))/noise)
+
+
+    def result(self, timeaxis = None):
+
+        """
+            Snapshot of the average in the format of Device.avgResult.
+
+            :return: 'amplitude' (list with the mean pulse), 'timeaxis', 'std', 'count', 'snr'
+            :rtype: dict
+        """
+
+        return {'amplitude': [self.mean.copy()],
+                'timeaxis': timeaxis,
+                'std': self.std,
+                'count': self.count,
+                'snr': self.snr()}
@@ -19,6 +19,8 @@ from PyQt5.QtCore import pyqtSignal, QTextCodec
 from PyQt5.QtWidgets import QApplication, QWidget
 
 from Controller.Menlo.scancontrolclient import ScanControlClient, ScanControlStatus
+from Controller.PulseQueue import PulseQueue
+from Controller.StreamingAverager import StreamingAverager
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -55,7 +57,17 @@ class Device(QWidget):
                 self.avgTask = None                        # averaging task 
                 self.status = None
                 self.avgResult = None                      # result of averaging task
-                self.pulseReady.connect(self.processPulses)   
+                self.pulseQueues = []                      # bounded queues of the pulse consumers (see subscribe)
+                self.avgFuture = None                      # resolved with the averaged pulse (see averagingDone)
+                self._avgArmed = False                     # a reset has been observed since the last average
+                self._pulsesSinceReset = 0                 # pulses received since resetAveraging
+                self.averager = None                       # optional client side StreamingAverager
+                self.snrTarget = None                      # stop client side averaging early at this SNR
+                self._streamFuture = None                  # resolved when the client side average is complete
+                self.stopCondition = None                  # optional callable(averager), True ends client side averaging early
+                self.pulseReady.connect(self._dispatchPulse)   
+                if hasattr(self.scanControl, 'currentAveragesChanged'):
+                    self.scanControl.currentAveragesChanged.connect(self._averagesChanged)
                 self.scanControl.statusChanged.connect(self._statusChanged) 
                 logger.info("ScanControl Ready")
         except:
@@ -67,6 +79,178 @@ class Device(QWidget):
         return "A device object to control Menlo TeraSmart, Device is a subclass of QWidget"
 
 
+    def subscribe(self, handler, policy = 'latest', nth = 1, maxDepth = 256):
+
+        """
+            Register a pulse consumer behind its own bounded queue. 
+
+            :type handler: callable
+            :param handler: called with each delivered pulse, may be a coroutine function or asyncSlot
+            :type policy: str
+            :param policy: 'latest' (only the newest pulse), 'nth' (every nth pulse) or 'lossless' (all pulses, for averaging)
+            :type nth: int
+            :param nth: decimation factor for the 'nth' policy
+            :type maxDepth: int
+            :param maxDepth: queue bound for the 'lossless' policy
+
+            :return: the consumer queue, exposing its depth and drop counters
+            :rtype: PulseQueue
+        """
+
+        queue = PulseQueue(handler, policy = policy, nth = nth, maxDepth = maxDepth)
+        self.pulseQueues.append(queue)
+        return queue
+
+
+    def unsubscribe(self, queue):
+
+        """
+            Remove a pulse consumer queue.
+        """
+
+        queue.enabled = False
+        queue.clear()
+        if queue in self.pulseQueues:
+            self.pulseQueues.remove(queue)
+
+
+    def queueStats(self):
+
+        """
+            :return: depth and drop counters of every pulse consumer
+            :rtype: dict
+        """
+
+        return {queue.name: queue.stats() for queue in self.pulseQueues}
+
+
+    def _dispatchPulse(self, data):
+
+        """
+            Keep the latest pulse for the averaging result and fan it out to the consumer queues.
+        """
+
+        self.pulseData = data
+        self._pulsesSinceReset += 1
+        if self._streamFuture is not None:
+            self._accumulate(data)
+        else:
+            self._checkAveraging()
+        for queue in self.pulseQueues:
+            queue.put(data)
+
+
+    async def pulsesProcessed(self):
+
+        """
+            Wait until the lossless consumers have processed every pulse received so far.
+        """
+
+        for queue in self.pulseQueues:
+            if queue.policy == 'lossless':
+                await queue.join()
+
+
+    def averagingDone(self):
+
+        """
+            Awaitable for the completion of the running average, resolved from the
+            currentAverages property updates (and pulses) instead of polling.
+
+            :return: future resolved with the averaged pulse data
+            :rtype: asyncio.Future
+        """
+
+        if self.avgFuture is None or self.avgFuture.done():
+            self.avgFuture = asyncio.get_event_loop().create_future()
+        self._checkAveraging()
+        return self.avgFuture
+
+
+    def useStreamingAverager(self, mode = 'cumulative', alpha = 0.1, window = 16, snrTarget = None):
+
+        """
+            Average raw single shot pulses in the client instead of in ScanControl. The averaging task
+            then also provides per sample noise (avgResult['std']) and can stop as soon as the SNR target is met.
+
+            :type mode: str
+            :param mode: 'cumulative', 'exponential' or 'window' (see StreamingAverager)
+            :type snrTarget: float
+            :param snrTarget: stop once the peak/ noise ratio of the mean reaches this value, None to always use numAvgs
+        """
+
+        self.averager = StreamingAverager(mode, alpha = alpha, window = window)
+        self.snrTarget = snrTarget
+
+
+    def _accumulate(self, data):
+
+        """
+            Add a raw pulse to the client side average and resolve the averaging task when it is complete.
+        """
+
+        self.averager.update(data['amplitude'][0])
+        if self._streamFuture.done():
+            return
+        snr = self.averager.snr() if self.snrTarget else None
+        if self.averager.count >= (self.numAvgs or 1) or (snr is not None and snr >= self.snrTarget) or \
+           (self.stopCondition is not None and self.stopCondition(self.averager)):
+            self._streamFuture.set_result(self.averager.result(data['timeaxis']))
+
+
+    async def streamAverage(self):
+
+        """
+            Client side averaging task: ScanControl delivers single shots which are accumulated
+            until numAvgs pulses or the SNR target is reached.
+
+            :return: averaged pulse data with per sample noise, in the format of avgResult
+            :rtype: dict
+        """
+
+        self.scanControl.setDesiredAverages(1)     # raw single shots, self.numAvgs keeps the client target
+        self.averager.reset()
+        self._streamFuture = asyncio.get_event_loop().create_future()
+        try:
+            if not self.isAcquiring:
+                await self.start()
+            avgData = await self._streamFuture
+        finally:
+            self._streamFuture = None
+        logger.info(f"> [SCANCONTROL] Client average of {avgData['count']} pulses, SNR {avgData['snr']}")
+        self.pulseData = avgData
+        for queue in self.pulseQueues:             # consumers see the average as the final pulse, as with ScanControl averaging
+            queue.put(avgData)
+        await self.pulsesProcessed()
+        return avgData
+
+
+    def _averagesChanged(self, *args):
+
+        self._checkAveraging()
+
+
+    def _checkAveraging(self):
+
+        """
+            Resolve the averaging future once the average is complete. A completed count is only
+            accepted after the reset is visible, as a count below target or enough new pulses.
+        """
+
+        if self.avgFuture is None or self.avgFuture.done():
+            return
+        current = self.scanControl.currentAverages
+        target = self.numAvgs if self.numAvgs is not None else self.scanControl.desiredAverages
+        if current is None or not target:
+            return
+        if not self._avgArmed:
+            self._avgArmed = current < target or self._pulsesSinceReset >= target
+            if not self._avgArmed:
+                return
+        if current >= target and self.pulseData is not None:
+            self.avgFuture.set_result(self.pulseData)
+
+
     def isAveragingDone(self):
 
         """ Check if averaging is completed"""
@@ -82,6 +266,8 @@ class Device(QWidget):
 
         logger.info("> [SCANCONTROL] Resetting averages")
         # self.qcResult = None
+        self._avgArmed = False
+        self._pulsesSinceReset = 0
         self.scanControl.resetAveraging()
 
 
@@ -190,16 +376,16 @@ class Device(QWidget):
         """Perform averaging task and emit final result as signal"""
 
         try:    
-            if self.avgTask is not None:
+            if self.avgTask is not None and self.averager is not None:
+                avgData = await self.streamAverage()
+                self.dataUpdateReady.emit(avgData)
+            elif self.avgTask is not None:
                 self.resetAveraging()
+                done = self.averagingDone()
                 if not self.isAcquiring:
                     await self.start()       
-                    await asyncio.sleep(2)     
-                while not self.isAveragingDone():
-                    await asyncio.sleep(0.1)
-                if self.isAveragingDone():
-                    avgData = self.pulseData
-                    self.dataUpdateReady.emit(avgData)
+                avgData = await done
+                self.dataUpdateReady.emit(avgData)
         except asyncio.exceptions.CancelledError as c:
             raise c
 
@@ -241,6 +427,13 @@ class Device(QWidget):
         self.isAcquiring = False
         self.keepRunning = False
         self.avgTask = None
+        if self.avgFuture is not None and not self.avgFuture.done():
+            self.avgFuture.cancel()                # nothing more to average, release the waiters
+        if self._streamFuture is not None and not self._streamFuture.done():
+            self._streamFuture.cancel()
+        for queue in self.pulseQueues:
+            queue.clear()
+        logger.info(f"> [SCANCONTROL] Pulse queues: {self.queueStats()}")
 
 
 
@@ -0,0 +1,174 @@
+import datetime
+import fnmatch
+import json
+import os
+import sqlite3
+from MenloParser import readHeader
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER,
+    size INTEGER,
+    timestamp TEXT,
+    lot TEXT,
+    wafer TEXT,
+    sensorId TEXT,
+    qcResult TEXT,
+    type TEXT,
+    averages INTEGER,
+    qcParams TEXT,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_lot ON files (lot, qcResult, timestamp);
+CREATE INDEX IF NOT EXISTS idx_sensor ON files (sensorId);
+CREATE INDEX IF NOT EXISTS idx_timestamp ON files (timestamp);
+"""
+
+_columns = ['path', 'mtime', 'size', 'timestamp', 'lot', 'wafer', 'sensorId',
+            'qcResult', 'type', 'averages', 'qcParams', 'version']
+
+
+class ArchiveIndex:
+
+    """
+        Incremental SQLite index over the header metadata of Menlo TDS exports.
+
+        Only the comment header of new or modified files is read (see MenloParser.readHeader),
+        unchanged files are skipped on the size/ mtime key. Queries run against the index
+        alone, no data file is opened.
+    """
+
+    def __init__(self, dbPath):
+
+        self.dbPath = dbPath                    # SQLite database file, ':memory:' for a throw away index
+        self.db = sqlite3.connect(dbPath)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(_schema)
+
+
+    def _scan(self, directory, pattern, recursive):
+
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]    # skip sidecar caches e.g. .tdscache
+            for name in fnmatch.filter(files, pattern):
+                yield os.path.abspath(os.path.join(root, name))
+            if not recursive:
+                break
+
+
+    def _record(self, path, st):
+
+        meta = readHeader(path)
+        timestamp = meta['timestamp'].isoformat() if meta['timestamp'] is not None else None
+        qcParams = meta['qcParams']
+        if qcParams is not None and not isinstance(qcParams, str):
+            qcParams = json.dumps(qcParams, default = str)
+        return (path, st.st_mtime_ns, st.st_size, timestamp, meta['lot'], meta['wafer'], meta['sensorId'],
+                meta['qcResult'], meta['Type'], meta['averages'], qcParams, meta['version'])
+
+
+    def update(self, directories, pattern = "*.txt", recursive = True):
+
+        """
+            Bring the index up to date with the files in the given directories.
+
+            :type directories: str or list
+            :param directories: export/ QC directories to index
+            :type pattern: str
+            :param pattern: file name pattern
+            :type recursive: bool
+            :param recursive: include sub directories e.g. the per day export folders
+
+            :return: number of added/ updated and removed entries
+            :rtype: int, int
+        """
+
+        if isinstance(directories, str):
+            directories = [directories]
+        changed = []
+        removed = []
+        for directory in directories:
+            prefix = os.path.join(os.path.abspath(directory), '')
+            known = {row['path']: (row['mtime'], row['size']) for row in
+                     self.db.execute("SELECT path, mtime, size FROM files WHERE substr(path, 1, ?) = ?",
+                                     (len(prefix), prefix))}
+            seen = set()
+            for path in self._scan(directory, pattern, recursive):
+                seen.add(path)
+                try:
+                    st = os.stat(path)
+                    if known.get(path) == (st.st_mtime_ns, st.st_size):
+                        continue
+                    changed.append(self._record(path, st))
+                except (OSError, UnicodeDecodeError, ValueError):
+                    continue                    # unreadable or half written file, picked up on the next update
+            removed.extend((path,) for path in known if path not in seen and
+                           (recursive or os.path.dirname(path) == prefix[:-1]))
+        with self.db:
+            self.db.executemany(f"INSERT OR REPLACE INTO files VALUES ({', '.join('?'*len(_columns))})", changed)
+            self.db.executemany("DELETE FROM files WHERE path = ?", removed)
+        return len(changed), len(removed)
+
+
+    def query(self, lot = None, wafer = None, sensorId = None, qcResult = None, since = None, until = None, type = None):
+
+        """
+            Find indexed files by header metadata, e.g. all FAIL sensors of a lot this month:
+            query(lot = "1", qcResult = "FAIL", since = datetime(2022, 4, 1))
+
+            :type since: datetime or str
+            :param since: earliest timestamp (inclusive)
+            :type until: datetime or str
+            :param until: latest timestamp (exclusive)
+
+            :return: matching entries in timestamp order
+            :rtype: list of dict
+        """
+
+        where = []
+        params = []
+        for column, value in [('lot', lot), ('wafer', wafer), ('sensorId', sensorId), ('qcResult', qcResult), ('type', type)]:
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(str(value))
+        for op, value in [('>=', since), ('<', until)]:
+            if value is not None:
+                if isinstance(value, datetime.datetime):
+                    value = value.isoformat()
+                where.append(f"timestamp {op} ?")
+                params.append(value)
+        sql = "SELECT * FROM files"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp"
+        results = []
+        for row in self.db.execute(sql, params):
+            entry = dict(row)
+            if entry['timestamp'] is not None:
+                entry['timestamp'] = datetime.datetime.fromisoformat(entry['timestamp'])
+            if entry['qcParams'] is not None:
+                try:
+                    entry['qcParams'] = json.loads(entry['qcParams'])
+                except ValueError:
+                    pass
+            results.append(entry)
+        return results
+
+
+    def paths(self, **criteria):
+
+        """
+            File paths matching the query criteria, ready for MenloLoader.
+
+            :return: file paths in timestamp order
+            :rtype: list
+        """
+
+        return [entry['path'] for entry in self.query(**criteria)]
+
+
+    def close(self):
+
+        self.db.close()
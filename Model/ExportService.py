@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from MenloParser import writeTDSBinary
+
+logger = logging.getLogger(__name__)
+
+
+class ExportService:
+
+    """
+        Shared background writer for the experiment exports (TDS text files, reports, config
+        rewrites, plot images), so the event loop never waits for the disk or a network share.
+
+        Every export is a job on a small thread pool and returns a concurrent.futures.Future,
+        awaitable in a coroutine through wait(). A file is written to <path>.tmp and renamed
+        when complete, so readers (e.g. MenloWatcher) never see half written files. At most
+        maxQueued jobs are pending; submitting more blocks until one completes, which only
+        happens if the disk falls behind by that many files.
+    """
+
+    def __init__(self, workers = 1, maxQueued = 64, fsync = False):
+
+        """
+            :type workers: int
+            :param workers: writer threads. One keeps the files in submission order.
+            :type maxQueued: int
+            :param maxQueued: pending jobs before submit blocks
+            :type fsync: bool
+            :param fsync: default fsync policy, fsync every file before it is renamed into place
+        """
+
+        self.workers = workers
+        self.maxQueued = maxQueued
+        self.fsync = fsync
+        self.errors = []                                       # (path, exception) of failed exports, newest last
+        self.onError = None                                    # optional callable(path, exception), called on the writer thread
+        self._slots = threading.BoundedSemaphore(maxQueued)
+        self._pool = None
+        self._lock = threading.Lock()
+
+
+    def _executor(self):
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers = self.workers, thread_name_prefix = "export")
+            return self._pool
+
+
+    def _write(self, path, write, fsync):
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        tmpFile = f"{path}.tmp"
+        try:
+            write(tmpFile)
+            if fsync:
+                with open(tmpFile, 'rb+') as f:
+                    os.fsync(f.fileno())
+            os.replace(tmpFile, path)
+        except BaseException:
+            if os.path.isfile(tmpFile):
+                os.remove(tmpFile)
+            raise
+        return path
+
+
+    def _done(self, path, future):
+
+        self._slots.release()
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            logger.error(f"Export of {path} failed: {e}")
+            self.errors.append((path, e))
+            if self.onError is not None:
+                self.onError(path, e)
+
+
+    def submit(self, path, write, fsync = None):
+
+        """
+            Queue a file export.
+
+            :type path: str
+            :param path: destination file, its directory is created if needed
+            :type write: callable
+            :param write: write(tmpPath) writes the complete file to tmpPath
+            :type fsync: bool
+            :param fsync: fsync before the rename, the service default if None
+
+            :return: resolves to path once the file is in place, or to the exception
+            :rtype: concurrent.futures.Future
+        """
+
+        if not self._slots.acquire(blocking = False):
+            logger.warning(f"Export queue full ({self.maxQueued} pending), waiting for the disk")
+            self._slots.acquire()
+        fsync = self.fsync if fsync is None else fsync
+        try:
+            future = self._executor().submit(self._write, path, write, fsync)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._done(path, f))
+        return future
+
+
+    def savetxt(self, path, array, fsync = None, **kwargs):
+
+        """
+            np.savetxt in the background, kwargs as for np.savetxt (header, delimiter ...).
+            The array is copied, the caller may reuse its buffer.
+        """
+
+        array = np.array(array)
+        return self.submit(path, lambda tmpFile: np.savetxt(tmpFile, array, **kwargs), fsync)
+
+
+    def saveTDSBinary(self, path, time, amp, header, fsync = None, delimiter = '\t'):
+
+        """
+            MenloParser.writeTDSBinary in the background, the compact alternative to savetxt.
+        """
+
+        time, amp = np.array(time), np.array(amp)
+
+        def write(tmpFile):
+            with open(tmpFile, 'wb') as f:
+                writeTDSBinary(f, time, amp, header, delimiter)
+
+        return self.submit(path, write, fsync)
+
+
+    def writeText(self, path, text, fsync = None):
+
+        def write(tmpFile):
+            with open(tmpFile, 'w') as f:
+                f.write(text)
+
+        return self.submit(path, write, fsync)
+
+
+    def toCsv(self, df, path, fsync = None, **kwargs):
+
+        """
+            DataFrame.to_csv in the background. The frame must not be modified until the future is done.
+        """
+
+        return self.submit(path, lambda tmpFile: df.to_csv(tmpFile, **kwargs), fsync)
+
+
+    def toPickle(self, df, path, fsync = None):
+
+        return self.submit(path, lambda tmpFile: df.to_pickle(tmpFile, compression = None), fsync)
+
+
+    def saveImage(self, image, path, fmt = None, fsync = None):
+
+        """
+            Save a QImage rendered on the GUI thread, e.g. ImageExporter.export(toBytes = True).
+            QImage (unlike QPixmap) may be written from a worker thread.
+
+            :type fmt: str
+            :param fmt: image format, from the path extension if None
+        """
+
+        fmt = fmt or os.path.splitext(path)[1][1:].upper()
+
+        def write(tmpFile):
+            if not image.save(tmpFile, fmt):
+                raise OSError(f"QImage.save failed for {path}")
+
+        return self.submit(path, write, fsync)
+
+
+    @staticmethod
+    async def wait(future):
+
+        """
+            Await an export in a coroutine without blocking the event loop.
+
+            :return: path of the written file
+            :rtype: str
+        """
+
+        return await asyncio.wrap_future(future)
+
+
+    def shutdown(self, wait = True):
+
+        """
+            Finish (wait = True) the queued exports and stop the threads. The service restarts on the next submit.
+        """
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait = wait)
+
+
+defaultExportService = ExportService()    # shared by all experiments
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FrameScheduler:
+
+    """
+        Frame start times of a timelapse on the monotonic clock.
+
+        Every frame has an absolute target time (offset from the start of the session), so
+        acquisition time and event loop latency do not accumulate into drift. The expected
+        acquisition time is learned from the frames so far, and each frame is started half
+        of it early, so it is centred on its target. A frame that is already late starts
+        immediately and the schedule is not shifted. The deviation of every frame centre
+        from its target is kept as the achieved jitter. The first frame (of a session or a
+        resumed session) starts without a lead, as its acquisition time is not known yet,
+        so it is left out of the jitter statistics.
+
+        Schedules:
+            uniform: one frame every interval
+            log:     log spaced from firstInterval, over the span of the uniform schedule
+            burst:   burstFrames frames every firstInterval, then every interval
+    """
+
+    schedules = ('uniform', 'log', 'burst')
+    lateTolerance = 0.1         # s a frame may start late before a warning is logged
+
+    def __init__(self, offsets, centre = True, clock = time.monotonic):
+
+        """
+            :type offsets: array like
+            :param offsets: frame target times (s) from the session start, increasing
+            :type centre: bool
+            :param centre: start frames half the expected acquisition time early
+            :type clock: callable
+            :param clock: monotonic time in seconds
+        """
+
+        self.offsets = np.asarray(offsets, dtype = float)
+        if np.any(np.diff(self.offsets) < 0):
+            raise ValueError("Frame offsets must be increasing")
+        self.centre = centre
+        self.clock = clock
+        self.t0 = None                                         # clock time of offset 0
+        self.acquisitionTime = None                            # running mean acquisition time (s)
+        self.started = np.full(len(self.offsets), np.nan)     # clock time each frame started, from t0
+        self.finished = np.full(len(self.offsets), np.nan)    # clock time each frame finished, from t0
+        self.centred = np.zeros(len(self.offsets), dtype = bool) # frame started with a known lead
+
+
+    def __len__(self):
+
+        return len(self.offsets)
+
+
+    @classmethod
+    def uniform(cls, interval, frames, **kwargs):
+
+        return cls(np.arange(frames)*float(interval), **kwargs)
+
+
+    @classmethod
+    def logSpaced(cls, firstInterval, span, frames, **kwargs):
+
+        """
+            :type firstInterval: float
+            :param firstInterval: time between the first two frames (s)
+            :type span: float
+            :param span: time of the last frame (s)
+        """
+
+        if frames < 2:
+            return cls(np.zeros(frames), **kwargs)
+        firstInterval = min(float(firstInterval), float(span))
+        return cls(np.concatenate([[0.0], np.geomspace(firstInterval, span, frames - 1)]), **kwargs)
+
+
+    @classmethod
+    def burst(cls, burstInterval, burstFrames, interval, frames, **kwargs):
+
+        """
+            :type burstInterval: float
+            :param burstInterval: time between frames of the burst (s)
+            :type burstFrames: int
+            :param burstFrames: frames in the initial burst
+            :type interval: float
+            :param interval: time between the remaining frames (s)
+        """
+
+        if frames < 1:
+            return cls(np.zeros(0), **kwargs)
+        steps = np.where(np.arange(1, frames) < burstFrames, float(burstInterval), float(interval))
+        return cls(np.concatenate([[0.0], np.cumsum(steps)]), **kwargs)
+
+
+    @classmethod
+    def fromConfig(cls, schedule, interval, frames, firstInterval = None, burstFrames = 0, **kwargs):
+
+        """
+            :type schedule: str
+            :param schedule: one of FrameScheduler.schedules
+            :type interval: float
+            :param interval: frame interval (s), the late interval of burst schedules
+            :type firstInterval: float
+            :param firstInterval: first interval of log and burst schedules (s), interval if None
+
+            :rtype: FrameScheduler
+        """
+
+        firstInterval = interval if firstInterval is None else firstInterval
+        if schedule == 'uniform':
+            return cls.uniform(interval, frames, **kwargs)
+        if schedule == 'log':
+            return cls.logSpaced(firstInterval, interval*(frames - 1), frames, **kwargs)
+        if schedule == 'burst':
+            return cls.burst(firstInterval, burstFrames, interval, frames, **kwargs)
+        raise ValueError(f"Unknown schedule '{schedule}', expected one of {cls.schedules}")
+
+
+    def start(self, frame = 0):
+
+        """
+            Start the schedule now, at the target time of frame (e.g. of the first frame not yet saved when a session is resumed).
+        """
+
+        self.t0 = self.clock() - self.offsets[frame]
+
+
+    def now(self):
+
+        return self.clock() - self.t0
+
+
+    def lead(self):
+
+        """
+            :return: how early a frame is started (s), half the expected acquisition time
+            :rtype: float
+        """
+
+        if not self.centre or self.acquisitionTime is None:
+            return 0.0
+        return self.acquisitionTime/2
+
+
+    def delay(self, frame):
+
+        """
+            :return: time (s) until the frame should be started, negative if it is late
+            :rtype: float
+        """
+
+        return self.offsets[frame] - self.lead() - self.now()
+
+
+    async def wait(self, frame):
+
+        """
+            Sleep until the frame should be started.
+        """
+
+        delay = self.delay(frame)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -self.lateTolerance:
+            logger.warning(f"Frame {frame} starts {-delay:.2f} s late, the acquisition is longer than its interval")
+
+
+    def frameStarted(self, frame):
+
+        self.started[frame] = self.now()
+        self.centred[frame] = not self.centre or self.acquisitionTime is not None
+
+
+    def frameFinished(self, frame):
+
+        """
+            Record the end of the frame acquisition and update the expected acquisition time.
+
+            :return: deviation of the frame centre from its target (s)
+            :rtype: float
+        """
+
+        self.finished[frame] = self.now()
+        duration = float(self.finished[frame] - self.started[frame])
+        n = np.count_nonzero(~np.isnan(self.finished))
+        self.acquisitionTime = duration if self.acquisitionTime is None else self.acquisitionTime + (duration - self.acquisitionTime)/n
+        return (self.started[frame] + self.finished[frame])/2 - self.offsets[frame]
+
+
+    def jitter(self):
+
+        """
+            :return: deviation of the frame centres from their targets (s), NaN for frames not acquired
+                     and for frames started before the acquisition time was known
+            :rtype: numpy array
+        """
+
+        jitter = (self.started + self.finished)/2 - self.offsets
+        jitter[~self.centred] = np.nan
+        return jitter
+
+
+    def summary(self):
+
+        """
+            :return: frames in the statistics, mean, standard deviation and max absolute jitter (s), mean acquisition time (s)
+            :rtype: dict
+        """
+
+        jitter = self.jitter()
+        jitter = jitter[~np.isnan(jitter)]
+        if len(jitter) == 0:
+            return {'frames': 0, 'mean': None, 'std': None, 'max': None, 'acquisitionTime': self.acquisitionTime}
+        return {'frames': len(jitter), 'mean': float(jitter.mean()), 'std': float(jitter.std()),
+                'max': float(np.abs(jitter).max()), 'acquisitionTime': self.acquisitionTime}
@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+
+
+class FrameStore:
+
+    """
+        Columnar in-memory store for the frames of a session (e.g. TheaTimelapse).
+
+        Pulse and spectrum rows go into preallocated 2-D arrays, per frame scalars into typed
+        1-D columns and axes shared by every frame (time, freq) are kept once. Appending a
+        frame copies only that frame. Capacity grows geometrically if more frames arrive than
+        it was sized for, and a DataFrame is only built when toDataFrame is called.
+
+        As a ring the store keeps only the last capacity frames, e.g. for display while the
+        session is streamed to a dataset, so memory does not grow with the session length.
+    """
+
+    def __init__(self, capacity, axes = ('time', 'freq'), arrays = ('amp', 'FFT'), scalars = None, ring = False):
+
+        """
+            :type capacity: int
+            :param capacity: expected number of frames e.g. the requested frames, bounded by maxFrames
+            :type axes: tuple
+            :param axes: columns shared by every frame, stored once
+            :type arrays: tuple
+            :param arrays: array columns stored as one row per frame
+            :type scalars: dict
+            :param scalars: scalar column name -> numpy dtype
+            :type ring: bool
+            :param ring: keep only the last capacity frames instead of growing
+        """
+
+        self.ring = ring
+        self.capacity = max(int(capacity), 1 if ring else 0)
+        self.axes = {name: None for name in axes}              # shared axis arrays, set by the first frame
+        self.arrayNames = tuple(arrays)
+        self.scalarTypes = dict(scalars or {})
+        self._arrays = {name: None for name in self.arrayNames}   # (capacity, length) arrays, allocated on first append
+        self._scalars = {name: self._emptyScalar(dtype, self.capacity) for name, dtype in self.scalarTypes.items()}
+        self.count = 0                                         # frames held
+        self.first = 0                                         # slot of the oldest frame, moves once a ring is full
+        self.total = 0                                         # frames appended since the last clear
+
+
+    def __len__(self):
+
+        return self.count
+
+
+    @staticmethod
+    def _emptyScalar(dtype, n):
+
+        dtype = np.dtype(dtype)
+        if dtype.kind == 'f':
+            return np.full(n, np.nan, dtype = dtype)
+        if dtype.kind == 'M':
+            return np.full(n, np.datetime64('NaT'), dtype = dtype)
+        return np.zeros(n, dtype = dtype)
+
+
+    def _grow(self, needed):
+
+        capacity = max(needed, 2*self.capacity, 1)
+        for name, array in self._arrays.items():
+            if array is not None:
+                grown = np.empty((capacity,) + array.shape[1:], dtype = array.dtype)
+                grown[:self.count] = array[:self.count]
+                self._arrays[name] = grown
+        for name, column in self._scalars.items():
+            grown = self._emptyScalar(column.dtype, capacity)
+            grown[:self.count] = column[:self.count]
+            self._scalars[name] = grown
+        self.capacity = capacity
+
+
+    def append(self, **frame):
+
+        """
+            Add one frame. Axis, array and scalar columns are passed by name, missing scalars are
+            stored as NaN/ NaT/ 0.
+
+            :raises ValueError: an axis differs from the first frame, or an array row changes length
+        """
+
+        for name in self.axes:
+            value = np.asarray(frame[name])
+            if self.axes[name] is None:
+                self.axes[name] = value.copy()
+            elif value.shape != self.axes[name].shape or not np.array_equal(value, self.axes[name]):
+                raise ValueError(f"Frame {self.count} has a different '{name}' axis than the session")
+        if self.ring and self.count == self.capacity:
+            i = self.first
+            self.first = (self.first + 1) % self.capacity
+        else:
+            if self.count >= self.capacity:
+                self._grow(self.count + 1)
+            i = self.count
+        for name in self.arrayNames:
+            value = np.asarray(frame[name])
+            array = self._arrays[name]
+            if array is None or (self.total == 0 and value.shape != array.shape[1:]):
+                array = self._arrays[name] = np.empty((self.capacity,) + value.shape, dtype = value.dtype)
+            elif value.shape != array.shape[1:]:
+                raise ValueError(f"Frame {i} '{name}' has shape {value.shape}, expected {array.shape[1:]}")
+            array[i] = value
+        for name, column in self._scalars.items():
+            value = frame.get(name)
+            column[i] = value if value is not None else self._emptyScalar(column.dtype, 1)[0]
+        self.count = min(self.count + 1, self.capacity) if self.ring else self.count + 1
+        self.total += 1
+
+
+    def _order(self):
+
+        """
+            Slots of the held frames, oldest first.
+        """
+
+        if self.first == 0:
+            return slice(0, self.count)
+        return np.roll(np.arange(self.count), -self.first)
+
+
+    def column(self, name):
+
+        """
+            :return: view of an array (frames x length) or scalar column over the stored frames, or a shared axis.
+                     A copy in frame order once a ring has wrapped around.
+            :rtype: numpy array
+        """
+
+        if name in self.axes:
+            return self.axes[name]
+        if name in self._arrays:
+            array = self._arrays[name]
+            return np.empty((0, 0)) if array is None else array[self._order()]
+        return self._scalars[name][self._order()]
+
+
+    def __getitem__(self, name):
+
+        return self.column(name)
+
+
+    def row(self, i):
+
+        """
+            :type i: int
+            :param i: frame index, negative from the end
+
+            :return: all columns of one frame
+            :rtype: dict
+        """
+
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(f"Frame {i} out of range ({self.count} frames)")
+        i = (self.first + i) % self.capacity
+        frame = dict(self.axes)
+        frame.update({name: self._arrays[name][i] for name in self.arrayNames})
+        frame.update({name: column[i] for name, column in self._scalars.items()})
+        return frame
+
+
+    def clear(self):
+
+        """
+            Forget all frames, the allocated arrays are reused by the next session if the frames keep their length.
+        """
+
+        self.count = 0
+        self.first = 0
+        self.total = 0
+        self.axes = {name: None for name in self.axes}
+        for name, column in self._scalars.items():
+            column[:] = self._emptyScalar(column.dtype, len(column))
+
+
+    def toDataFrame(self):
+
+        """
+            One row per frame with the axis and array columns as per row arrays (views, not copies),
+            as the results DataFrame of the experiments.
+
+            :rtype: pandas DataFrame
+        """
+
+        data = {name: self.column(name) for name in self.scalarTypes}
+        for name in list(self.axes) + list(self.arrayNames):
+            values = self.column(name)
+            cells = np.empty(self.count, dtype = object)
+            for i in range(self.count):
+                cells[i] = values if name in self.axes else values[i]
+            data[name] = cells
+        return pd.DataFrame(data)
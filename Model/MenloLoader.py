@@ -1,24 +1,43 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import csv
 import numpy as np
-import datetime
-from scipy import signal as sgnl
+from SpectralEngine import SpectralEngine
+from MenloParser import readTDS, readHeader
+from TDSCache import TDSCache
+from PulseDataset import PulseDataset, PulseDatasetWriter
+
+
+def _loadChunk(paths, unwrap, cache):
+
+    """
+        Process pool worker: parse and transform one chunk of files.
+
+        :return: data and header metadata of the files
+        :rtype: tuple(pandas DataFrame, list of dict)
+    """
+
+    loader = MenloLoader(paths, unwrap = unwrap, cache = cache)
+    return loader.data, loader.meta
 
 
 class MenloLoader:
 
-    def __init__(self, src_flist, config = None):
+    def __init__(self, src_flist, config = None, unwrap = False, cache = None):
 
         self.src_flist = src_flist
+        self.unwrap = unwrap                     # add unwrapped phase and group delay columns
         self.win = 400
         self.config = config
+        self.engine = SpectralEngine()
+        if cache is True:
+            cache = TDSCache()
+        self.cache = cache                       # optional TDSCache for the parsed files and their spectra
+        self.cachedSpectra = []                  # cached complex spectrum per file, None if not cached
         self.src_TDS, self.dtlist = self.FileLoader(self.src_flist)
         self.data = self.get_data(self.src_flist, self.src_TDS, self.dtlist)
-        FD = pd.DataFrame()
-        for i in range(len(self.data)):
-            FD = pd.concat([FD,self.get_FD(self.data.loc[i]['time'],
-                                            self.data.loc[i]['amp'])],
-                                            axis = 0).reset_index(drop = True)
+        FD = self.get_FD_frames(self.data, unwrap = self.unwrap)
         self.data = pd.concat([FD, self.data], axis = 1) 
 
   
@@ -29,59 +48,133 @@ class MenloLoader:
         return idx, array[idx] 
 
 
-    def get_FD(self,time, TDS_signal): 
-
-        c_FFT = []
-        # Pad zeros on the time signal to reach this length
-        t_ser_len = 16384
-        phase = []
-        e_time = time
-        e_amp = TDS_signal
-        T = e_time[1]-e_time[0]                      
-        e_time = e_time - time[0]
-        N0 = len(e_time)
-        # e_time = e_time[:(self.find_nearest(e_time, self.win)[0])]                   
-        # e_amp = e_amp[:(self.find_nearest(e_time, self.win)[0])]
-        N = len(e_time)              
-        w = sgnl.tukey(N, alpha = 0.1) 
-
-        e_amp = w*(e_amp)                                     
-           
-        pad = t_ser_len - N  
-        e_time = np.append(e_time, np.zeros(pad))          
-        e_amp = np.append(e_amp, np.zeros(pad))
-        N0 = len(e_time)
-
-        freq = np.fft.fftfreq(N0, T)
-        zero_THz_idx = self.find_nearest(freq, 0)[0]
-        freq= freq[zero_THz_idx:int(len(freq)/2)]
-        e_FFT = np.fft.fft(e_amp)/(N0/2)   
-        e_FFT = e_FFT[zero_THz_idx:int(len(e_FFT)/2)]     
-        FFT = np.abs(e_FFT)
-        
-        for j in range(len(e_FFT)):
-            phase.append(np.arctan2(e_FFT[j].imag,e_FFT[j].real))
-        phase = np.array(phase)
-        start = self.find_nearest(freq,0)[0]
-        stop = self.find_nearest(freq,4)[0]
-        slc_freq = freq[start:stop]
-        phase = phase[start:stop]
-        slc_FFT = FFT[start:stop]                        
-        p_freq = slc_freq
-        phase = phase
-        c_FFT.append({'freq':freq,
-                        'FFT': FFT, 'c_FFT': e_FFT,
-                        'p_freq' : p_freq ,
-                        'phase' : phase,'slc_FFT' : slc_FFT})
-        c_FFT = pd.DataFrame(c_FFT)
-        return c_FFT
+    def get_FD(self, time, TDS_signal, unwrap = False): 
+
+        """
+            Spectrum of a single pulse.
+
+            :type time: numpy array
+            :param time: time axis of the pulse (ps)
+            :type TDS_signal: numpy array
+            :param TDS_signal: pulse amplitude
+            :type unwrap: bool
+            :param unwrap: also return the unwrapped phase and group delay over 0 - 4 THz
+
+            :return: one row DataFrame with the spectra of the pulse
+            :rtype: pandas DataFrame
+        """
+
+        FD = self.get_FD_batch(time, TDS_signal, unwrap = unwrap)
+        c_FFT = {'freq': FD['freq'], 'FFT': FD['FFT'][0], 'c_FFT': FD['c_FFT'][0],
+                 'p_freq': FD['p_freq'], 'phase': FD['phase'][0], 'slc_FFT': FD['slc_FFT'][0]}
+        if unwrap:
+            c_FFT['uphase'] = FD['uphase'][0]
+            c_FFT['groupDelay'] = FD['groupDelay'][0]
+        return pd.DataFrame([c_FFT])
             
 
+    def get_FD_batch(self, time, amps, unwrap = False):
+
+        """
+            Spectra of a stack of equal length pulses sharing one time axis, in one transform.
+
+            :type time: numpy array
+            :param time: common time axis of the pulses (ps)
+            :type amps: numpy array
+            :param amps: 2-D array of pulses, one pulse per row.
+            :type unwrap: bool
+            :param unwrap: also return the unwrapped phase (rad) and group delay (ps) over 0 - 4 THz
+
+            :return: freq, magnitude, complex and phase spectra (one row per pulse), 
+                     plus the 0 - 4 THz slices used by get_FD.
+            :rtype: dict
+        """
+
+        T = time[1]-time[0]
+        freq, e_FFT = self.engine.batch(amps, T)
+        return self.spectralProducts(freq.copy(), e_FFT, self.engine.plan(len(time), T), unwrap = unwrap)
+
+
+    def spectralProducts(self, freq, e_FFT, plan, unwrap = False):
+
+        """
+            Magnitude, phase and 0 - 4 THz slices derived from a stack of complex spectra.
+
+            :type freq: numpy array
+            :param freq: frequency axis (THz)
+            :type e_FFT: numpy array
+            :param e_FFT: complex spectra, one row per pulse
+            :type plan: SpectralPlan
+            :param plan: plan the spectra were computed with, provides the cached band indices
+            :type unwrap: bool
+            :param unwrap: also return the unwrapped phase (rad) and group delay (ps)
+
+            :return: spectra as returned by get_FD_batch
+            :rtype: dict
+        """
+
+        start, stop = plan.bandIndices(0, 4)
+        FFT = np.abs(e_FFT)
+        phase = np.angle(e_FFT[:, start:stop])
+        FD = {'freq': freq, 'FFT': FFT, 'c_FFT': e_FFT,
+              'p_freq': freq[start:stop], 'phase': phase,
+              'slc_FFT': FFT[:, start:stop]}
+        if unwrap:
+            FD['uphase'] = np.unwrap(phase, axis = 1)
+            FD['groupDelay'] = -np.gradient(FD['uphase'], FD['p_freq'], axis = 1)/(2*np.pi)
+        return FD
+
+
+    def get_FD_frames(self, data, unwrap = False):
+
+        """
+            Frequency domain DataFrame for all loaded pulses, one row per pulse in the same order as data.
+            Pulses are grouped by time axis geometry and each group is transformed as one batch.
+
+            :type data: pandas DataFrame
+            :param data: time domain data with 'time' and 'amp' columns
+            :type unwrap: bool
+            :param unwrap: also add unwrapped phase and group delay columns
+
+            :return: DataFrame with the columns returned by get_FD
+            :rtype: pandas DataFrame
+        """
+
+        cols = ['freq', 'FFT', 'c_FFT', 'p_freq', 'phase', 'slc_FFT']
+        if unwrap:
+            cols += ['uphase', 'groupDelay']
+        rows = [None]*len(data)
+        groups = {}
+        for i in range(len(data)):
+            time = data['time'].iloc[i]
+            key = (len(time), time[1]-time[0])
+            groups.setdefault(key, []).append(i)
+        for idx in groups.values():
+            time = data['time'].iloc[idx[0]]
+            plan = self.engine.plan(len(time), time[1]-time[0])
+            cached = [self.cachedSpectra[i] if i < len(self.cachedSpectra) else None for i in idx]
+            if all(c is not None for c in cached):
+                FD = self.spectralProducts(cached[0][0], np.vstack([c[1] for c in cached]), plan, unwrap = unwrap)
+            else:
+                FD = self.get_FD_batch(time, np.vstack([data['amp'].iloc[i] for i in idx]), unwrap = unwrap)
+                if self.cache is not None:
+                    specKey = (self.engine.padLength, self.engine.alpha)
+                    for k, i in enumerate(idx):
+                        self.cache.saveSpectrum(self.src_flist[i], FD['freq'], FD['c_FFT'][k], specKey)
+            for k, i in enumerate(idx):
+                rows[i] = (FD['freq'], FD['FFT'][k], FD['c_FFT'][k],
+                           FD['p_freq'], FD['phase'][k], FD['slc_FFT'][k])
+                if unwrap:
+                    rows[i] += (FD['uphase'][k], FD['groupDelay'][k])
+        return pd.DataFrame(rows, columns = cols)
+
+
     def get_data(self, src_flist, src_TDS, dtlist):
 
         for i in range(len(src_flist)):
-            name = src_flist[i].split("\\")[-1].split(".")[0]
+            name = os.path.basename(src_flist[i].split("\\")[-1]).split(".")[0]
             attrs = name.split("_")
+            Type, sensor_id = None, None           # files outside the reference naming scheme e.g. in a mixed export folder
             if "Reference" in name:
                 Type = "Reference"
                 sensor_id = attrs[4]
@@ -92,51 +185,252 @@ class MenloLoader:
         return data
 
 
-    def FileLoader(self, src_flist):
+    def FileLoader(self, src_flist, dtype = np.float64):
+
+        """
+            Parse each file once, collecting the TDS data and the header timestamp in the same pass.
+
+            :type src_flist: list
+            :param src_flist: file paths
+            :type dtype: numpy dtype
+            :param dtype: float32 or float64 output arrays
+
+            :return: TDS dictionaries and timestamps
+            :rtype: list, list
+        """
 
         src_TDS = []
         dtlist = []
-        #Look for TDS files and save paths to arrays
-        src_TDS = self.getTDS(src_flist, src_TDS)
-        dtlist = self.getDatetime(src_flist, dtlist)
+        self.meta = []
+        self.cachedSpectra = []
+        specKey = (self.engine.padLength, self.engine.alpha)
+        for path in src_flist:
+            if self.cache is not None:
+                tds = self.cache.load(path, dtype = dtype)
+            else:
+                tds = readTDS(path, dtype = dtype)
+            time = tds['time'] - tds['time'][0]
+            src_TDS.append({'time': time, 'amp': tds['amp']})
+            dtlist.append(tds['meta']['timestamp'])
+            self.meta.append(tds['meta'])
+            if 'c_FFT' in tds and tds['specKey'] == specKey:
+                self.cachedSpectra.append((tds['freq'], tds['c_FFT']))
+            else:
+                self.cachedSpectra.append(None)
         return src_TDS, dtlist    
 
 
-    def getTDS(self,src_flist, des_TDS):   
+    def getTDS(self,src_flist, des_TDS, dtype = np.float64):   
 
-        for j in range(len(src_flist)):
-            e_time = []
-            e_amp = []
-            with open(src_flist[j]) as csvfile: 
-                reader = csv.reader(csvfile, delimiter ='\t')
-                for k in range(5): next(reader)
-                for row in reader:
-                    e_time.append(float(row[0]))
-                    e_amp.append(float(row[1]))           
-                e_time = np.array(e_time) - e_time[0]        
-                des_TDS.append({'time':np.array(e_time), 'amp':np.array(e_amp)})
+        """
+            Append the TDS data of each file to des_TDS. Time axis is offset to start at 0 ps.
+        """
+
+        for path in src_flist:
+            tds = readTDS(path, dtype = dtype)
+            tds['time'] -= tds['time'][0]
+            des_TDS.append({'time': tds['time'], 'amp': tds['amp']})
         return des_TDS
     
 
     def getDatetime(self, filesrclist, dtlist):    
 
-        for j in range(len(filesrclist)):
-            with open(filesrclist[j]) as dtr: 
-                for com in dtr:
-                    if com.startswith('#') and "Timestamp" in com and 'wafer' not in com:
-                        dtlist.append(
-                                      datetime.datetime.strptime(com.split('Timestamp')[1]\
-                                                                 .split('\n')[0][2:],
-                                                                '%Y-%m-%dT%H:%M:%S'))                   
-                    elif com.startswith('#') and "Timestamp" in com and 'wafer' in com:
-                        try:
-                            dtlist.append(
-                                          datetime.datetime.strptime(com.split('Timestamp')[1].split(',')[0] \
-                                                                 .split('\n')[0][2:][2:],
-                                                                '%Y-%m-%dT%H:%M:%S'))                   
-                        except ValueError:                                                            
-                            print("Incorrect file type")
+        """
+            Append the header timestamp of each file to dtlist, None when the header has no timestamp.
+        """
 
+        for path in filesrclist:
+            dtlist.append(readHeader(path)['timestamp'])
         return dtlist
 
-    
+
+    @staticmethod
+    def discover(directory, pattern = "*.txt", recursive = False):
+
+        """
+            Find TDS files in a directory and order them by header timestamp.
+            Only the header lines of each file are read.
+
+            :type directory: str
+            :param directory: export directory e.g. Export/<date>/ or a QC session qcSaveDir
+            :type pattern: str
+            :param pattern: glob pattern for the data files
+            :type recursive: bool
+            :param recursive: also search sub directories
+
+            :return: file paths in timestamp order (files without a timestamp last, by name)
+            :rtype: list
+        """
+
+        if recursive:
+            paths = glob.glob(os.path.join(directory, "**", pattern), recursive = True)
+        else:
+            paths = glob.glob(os.path.join(directory, pattern))
+        keyed = []
+        for path in paths:
+            timestamp = readHeader(path)['timestamp']
+            keyed.append((timestamp is None, timestamp or 0, path))
+        keyed.sort()
+        return [path for _, _, path in keyed]
+
+
+    @classmethod
+    def iterDirectory(cls, directory, pattern = "*.txt", recursive = False, processes = None, 
+                      chunkSize = 64, unwrap = False, cache = None):
+
+        """
+            Load a whole directory across a process pool, yielding one DataFrame per chunk of files
+            in timestamp order. At most two chunks per worker are in flight, so memory stays bounded
+            by the chunk size rather than the directory size.
+
+            :type directory: str
+            :param directory: export directory e.g. Export/<date>/ or a QC session qcSaveDir
+            :type pattern: str
+            :param pattern: glob pattern for the data files
+            :type recursive: bool
+            :param recursive: also search sub directories
+            :type processes: int
+            :param processes: number of worker processes, None for all cores, 1 to load in this process
+            :type chunkSize: int
+            :param chunkSize: files parsed and transformed per task
+            :type unwrap: bool
+            :param unwrap: also add unwrapped phase and group delay columns
+            :type cache: bool or TDSCache
+            :param cache: load the files through a TDSCache
+
+            :return: generator of DataFrames with the same columns as MenloLoader.data
+            :rtype: generator
+        """
+
+        paths = cls.discover(directory, pattern, recursive)
+        return cls.iterFiles(paths, processes, chunkSize, unwrap, cache)
+
+
+    @classmethod
+    def iterFiles(cls, paths, processes = None, chunkSize = 64, unwrap = False, cache = None):
+
+        """
+            Load a list of files across a process pool, yielding one DataFrame per chunk
+            in the order of paths. See iterDirectory for the arguments.
+
+            :return: generator of DataFrames with the same columns as MenloLoader.data
+            :rtype: generator
+        """
+
+        for data, _ in cls._iterChunks(paths, processes, chunkSize, unwrap, cache):
+            yield data
+
+
+    @classmethod
+    def _iterChunks(cls, paths, processes, chunkSize, unwrap, cache):
+
+        """
+            :return: generator of (data, header metadata) per chunk of files, in the order of paths
+            :rtype: generator
+        """
+
+        chunks = [paths[i:i + chunkSize] for i in range(0, len(paths), chunkSize)]
+        if processes == 1:
+            for chunk in chunks:
+                yield _loadChunk(chunk, unwrap, cache)
+            return
+
+        maxPending = 2*(processes or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            pending = []
+            for chunk in chunks:
+                pending.append(pool.submit(_loadChunk, chunk, unwrap, cache))
+                if len(pending) >= maxPending:
+                    yield pending.pop(0).result()
+            while pending:
+                yield pending.pop(0).result()
+
+
+    @classmethod
+    def fromDirectory(cls, directory, pattern = "*.txt", recursive = False, processes = None, 
+                      chunkSize = 64, unwrap = False, cache = None):
+
+        """
+            Load a whole directory across a process pool into a single MenloLoader.
+            See iterDirectory for the arguments. The DataFrame is assembled once at the end.
+
+            :return: loader with data for all files in timestamp order
+            :rtype: MenloLoader
+        """
+
+        loader = cls([], unwrap = unwrap, cache = cache)
+        loader.src_flist = cls.discover(directory, pattern, recursive)
+        frames = []
+        for data, meta in cls._iterChunks(loader.src_flist, processes, chunkSize, unwrap, cache):
+            frames.append(data)
+            loader.meta.extend(meta)
+        if frames:
+            loader.data = pd.concat(frames, axis = 0, ignore_index = True)
+        loader.dtlist = [meta['timestamp'] for meta in loader.meta]
+        return loader
+
+
+    @classmethod
+    def fromIndex(cls, index, unwrap = False, cache = None, **criteria):
+
+        """
+            Load the files selected from an ArchiveIndex query, e.g.
+            MenloLoader.fromIndex(index, lot = "1", qcResult = "FAIL").
+
+            :type index: ArchiveIndex
+            :param index: header metadata index of the archive
+
+            :return: loader with data for the matching files in timestamp order
+            :rtype: MenloLoader
+        """
+
+        return cls(index.paths(**criteria), unwrap = unwrap, cache = cache)
+
+
+    @staticmethod
+    def openDataset(path):
+
+        """
+            Open a columnar pulse dataset written by the experiments or by toDataset. Nothing is
+            loaded up front, columns are memory mapped on first access.
+
+            :type path: str
+            :param path: dataset directory
+
+            :return: lazy dataset reader
+            :rtype: PulseDataset
+        """
+
+        return PulseDataset(path)
+
+
+    def toDataset(self, path, commitEvery = 256):
+
+        """
+            Convert the loaded files into a columnar pulse dataset. All pulses must share the
+            same time axis, which is stored once together with the frequency axis.
+
+            :type path: str
+            :param path: dataset directory
+            :type commitEvery: int
+            :param commitEvery: rows between index commits
+
+            :return: lazy reader for the written dataset
+            :rtype: PulseDataset
+        """
+
+        writer = PulseDatasetWriter(path, commitEvery = commitEvery, attrs = {'source': 'MenloLoader'})
+        if len(self.data):
+            writer.setShared('time', self.data['time'].iloc[0])
+            writer.setShared('freq', self.data['freq'].iloc[0])
+        for i in range(len(self.data)):
+            row = self.data.iloc[i]
+            meta = self.meta[i] if i < len(self.meta) else {}
+            timestamp = row['Datetime']
+            writer.append({'timestamp': np.datetime64('NaT', 'ns') if timestamp is None else timestamp,
+                           'sensorId': row['sensor_id'] or '',
+                           'qcResult': meta.get('qcResult') or '',
+                           'amp': row['amp'],
+                           'FFT': row['FFT']})
+        writer.close()
+        return PulseDataset(path)
@@ -0,0 +1,226 @@
+import ast
+import datetime
+import io
+import os
+import re
+import warnings
+import numpy as np
+
+
+# Header fields written by Menlo ScanControl and Experiment.makeHeader
+_headerFields = {'version': re.compile(r"Program Version ([\w.]+)"),
+                 'averages': re.compile(r"Average over (\d+) waveforms"),
+                 'start': re.compile(r"Start: (-?[\d.]+) ps"),
+                 'timestamp': re.compile(r"Timestamp: (\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})"),
+                 'lot': re.compile(r"Lot number: ([^,\n]*)"),
+                 'wafer': re.compile(r"wafer num: ([^,\n]*)"),
+                 'timeShift': re.compile(r"User time axis shift: (-?[\d.]+)"),
+                 'phi': re.compile(r"Phi: (-?[\d.]+)"),
+                 'qcParams': re.compile(r"QC Parameters: (\{.*\})")}
+
+# Fields encoded in the file name e.g. 22-04-20T144328_T_NIL_RH_NIL_PID_NIL_SN_1_PASS_Reference.txt
+_sensorIdPattern = re.compile(r"_SN_([^_.]+)")
+_qcResultPattern = re.compile(r"_(PASS|FAIL|None)_Reference")
+
+binaryExtension = ".npz"       # compressed binary TDS files, see writeTDSBinary
+
+
+def parseHeader(lines, path = None):
+
+    """
+        Extract metadata from the comment lines of a Menlo TDS file.
+
+        :type lines: list
+        :param lines: header lines, with or without the leading '#'
+        :type path: str
+        :param path: file path, used for the metadata that is only encoded in the file name
+
+        :return: metadata (missing fields are None)
+        :rtype: dict
+    """
+
+    text = "\n".join(line.lstrip('#').strip() for line in lines)
+    meta = {}
+    for key, pattern in _headerFields.items():
+        match = pattern.search(text)
+        meta[key] = match.group(1).strip() if match else None
+    if meta['averages'] is not None:
+        meta['averages'] = int(meta['averages'])
+    for key in ['start', 'timeShift', 'phi']:
+        if meta[key] is not None:
+            meta[key] = float(meta[key])
+    if meta['timestamp'] is not None:
+        meta['timestamp'] = datetime.datetime.strptime(meta['timestamp'], '%Y-%m-%dT%H:%M:%S')
+    if meta['qcParams'] is not None:
+        try:
+            meta['qcParams'] = ast.literal_eval(meta['qcParams'])
+        except (ValueError, SyntaxError):
+            pass                                               # keep the raw string
+
+    meta['sensorId'] = None
+    meta['qcResult'] = None
+    meta['Type'] = None
+    if path is not None:
+        name = os.path.basename(path)
+        match = _sensorIdPattern.search(name)
+        meta['sensorId'] = match.group(1) if match else None
+        match = _qcResultPattern.search(name)
+        meta['qcResult'] = match.group(1) if match else None
+        meta['Type'] = "Reference" if "Reference" in name else None
+    return meta
+
+
+def readHeader(path):
+
+    """
+        Read only the comment header of a Menlo TDS file.
+
+        :type path: str
+        :param path: path to the file
+
+        :return: metadata (see parseHeader)
+        :rtype: dict
+    """
+
+    if path.endswith(binaryExtension):
+        with np.load(path, allow_pickle = False) as data:     # only the header member is decompressed
+            return parseHeader(str(data['header']).splitlines(), path)
+    lines = []
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            lines.append(line)
+    return parseHeader(lines, path)
+
+
+def readTDS(path, dtype = np.float64):
+
+    """
+        Single pass loader for Menlo tab separated TDS files. The header and both
+        numeric columns are parsed in bulk, without a per row Python loop.
+        Binary files (binaryExtension) are read with parseTDSBinary.
+
+        :type path: str
+        :param path: path to the file
+        :type dtype: numpy dtype
+        :param dtype: float32 or float64 output
+
+        :return: time axis as stored in the file, amplitude and header metadata
+        :rtype: dict
+    """
+
+    if path.endswith(binaryExtension):
+        with open(path, 'rb') as f:
+            return parseTDSBinary(f.read(), path, dtype = dtype)
+    with open(path) as f:
+        text = f.read()
+    return parseTDS(text, path, dtype = dtype)
+
+
+def parseTDS(text, path = None, dtype = np.float64):
+
+    """
+        Parse the contents of a Menlo TDS file already read into memory (see readTDS).
+
+        :type text: str
+        :param text: file contents
+        :type path: str
+        :param path: file path, used for file name metadata and error messages
+        :type dtype: numpy dtype
+        :param dtype: float32 or float64 output
+
+        :return: time axis as stored in the file, amplitude and header metadata
+        :rtype: dict
+    """
+
+    bodyStart = 0
+    lines = []
+    while text.startswith('#', bodyStart):
+        lineEnd = text.find('\n', bodyStart)
+        if lineEnd < 0:
+            lineEnd = len(text)
+        lines.append(text[bodyStart:lineEnd])
+        bodyStart = lineEnd + 1
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)    # numpy warns instead of failing on bad text
+        try:
+            values = np.fromstring(text[bodyStart:], dtype = np.float64, sep = ' ')
+        except (DeprecationWarning, ValueError):
+            raise ValueError(f"Could not parse numeric data in {path}")
+    if values.size == 0 or values.size % 2:
+        raise ValueError(f"Expected two numeric columns in {path}")
+    values = values.reshape(-1, 2)
+    return {'time': np.ascontiguousarray(values[:, 0], dtype = dtype),
+            'amp': np.ascontiguousarray(values[:, 1], dtype = dtype),
+            'meta': parseHeader(lines, path)}
+
+
+def writeTDSBinary(f, time, amp, header, delimiter = '\t'):
+
+    """
+        Write a TDS pulse as a compressed binary file: the float64 arrays and the exact header text
+        of the Menlo text file. About a quarter of the text size and faster to write, binaryToText
+        restores the text file byte for byte.
+
+        :type f: str or file
+        :param f: path (binaryExtension is appended by numpy if missing) or binary file object
+        :type time: numpy array
+        :param time: time axis (ps)
+        :type amp: numpy array
+        :param amp: THz signal
+        :type header: str
+        :param header: header as passed to np.savetxt
+        :type delimiter: str
+        :param delimiter: column delimiter of the text layout
+    """
+
+    np.savez_compressed(f, time = np.asarray(time, dtype = np.float64), amp = np.asarray(amp, dtype = np.float64),
+                        header = np.array(header), delimiter = np.array(delimiter))
+
+
+def parseTDSBinary(raw, path = None, dtype = np.float64):
+
+    """
+        Parse the contents of a binary TDS file (see writeTDSBinary).
+
+        :type raw: bytes
+        :param raw: file contents
+        :type path: str
+        :param path: file path, used for file name metadata and error messages
+
+        :return: time axis, amplitude and header metadata as parseTDS
+        :rtype: dict
+    """
+
+    try:
+        with np.load(io.BytesIO(raw), allow_pickle = False) as data:
+            time, amp, header = data['time'], data['amp'], str(data['header'])
+    except (OSError, ValueError, KeyError) as e:
+        raise ValueError(f"Could not read binary TDS data in {path}: {e}")
+    return {'time': np.ascontiguousarray(time, dtype = dtype),
+            'amp': np.ascontiguousarray(amp, dtype = dtype),
+            'meta': parseHeader(header.splitlines(), path)}
+
+
+def binaryToText(path, out = None):
+
+    """
+        Convert a binary TDS file to the Menlo text layout, identical to the file np.savetxt
+        would have written at acquisition.
+
+        :type path: str
+        :param path: binary TDS file
+        :type out: str
+        :param out: text file, path with a .txt extension if None
+
+        :return: path of the text file
+        :rtype: str
+    """
+
+    with np.load(path, allow_pickle = False) as data:
+        time, amp, header, delimiter = data['time'], data['amp'], str(data['header']), str(data['delimiter'])
+    if out is None:
+        out = os.path.splitext(path)[0] + ".txt"
+    np.savetxt(out, np.vstack([time, amp]).T, header = header, delimiter = delimiter)
+    return out
@@ -0,0 +1,320 @@
+import asyncio
+import collections
+import fnmatch
+import logging
+import os
+import time
+import numpy as np
+from MenloLoader import MenloLoader
+from TDSCache import TDSCache
+from ResonanceEstimator import ResonanceEstimator
+
+logger = logging.getLogger(__name__)
+
+
+class MenloWatcher:
+
+    """
+        Incremental watcher for an export directory (e.g. Export/<date>/ folders written by
+        Experiment.saveAverageData).
+
+        The directory is polled and only new or modified files are passed to MenloLoader.
+        Running aggregates - mean magnitude spectrum, resonance drift and QC pass rate - are
+        updated from the new files alone, the history is never reloaded. The few spectra kept
+        per file let a modified file replace its previous contribution exactly.
+
+        In run() the directory scan and the parsing of new files run on a worker thread, only
+        the aggregate update runs on the event loop, so the watcher can share the GUI/
+        acquisition loop.
+    """
+
+    def __init__(self, directory, pattern = "*.txt", recursive = True, cache = None,
+                 resonanceBand = (0.71, 0.81), settle = 2, keepSpectra = 256, historyLength = 1000):
+
+        self.directory = directory
+        self.pattern = pattern
+        self.recursive = recursive
+        if cache is True:
+            cache = TDSCache()
+        self.cache = cache                                     # optional TDSCache shared by every poll
+        self.resonance = ResonanceEstimator(*resonanceBand)    # sub-bin resonance minimum in the band (THz)
+        self.settle = settle                                   # seconds a file must be unchanged before it is ingested
+        self.keepSpectra = keepSpectra                         # recent spectra kept to replace modified files
+        self.running = False                                   # flag for the run loop
+        self.reset(historyLength)
+
+
+    def reset(self, historyLength = None):
+
+        """
+            Forget all ingested files and aggregates.
+        """
+
+        if historyLength is None:
+            historyLength = self.history.maxlen
+        self.seen = {}                                         # path -> (mtime, size) of ingested files
+        self.contributions = {}                                # path -> (qcResult, timestamp, resonance, aggregated)
+        self.freq = None                                       # frequency axis of the mean spectrum
+        self.spectrumSum = None                                # running sum of magnitude spectra
+        self.count = 0                                         # spectra in the running sum
+        self.skipped = 0                                       # files with a different geometry, not aggregated
+        self.qcCounts = collections.Counter()                  # files per QC result
+        self.history = collections.deque(maxlen = historyLength)   # recent (timestamp, resonance) for display
+        self._fit = np.zeros(5)                                # n, Sx, Sy, Sxx, Sxy of resonance vs time (h)
+        self._t0 = None                                        # time origin of the drift fit
+        self._spectra = collections.OrderedDict()              # recent spectra per path
+        self._rebuildPending = False
+
+
+    @property
+    def meanSpectrum(self):
+
+        """
+            :return: frequency axis (THz) and mean magnitude spectrum of all ingested files
+            :rtype: numpy array, numpy array
+        """
+
+        if self.count == 0:
+            return None, None
+        return self.freq, self.spectrumSum/self.count
+
+
+    @property
+    def passRate(self):
+
+        """
+            :return: fraction of QC'd files that passed, None before the first QC file
+            :rtype: float
+        """
+
+        done = self.qcCounts['PASS'] + self.qcCounts['FAIL']
+        return self.qcCounts['PASS']/done if done else None
+
+
+    @property
+    def resonanceDrift(self):
+
+        """
+            Least squares slope of the resonance minimum over time.
+
+            :return: drift in THz per hour, None until two timestamps are available
+            :rtype: float
+        """
+
+        n, Sx, Sy, Sxx, Sxy = self._fit
+        denominator = n*Sxx - Sx*Sx
+        if n < 2 or abs(denominator) < 1e-12:
+            return None
+        return (n*Sxy - Sx*Sy)/denominator
+
+
+    def scan(self):
+
+        """
+            :return: paths of new or modified files that have settled
+            :rtype: list
+        """
+
+        now = time.time()
+        changed = []
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]    # skip sidecar caches e.g. .tdscache
+            for name in fnmatch.filter(files, self.pattern):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if self.seen.get(path) != (st.st_mtime_ns, st.st_size) and now - st.st_mtime >= self.settle:
+                    changed.append(path)
+            if not self.recursive:
+                break
+        return sorted(changed)
+
+
+    def _load(self, paths):
+
+        try:
+            return MenloLoader(paths, cache = self.cache)
+        except (ValueError, OSError):
+            loaders = []
+            for path in paths:                                 # isolate the unreadable file, retried next poll
+                try:
+                    loaders.append(MenloLoader([path], cache = self.cache))
+                except (ValueError, OSError) as e:
+                    logger.warning(f"Skipping {path}: {e}")
+            return loaders
+
+
+    def _retract(self, path):
+
+        """
+            Remove the previous contribution of a modified file. Returns False if its spectrum is no longer kept.
+        """
+
+        qcResult, timestamp, resonance, aggregated = self.contributions.pop(path)
+        if qcResult is not None:
+            self.qcCounts[qcResult] -= 1
+        if timestamp is not None:
+            x = (timestamp - self._t0).total_seconds()/3600
+            self._fit -= (1, x, resonance, x*x, x*resonance)
+        if not aggregated:
+            self.skipped -= 1
+            return True
+        spectrum = self._spectra.pop(path, None)
+        if spectrum is None:
+            return False
+        self.spectrumSum -= spectrum
+        self.count -= 1
+        return True
+
+
+    def _ingest(self, loader):
+
+        for i, path in enumerate(loader.src_flist):
+            row = loader.data.iloc[i]
+            meta = loader.meta[i]
+            freq, FFT = row['freq'], row['FFT']
+            if self.freq is None:
+                self.freq = freq
+                self.spectrumSum = np.zeros_like(FFT)
+            if path in self.contributions and not self._retract(path):
+                logger.info(f"{path} was modified after its spectrum was dropped, rebuilding aggregates")
+                self._rebuildPending = True
+                return
+            aggregated = len(freq) == len(self.freq) and np.allclose(freq, self.freq)
+            resonance = None
+            if not aggregated:
+                self.skipped += 1
+            else:
+                self.spectrumSum += FFT
+                self.count += 1
+                self._spectra[path] = FFT
+                if len(self._spectra) > self.keepSpectra:
+                    self._spectra.popitem(last = False)
+                resonance = self.resonance.estimateZoom(row['time'], row['amp'])
+            timestamp = meta['timestamp']
+            if timestamp is not None and resonance is not None:
+                if self._t0 is None:
+                    self._t0 = timestamp
+                x = (timestamp - self._t0).total_seconds()/3600
+                self._fit += (1, x, resonance, x*x, x*resonance)
+                self.history.append((timestamp, resonance))
+            else:
+                timestamp = None
+            qcResult = meta['qcResult'] if meta['qcResult'] in ('PASS', 'FAIL') else None
+            if qcResult is not None:
+                self.qcCounts[qcResult] += 1
+            self.contributions[path] = (qcResult, timestamp, resonance, aggregated)
+
+
+    def _collect(self):
+
+        """
+            File system part of a poll: scan the directory and parse the new and modified files.
+            No aggregate is changed, so it may run on a worker thread.
+
+            :return: loader and stat key per file of each chunk of loaded files
+            :rtype: list of (MenloLoader, dict)
+        """
+
+        paths = self.scan()
+        if not paths:
+            return []
+        loaded = self._load(paths)
+        collected = []
+        for loader in (loaded if isinstance(loaded, list) else [loaded]):
+            keys = {}
+            for path in loader.src_flist:
+                st = os.stat(path)
+                keys[path] = (st.st_mtime_ns, st.st_size)
+            collected.append((loader, keys))
+        return collected
+
+
+    def _apply(self, collected):
+
+        """
+            Update the aggregates from the files loaded by _collect.
+
+            :return: paths of the ingested files, None if a rebuild is needed
+            :rtype: list
+        """
+
+        ingested = []
+        for loader, keys in collected:
+            self.seen.update(keys)
+            self._ingest(loader)
+            if self._rebuildPending:
+                return None
+            ingested.extend(loader.src_flist)
+        if ingested:
+            logger.info(f"Ingested {len(ingested)} file(s) from {self.directory}")
+        return ingested
+
+
+    def poll(self):
+
+        """
+            Ingest new and modified files and update the running aggregates.
+
+            :return: paths of the ingested files
+            :rtype: list
+        """
+
+        ingested = self._apply(self._collect())
+        if ingested is None:
+            self.rebuild()
+            return list(self.seen)
+        return ingested
+
+
+    async def pollAsync(self):
+
+        """
+            poll() with the scan and file loading on a worker thread, the aggregates are updated on the event loop.
+
+            :return: paths of the ingested files
+            :rtype: list
+        """
+
+        loop = asyncio.get_event_loop()
+        ingested = self._apply(await loop.run_in_executor(None, self._collect))
+        if ingested is None:                                   # rebuild from the whole directory, also off the loop
+            self.reset()
+            await self.pollAsync()
+            return list(self.seen)
+        return ingested
+
+
+    def rebuild(self):
+
+        """
+            Recompute the aggregates from every file in the directory.
+        """
+
+        self.reset()
+        self.poll()
+
+
+    async def run(self, interval = 5, callback = None):
+
+        """
+            Poll the directory until stop() is called. Files are scanned and loaded on a worker thread.
+
+            :type interval: float
+            :param interval: seconds between polls
+            :type callback: callable
+            :param callback: called with the watcher after each poll that ingested files e.g. to refresh a dashboard
+        """
+
+        self.running = True
+        while self.running:
+            if await self.pollAsync() and callback is not None:
+                callback(self)
+            await asyncio.sleep(interval)
+
+
+    def stop(self):
+
+        self.running = False
@@ -1,5 +1,6 @@
 import sys
 import os
+import re
 
 
 from pyqtgraph.exporters import ImageExporter
@@ -13,6 +14,7 @@ from Model.experiment import *
 from Model.TemperatureSensor import *
 from Resources import ur
 from MenloLoader import MenloLoader
+from FrameStore import FrameStore
 import pandas as pd
 from PyQt5 import QtSerialPort
 
@@ -79,6 +81,7 @@ class TheaPolSweep(Experiment):
             
             self.initTemperatureSensor(self.loop, self.configFileName)
             self.serial = self.tempSensorModel.serial
+            self.robotLink = self.tempSensorModel.serialLink    # robot and temperature sensor share the port
         except Exception as e:
             print("Could not open serial device")
             raise e
@@ -115,6 +118,7 @@ class TheaPolSweep(Experiment):
         self.port = None                                      # Serial port name
         self.baudrate = None                                  # baudrate for serial communication  
         self.serial = None                                    # Serial object to communicate with robots
+        self.robotLink = None                                 # command/ ACK layer on the serial port
         self.lastMessage = None 
         self.angle1Lim = None                                # angle 1 limit
         self.angle2Lim = None                                # angle 2 limit  
@@ -155,7 +159,7 @@ class TheaPolSweep(Experiment):
         self.polSweepTask = None
         self.continuePolSweep = None              # flag to control/ suspend aqcuisition
         self.timelapseDone = False                 # flag to control progress
-        self.results = pd.DataFrame()                      # this will be the resulting dataFrame
+        self.frames = self.newFrameStore()         # frames of the sweep, as a DataFrame via frames.toDataFrame()
         self.GIFSourceNames = []                   # names of files to make a GIF out of
         self.timeout = None
         self.ackTask = None                         # wait for ack with timeout
@@ -173,37 +177,30 @@ class TheaPolSweep(Experiment):
         self.keepRunning = False                   # continue flag for temperature observations        
 
 
-    def initTemperatureSensor(self, loop, configFileName):
-        
-        """
-            Initialise MAX31855 sensor object
+    def newFrameStore(self, capacity = 0, ring = False):
+
         """
+            Empty frame store for a sweep of up to capacity frames.
 
-        self.tempSensorModel = MAXSerialTemp(loop, configFileName)
+            :type capacity: int
+            :param capacity: expected number of frames, the store grows beyond it if needed
+            :type ring: bool
+            :param ring: keep only the last capacity frames, when the sweep is streamed to a dataset
+            :rtype: FrameStore
+        """
 
+        return FrameStore(capacity, axes = ('time', 'freq'), arrays = ('amp', 'FFT'),
+                          scalars = {'frameNum': 'i8', 'datetime': 'M8[us]', 'phi': 'f8'}, ring = ring)
 
-    def findResonanceMinima(self,data):
 
+    def initTemperatureSensor(self, loop, configFileName):
+        
         """
-            Find the resonance minima in between 0.71 - 0.81 THz.
-            
-            data: this is the unsliced FFT array from the measurement
-
-            :return: resonance minima in THz.
-            :rtype: float
+            Initialise MAX31855 sensor object
         """
 
-        minList = []
-        f1 = 0.71
-        f2 = 0.81
-        x = self.freq
-        fStartId = self.mLoader.find_nearest(x, f1)[0]
-        fEndId = self.mLoader.find_nearest(x, f2)[0]
-        f = x[fStartId:fEndId]    
-        y = 20*np.log(np.abs(data))[fStartId:fEndId]
-        rMinima = f[np.argmin(y)]
-        return rMinima
-        
+        self.tempSensorModel = MAXSerialTemp(loop, configFileName)
+
 
 ##################################### AsyncSlot coroutines #######################################
 
@@ -227,7 +224,6 @@ class TheaPolSweep(Experiment):
         self.avgProgVal = int(self.device.scanControl.currentAverages/\
                                  self.device.scanControl.desiredAverages*100)
         
-        await asyncio.sleep(0.1)
         
  
     @asyncSlot()
@@ -244,16 +240,13 @@ class TheaPolSweep(Experiment):
             self.device.setDesiredAverages(numAvgs)
             print(f"special averaginig: {numAvgs}")
                 
-        await asyncio.sleep(1)
         self.device.keepRunning = True
         self.device.avgTask = asyncio.ensure_future(self.device.doAvgTask())
-        await asyncio.gather(self.device.avgTask)
-        while not self.device.isAveragingDone():
-            await asyncio.sleep(1)
+        await self.device.avgTask                    # resolved by the averaging progress notifications
+        await self.device.pulsesProcessed()
         if self.device.isAveragingDone():
             print(f"{self.device.scanControl.currentAverages}/{self.device.scanControl.desiredAverages}")
             print("DONE")
-            rawExportData = np.vstack([self.timeAxis, self.pulseAmp]).T
             currentDatetime = datetime.now()
 
             header = f"""THEA Phi Scan - RAM Group GmbH, powered by Menlo Systems\nProgram Version 0.2\nAverage over {self.numAvgs} waveforms. Start: {self.config['TScan']['begin']} ps, Timestamp: {currentDatetime.strftime('%Y-%m-%dT%H:%M:%S')}
@@ -261,16 +254,26 @@ class TheaPolSweep(Experiment):
     Time [ps]              THz Signal [mV]"""
             base_name = f"""{currentDatetime.strftime("%d%m%yT%H%M%S")}_{self.scanName}_data{self.numFramesDone+1:04d}"""
             exportPath = os.path.join(self.exportPath, base_name)
-            data_file = os.path.join(exportPath.replace("/","\\") +'.txt')
+            data_file = self.tdsPath(os.path.join(exportPath.replace("/","\\") +'.txt'))
             print(f"EXPORTED: {data_file}")
-            df = pd.DataFrame.from_dict({'frameNum': f"data{self.numFramesDone+1:04d}" , 'datetime': currentDatetime, 'time':self.timeAxis, 'amp':self.pulseAmp, 'freq' : self.freq, 'FFT': self.FFT}, orient='index')
-            df = df.transpose()
-            self.results = pd.concat([self.results, df], axis = 0).reset_index(drop = True)
+            self.frames.append(frameNum = self.numFramesDone+1,
+                               datetime = currentDatetime,
+                               phi = self.actualAngle,
+                               time = self.timeAxis,
+                               amp = self.pulseAmp,
+                               freq = self.freq,
+                               FFT = self.FFT)
+            self.appendToDataset({'frameNum': self.numFramesDone+1,
+                                  'timestamp': currentDatetime,
+                                  'phi': self.actualAngle,
+                                  'time': self.timeAxis,
+                                  'freq': self.freq,
+                                  'amp': self.pulseAmp,
+                                  'FFT': self.FFT})
             
-            np.savetxt(data_file, rawExportData, header = header, delimiter = '\t' )  
+            self.exportTDS(data_file, self.timeAxis, self.pulseAmp, header)
             self.numFramesDone +=1
-            
-            print(self.results.tail())
+            logger.debug(f"Frame {self.numFramesDone}: phi {self.actualAngle:.2f} deg")
 
             
 
@@ -279,23 +282,24 @@ class TheaPolSweep(Experiment):
 
         """Do a new scan"""
 
-        self.contactFreezer()
-        await self.waitOnRobot()
+        await self.waitOnRobot(self.contactFreezer())
         self.device.resetAveraging()
         await self.startAveraging()
-        self.liftFreezer()
-        await self.waitOnRobot()
+        await self.waitOnRobot(self.liftFreezer())
         
 
-    async def waitOnRobot(self):
+    async def waitOnRobot(self, future):
 
-        """Reusable block of code to log timeout for Ack"""
+        """Wait for the ACK to a robot command, log timeout for Ack
+
+            :type future: asyncio.Future
+            :param future: response future returned when the command was sent
+        """
         
-        logger.info(f"last message : {self.lastMessage}")
-        self.lastMessage = " "      #  clear previous ACK if any
         try:
-            self.ackTask = asyncio.create_task(self.waitForAck())
-            await asyncio.wait_for(self.ackTask, timeout = self.timeout)
+            self.ackTask = asyncio.ensure_future(self.robotLink.wait(future, timeout = self.timeout))
+            await self.ackTask
+            logger.info("ACK received")
 
         except asyncio.exceptions.TimeoutError:
             logger.error(f"[ERROR]: ACK not received")
@@ -328,6 +332,8 @@ class TheaPolSweep(Experiment):
                 logger.info("Cancelling Ack timer")
                 self.ackTask.cancel()   
                 self.ackTask.cancelled()
+            if self.robotLink is not None:
+                self.robotLink.clear(owner = self)       # the temperature sensor shares the link
 
             await self.device.stop()
             await asyncio.sleep(2)
@@ -339,35 +345,34 @@ class TheaPolSweep(Experiment):
 
         """Send command on serial to break freezer contact """
 
-        txt = "lift\n"
-        self.serial.write(txt.encode())
+        future = self.robotLink.send("lift", owner = self)
         self.freezerStatus.emit("lift")
+        return future
 
 
     def contactFreezer(self):
 
         """Send command on serial to make freezer contact """
 
-        txt = "contact\n"
-        self.serial.write(txt.encode())
+        future = self.robotLink.send("contact", owner = self)
         self.freezerStatus.emit("contact")
+        return future
 
 
     def ejectFreezer(self):
 
         """Send command on serial to eject freezer """
 
-        txt = "eject\n"
-        self.serial.write(txt.encode())
+        future = self.robotLink.send("eject", owner = self)
         self.freezerStatus.emit("eject")
+        return future
 
 
     def homeRobot(self):
 
         """Send command on serial to insert cartridge"""
 
-        txt = "home\n"
-        self.serial.write(txt.encode())
+        return self.robotLink.send("home", owner = self)
 
 
     def rotateHolder(self, angle):
@@ -375,49 +380,55 @@ class TheaPolSweep(Experiment):
         """Send command on serial to insert cartridge"""
         
         if angle == self.angle1:     
-            txt = f"rot+{angle:2f}\n"
-        else:
-            txt = f"rot-{angle:.2f}\n"
-        self.serial.write(txt.encode())
+            return self.robotLink.send(f"rot+{angle:2f}", owner = self)
+        return self.robotLink.send(f"rot-{angle:.2f}", owner = self)
 
 
     def goHome(self):
 
-        txt = f"rot+{abs(self.sweepArray[-1]):3f}\n"
-        self.serial.write(txt.encode())
+        return self.robotLink.send(f"rot+{abs(self.sweepArray[-1]):3f}", owner = self)
 
 
     async def getPosition(self):
 
         """Send command on serial to insert cartridge"""
         
-        txt = "pos\n"
-        self.serial.write(txt.encode())
-        await asyncio.sleep(0.5)
-        print(self.lastMessage)
-        self.currentPosition = self.lastMessage
+        try:
+            self.currentPosition = await self.robotLink.request("pos", timeout = 0.5, owner = self,
+                                                                expect = lambda line: re.fullmatch(r"[-+]?\d+(\.\d*)?", line))
+        except asyncio.exceptions.TimeoutError:
+            self.currentPosition = self.robotLink.lastMessage
+        logger.debug(f"Holder position: {self.currentPosition}")
 
     @asyncSlot()
     async def polSweepStart(self):
 
         try:
-            self.results = pd.DataFrame()
+            resume = f"*_{self.scanName}" if self.config['Export'].get('resume', False) else None
+            self.openDataset(f"{datetime.now():%y-%m-%dT%H%M%S}_{self.scanName}",
+                             attrs = {'scanName': self.scanName, 'angle1': self.angle1, 'angle2': self.angle2,
+                                      'frames': len(self.sweepArray)}, resume = resume)
+            if self.dataset is not None:    # frames are streamed to disk, only the displayed ones are kept
+                self.frames = self.newFrameStore(self.config['PolSweep'].get('numDisplayDataSeries', 5), ring = True)
+                self.numFramesDone = len(self.dataset)
+            else:
+                self.frames = self.newFrameStore(len(self.sweepArray))
+                self.numFramesDone = 0
+            start = self.numFramesDone
             self.polSweepDone = False
             self.continuePolSweep = True
             self.GIFSourceNames = [] 
             self.polSweepFinished.emit()   # emit this to check validity of the btn states
             
-            self.ejectFreezer()
-            await self.waitOnRobot()      # eject freezer for homing
+            await self.waitOnRobot(self.ejectFreezer())      # eject freezer for homing
             logger.info("Ejecting freezer")
 
-            self.homeRobot()          # home pol. holder
-            await self.waitOnRobot()
+            await self.waitOnRobot(self.homeRobot())      # home pol. holder
             logger.info("Homing complete. . .")
             
-            for i in range(len(self.sweepArray)):
-                if i == 0:
-                    self.requestedAngle =  self.sweepArray[i]
+            for i in range(start, len(self.sweepArray)):
+                if i == start:
+                    self.requestedAngle =  self.sweepArray[0]
                     interval = self.preChill + self.interval # wait time for freezing
                 else:
                     self.requestedAngle = abs(self.sweepArray[i-1] - self.sweepArray[i])
@@ -425,19 +436,16 @@ class TheaPolSweep(Experiment):
                 self.actualAngle = self.sweepArray[i]
                 print(f"Scan {i}/{len(self.sweepArray)}")
                 
-                self.rotateHolder(self.requestedAngle)
-                await self.waitOnRobot()
+                await self.waitOnRobot(self.rotateHolder(self.requestedAngle))
+                if i == start and i > 0:                     # resumed sweep, continue from the first angle not saved
+                    await self.waitOnRobot(self.rotateHolder(abs(self.sweepArray[0] - self.sweepArray[i])))
                 await self.getPosition()
 
-                self.contactFreezer()          # make first contact and wait for freezing
-                await self.waitOnRobot()
+                await self.waitOnRobot(self.contactFreezer())      # make first contact and wait for freezing
                 await asyncio.sleep(interval)
             
                 self.polSweepTask =  asyncio.ensure_future(self.newScan())
-                asyncio.gather(self.polSweepTask)
-
-                while not self.polSweepTask.done():
-                    await asyncio.sleep(1)
+                await self.polSweepTask
 
                 self.polSweepProgVal = int((i+1)/len(self.sweepArray)*100)
                 print(f"Pol. sweep progress: {self.polSweepProgVal} %")
@@ -451,27 +459,21 @@ class TheaPolSweep(Experiment):
             self.numFramesDone = 0 # reset counter for new timelapse if initiated through the GUI
             self.polSweepFinished.emit()
             await asyncio.sleep(1)
-            self.ejectFreezer()
-            await self.waitOnRobot()
+            await self.waitOnRobot(self.ejectFreezer())
             self.goHome()
-            df = self.results 
-            df.to_pickle(f"{self.scanName}_{self.angle1}_{self.angle2}_{self.numRequestedFrames}.pkl")
-            print("SCAN COMPLETED AND DATAFRAME EXPORTED")
+            if self.dataset is not None:
+                print(f"SCAN COMPLETED - {len(self.dataset)} FRAMES IN {self.dataset.path}")
+                self.closeDataset()
+            else:
+                df = self.frames.toDataFrame()
+                self.exportService.toPickle(df, f"{self.scanName}_{self.angle1}_{self.angle2}_{self.numRequestedFrames}.pkl")
+                print("SCAN COMPLETED AND DATAFRAME EXPORTED")
 
         except asyncio.exceptions.CancelledError:
             print("CANCELLED TIMELAPSE")        
+            self.closeDataset()
 
     
-    async def waitForAck(self):
-
-        """Wait for ACK from Robot"""
-
-        while self.lastMessage != 'ACK':
-            logger.info("Waiting for ACK")
-            await asyncio.sleep(1)
-        logger.info("ACK received")
-
-
     @asyncSlot()
     async def cancelTasks(self):
 
@@ -0,0 +1,491 @@
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+_indexName = "index.json"
+_version = 1
+
+
+def _columnFile(path, name):
+
+    return os.path.join(path, f"{name}.bin")
+
+
+def _sharedFile(path, name):
+
+    return os.path.join(path, f"{name}.npy")
+
+
+def _rowBytes(spec):
+
+    return np.dtype(spec['dtype']).itemsize*int(np.prod(spec['shape'], dtype = int))
+
+
+def _writeIndex(path, index, sync = False):
+
+    """
+        Atomically replace the metadata index of a dataset.
+    """
+
+    tmpFile = os.path.join(path, _indexName + ".tmp")
+    with open(tmpFile, 'w') as f:
+        json.dump(index, f, indent = 1)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmpFile, os.path.join(path, _indexName))
+
+
+class PulseDataset:
+
+    """
+        Lazy, memory mapped reader for a columnar pulse dataset.
+
+        A dataset is a directory holding one fixed width binary file per column (one row per pulse),
+        shared arrays such as the time and frequency axis as .npy files, and a small JSON index with
+        the column dtypes, row width and committed row count. Columns are only mapped when accessed,
+        so opening an archive of any size is instant and slicing reads just the rows touched.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self._maps = {}
+        self.refresh()
+
+
+    def refresh(self):
+
+        """
+            Re-read the index e.g. to pick up rows appended by a running experiment.
+        """
+
+        with open(os.path.join(self.path, _indexName)) as f:
+            self.index = json.load(f)
+        self.rows = self.index['rows']
+        self.attrs = self.index.get('attrs', {})
+        self._maps = {}
+
+
+    def __len__(self):
+
+        return self.rows
+
+
+    @property
+    def columns(self):
+
+        return list(self.index['columns'])
+
+
+    @property
+    def complete(self):
+
+        """
+            False while the dataset is written, and for a session that was interrupted.
+        """
+
+        return self.index.get('complete', True)
+
+
+    @property
+    def chunks(self):
+
+        """
+            Committed chunks in row order.
+
+            :return: row range of each chunk
+            :rtype: list of slice
+        """
+
+        return [slice(c['start'], c['start'] + c['rows']) for c in self.index.get('chunks', [])]
+
+
+    def __getitem__(self, name):
+
+        """
+            Memory mapped column, shape (rows,) for scalars or (rows, width) for arrays.
+        """
+
+        if name in self._maps:
+            return self._maps[name]
+        if name in self.index.get('shared', []):
+            column = np.load(_sharedFile(self.path, name), mmap_mode = 'r')
+        else:
+            spec = self.index['columns'][name]
+            shape = (self.rows,) + tuple(spec['shape'])
+            if self.rows == 0:
+                column = np.empty(shape, dtype = spec['dtype'])
+            else:
+                column = np.memmap(_columnFile(self.path, name), dtype = spec['dtype'], mode = 'r', shape = shape)
+        self._maps[name] = column
+        return column
+
+
+    def frames(self, rows, columns = None):
+
+        """
+            Rows of the dataset, read from the mapped columns.
+
+            :type rows: slice, int array or bool mask
+            :param rows: selection of rows e.g. slice(100, 200)
+            :type columns: list
+            :param columns: column names, all columns if None
+
+            :return: column name to array of the selected rows
+            :rtype: dict
+        """
+
+        columns = self.columns if columns is None else columns
+        return {name: np.asarray(self[name][rows]) for name in columns}
+
+
+    def between(self, start, end, column = 'timestamp'):
+
+        """
+            Rows acquired in [start, end). Uses a binary search when the rows are in time order.
+
+            :type start: datetime
+            :param start: start of the time range
+            :type end: datetime
+            :param end: end of the time range
+            :type column: str
+            :param column: timestamp column
+
+            :return: row selection
+            :rtype: slice or numpy array
+        """
+
+        t = self[column]
+        start, end = np.datetime64(start, 'ns'), np.datetime64(end, 'ns')
+        if self.index['columns'][column].get('sorted', False):
+            return slice(int(np.searchsorted(t, start, 'left')), int(np.searchsorted(t, end, 'left')))
+        return np.flatnonzero((t >= start) & (t < end))
+
+
+    def where(self, **criteria):
+
+        """
+            Rows where the scalar columns equal the given values e.g. where(sensorId = 12, qcResult = "FAIL").
+
+            :return: row indices
+            :rtype: numpy array
+        """
+
+        mask = np.ones(self.rows, dtype = bool)
+        for name, value in criteria.items():
+            column = self[name]
+            if column.dtype.kind == 'S':
+                value = str(value).encode()
+            mask &= column == value
+        return np.flatnonzero(mask)
+
+
+    def toDataFrame(self, rows = slice(None), columns = None):
+
+        """
+            Materialise selected rows as a DataFrame, one array per cell for the array columns.
+        """
+
+        data = self.frames(rows, columns)
+        out = {}
+        for name, values in data.items():
+            if values.dtype.kind == 'S':
+                out[name] = [v.decode() for v in values]
+            elif values.ndim > 1:
+                out[name] = list(values)
+            else:
+                out[name] = values
+        return pd.DataFrame(out)
+
+
+class PulseDatasetWriter:
+
+    """
+        Append only writer for a PulseDataset. The column layout is taken from the first row:
+        arrays become fixed width columns, numbers, datetimes and strings become scalar columns.
+        Rows only become visible to readers when the index is committed (every commitEvery rows
+        and on close). Every commit is recorded as a chunk in the index.
+
+        The index is only replaced after the column files are written, so after a crash it
+        describes the last complete chunk. Opening the dataset again truncates the columns to
+        that chunk and continues appending.
+    """
+
+    stringWidth = 64            # bytes for string columns e.g. sensor id, qc result
+
+    def __init__(self, path, commitEvery = 1, attrs = None, sync = False):
+
+        """
+            :type path: str
+            :param path: dataset directory, an existing dataset is continued
+            :type commitEvery: int
+            :param commitEvery: rows per chunk
+            :type attrs: dict
+            :param attrs: session metadata stored in the index
+            :type sync: bool
+            :param sync: fsync the columns and the index on every commit, so a chunk survives a power loss
+        """
+
+        self.path = path
+        self.commitEvery = max(int(commitEvery), 1)
+        self.sync = sync
+        self._files = {}
+        self._lastTimes = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        indexFile = os.path.join(path, _indexName)
+        if os.path.isfile(indexFile):
+            with open(indexFile) as f:
+                self.index = json.load(f)
+            self._recover()
+        else:
+            self.index = {'version': _version, 'rows': 0, 'columns': {}, 'shared': [], 'attrs': {}}
+        self.index.setdefault('chunks', [])
+        self.index['complete'] = False
+        if attrs:
+            self.index['attrs'].update(attrs)
+        self._pending = 0
+
+
+    def __len__(self):
+
+        return self.index['rows'] + self._pending
+
+
+    @property
+    def shared(self):
+
+        return self.index['shared']
+
+
+    def _recover(self):
+
+        """
+            Drop rows written after the last commit e.g. by a session that crashed mid chunk.
+        """
+
+        rows = self.index['rows']
+        for name, spec in self.index['columns'].items():
+            columnFile = _columnFile(self.path, name)
+            size = rows*_rowBytes(spec)
+            written = os.path.getsize(columnFile) if os.path.isfile(columnFile) else 0
+            if written < size:
+                raise OSError(f"Column '{name}' in {self.path} is shorter than its index ({written} < {size} bytes)")
+            if written > size:
+                logger.warning(f"Dropping {written - size} uncommitted bytes of '{name}' in {self.path}")
+                with open(columnFile, 'r+b') as f:
+                    f.truncate(size)
+            if rows and spec['dtype'].startswith('M8'):                 # keeps the 'sorted' flag valid across the resume
+                self._lastTimes[name] = np.fromfile(columnFile, dtype = spec['dtype'], count = 1,
+                                                    offset = size - _rowBytes(spec))[0]
+
+
+    def setShared(self, name, array):
+
+        """
+            Store an array common to all rows e.g. the time or frequency axis.
+        """
+
+        np.save(_sharedFile(self.path, name), np.asarray(array))
+        if name not in self.index['shared']:
+            self.index['shared'].append(name)
+
+
+    def _columnSpec(self, value):
+
+        if isinstance(value, (datetime.datetime, np.datetime64)):
+            return {'dtype': 'M8[ns]', 'shape': [], 'sorted': True}
+        if isinstance(value, (str, bytes)):
+            return {'dtype': f'S{self.stringWidth}', 'shape': []}
+        arr = np.asarray(value)
+        if arr.dtype.kind in 'iu':
+            return {'dtype': '<i8', 'shape': list(arr.shape)}
+        if arr.dtype.kind == 'b':
+            return {'dtype': '|b1', 'shape': list(arr.shape)}
+        if arr.dtype.kind == 'c':
+            return {'dtype': '<c16', 'shape': list(arr.shape)}
+        return {'dtype': '<f8', 'shape': list(arr.shape)}
+
+
+    def _encode(self, name, spec, value):
+
+        if spec['dtype'].startswith('M8'):
+            value = np.datetime64(value, 'ns')
+            if name in self._lastTimes and value < self._lastTimes[name]:
+                spec['sorted'] = False
+            self._lastTimes[name] = value
+            return np.array(value, dtype = spec['dtype'])
+        if spec['dtype'].startswith('S'):
+            return np.array(b'' if value is None else str(value).encode(), dtype = spec['dtype'])
+        if value is None:
+            value = np.nan
+        arr = np.asarray(value, dtype = spec['dtype'])
+        if list(arr.shape) != spec['shape']:
+            raise ValueError(f"Column '{name}' expects shape {spec['shape']}, got {list(arr.shape)}")
+        return arr
+
+
+    def append(self, row):
+
+        """
+            Append one pulse.
+
+            :type row: dict
+            :param row: column name to value. Arrays must keep the width of the first row.
+        """
+
+        columns = self.index['columns']
+        if not columns:
+            for name, value in row.items():
+                columns[name] = self._columnSpec(value)
+        for name, spec in columns.items():
+            f = self._files.get(name)
+            if f is None:
+                f = self._files[name] = open(_columnFile(self.path, name), 'ab')
+            f.write(self._encode(name, spec, row.get(name)).tobytes())
+        self._pending += 1
+        if self._pending >= self.commitEvery:
+            self.commit()
+
+
+    def commit(self):
+
+        """
+            Flush the column files and publish the appended rows in the index as one chunk.
+        """
+
+        for f in self._files.values():
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+        if self._pending:
+            self.index['chunks'].append({'start': self.index['rows'], 'rows': self._pending,
+                                         'committed': datetime.datetime.now().isoformat()})
+        self.index['rows'] += self._pending
+        self._pending = 0
+        _writeIndex(self.path, self.index, self.sync)
+
+
+    def close(self):
+
+        """
+            Commit the remaining rows and mark the dataset complete.
+        """
+
+        self.index['complete'] = True
+        self.commit()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class StreamingDatasetWriter:
+
+    """
+        PulseDatasetWriter running on a background thread, so the event loop never waits for the disk.
+
+        Rows are copied and queued, the thread appends them and commits a chunk every commitEvery
+        rows. The queue is bounded, so memory stays flat however long the session runs. An error
+        of the thread is raised by the next append or close.
+    """
+
+    def __init__(self, path, commitEvery = 8, attrs = None, sync = True, maxQueued = None):
+
+        """
+            :type maxQueued: int
+            :param maxQueued: rows waiting to be written before append blocks, two chunks if None
+        """
+
+        self.writer = PulseDatasetWriter(path, commitEvery = commitEvery, attrs = attrs, sync = sync)
+        self.path = path
+        self.shared = list(self.writer.shared)             # shared arrays stored or queued
+        self.rows = len(self.writer)                       # rows appended, including queued ones
+        self.error = None
+        self._queue = queue.Queue(maxQueued or 2*self.writer.commitEvery)
+        self._thread = threading.Thread(target = self._run, name = f"dataset {os.path.basename(path)}", daemon = True)
+        self._thread.start()
+
+
+    def __len__(self):
+
+        return self.rows
+
+
+    def _run(self):
+
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    kind, args = item
+                    if kind == 'row':
+                        self.writer.append(*args)
+                    else:
+                        self.writer.setShared(*args)
+            except Exception as e:
+                logger.error(f"Writing {self.path} failed: {e}")
+                self.error = e
+            finally:
+                self._queue.task_done()
+
+
+    def _check(self):
+
+        if self.error is not None:
+            raise self.error
+
+
+    def setShared(self, name, array):
+
+        self._check()
+        if name not in self.shared:
+            self.shared.append(name)
+        self._queue.put(('shared', (name, np.array(array))))
+
+
+    def append(self, row):
+
+        """
+            Queue one pulse, arrays are copied so the caller may reuse its buffers.
+
+            :type row: dict
+            :param row: column name to value, see PulseDatasetWriter.append
+        """
+
+        self._check()
+        row = {name: value.copy() if isinstance(value, np.ndarray) else value for name, value in row.items()}
+        self._queue.put(('row', (row,)))
+        self.rows += 1
+
+
+    def flush(self):
+
+        """
+            Wait until the queued rows are written (not necessarily committed).
+        """
+
+        self._queue.join()
+        self._check()
+
+
+    def close(self):
+
+        """
+            Write the queued rows, commit the last chunk and stop the thread.
+        """
+
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is None:
+            self.writer.close()
+        self._check()
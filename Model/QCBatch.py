@@ -0,0 +1,200 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from SpectralEngine import SpectralEngine
+from MenloParser import readTDS
+from TDSCache import TDSCache
+from QCKernel import QCKernel, PulseClassifier
+from ResonanceEstimator import ResonanceEstimator
+
+logger = logging.getLogger(__name__)
+
+_worker = None                                             # QCBatch of the current pool process
+
+
+def _initWorker(batch):
+
+    """
+        Process pool initializer: the reference spectrum and kernel are sent once per process, not per chunk.
+    """
+
+    global _worker
+    _worker = batch
+
+
+def _evaluateChunk(paths, thresholds):
+
+    return _worker.evaluateFiles(paths, thresholds)
+
+
+class QCBatch:
+
+    """
+        Headless re-run of the TheaQC decision logic on archived TDS files.
+
+        Each file is classified (Air/ Sensor) with the live peak finding vote, compared to the
+        standard reference with the same QCKernel and its resonance minimum is located with the
+        same chirp-z zoom. No Qt, ScanControl or serial device is involved, so archived sessions
+        can be re-judged under new thresholds across a process pool.
+    """
+
+    def __init__(self, config, stdRefPath = None, cache = None, resonanceBand = (0.71, 0.81)):
+
+        """
+            :type config: dict
+            :param config: TheaQC config, the 'QC' and 'Classification' sections are used
+            :type stdRefPath: str
+            :param stdRefPath: standard reference file, config QC:stdRefFileName in Resources/StandardReferences if None
+            :type cache: bool or TDSCache
+            :param cache: load the files through a TDSCache
+        """
+
+        self.config = config
+        self.engine = SpectralEngine()                         # same pad length and window as the live QC
+        self.resonance = ResonanceEstimator(*resonanceBand, engine = self.engine)
+        self.classifier = PulseClassifier.fromConfig(config['Classification'])
+        if cache is True:
+            cache = TDSCache()
+        self.cache = cache
+        if stdRefPath is None:
+            rscDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Resources")
+            stdRefPath = os.path.join(rscDir, "StandardReferences", *config['QC']['stdRefFileName'].split("\\"))
+        self.stdRefPath = stdRefPath
+        ref = readTDS(stdRefPath)
+        self.dt = ref['time'][1] - ref['time'][0]              # sampling interval the reference spectrum is valid for
+        self.freq, refFFT = self.engine.magnitude(ref['amp'], self.dt)
+        self.freq = self.freq.copy()
+        self.kernel = QCKernel.fromConfig(self.freq, refFFT, config['QC'])
+
+
+    def thresholds(self, allowedErrordB = None, maxViolations = None):
+
+        """
+            All combinations of the given thresholds, the configured ones for None.
+
+            :type allowedErrordB: float or list
+            :type maxViolations: int or list
+
+            :return: (allowedErrordB, maxViolations) pairs
+            :rtype: list
+        """
+
+        allowed = np.atleast_1d(self.kernel.allowedErrordB if allowedErrordB is None else allowedErrordB)
+        maxViolations = np.atleast_1d(self.kernel.maxViolations if maxViolations is None else maxViolations)
+        return [(float(a), int(m)) for a in allowed for m in maxViolations]
+
+
+    def _load(self, path):
+
+        if self.cache is not None:
+            return self.cache.load(path)
+        return readTDS(path)
+
+
+    def evaluateFiles(self, paths, thresholds = None):
+
+        """
+            Re-run the QC on a list of files.
+
+            :type paths: list
+            :param paths: TDS files e.g. from a QC session qcSaveDir
+            :type thresholds: list
+            :param thresholds: (allowedErrordB, maxViolations) pairs to judge every file with (see thresholds)
+
+            :return: one row per readable file
+            :rtype: list of dict
+        """
+
+        if thresholds is None:
+            thresholds = self.thresholds()
+        allowed = np.array([a for a, _ in thresholds])
+        maxViolations = np.array([m for _, m in thresholds])
+        rows, amps = [], []
+        for path in paths:
+            try:
+                tds = self._load(path)
+            except (ValueError, OSError) as e:
+                logger.warning(f"Skipping {path}: {e}")
+                continue
+            meta = tds['meta']
+            time = tds['time'] - tds['time'][0]                # live time axis starts at 0 ps
+            row = {'path': path, 'timestamp': meta['timestamp'], 'lot': meta['lot'], 'wafer': meta['wafer'],
+                   'sensorId': meta['sensorId'], 'archivedResult': meta['qcResult']}
+            row['classification'], _, _ = self.classifier.classify(time, tds['amp'])
+            if len(time) > 1 and np.isclose(time[1], self.dt):
+                row['resonance'] = float(self.resonance.estimateZoom(time, tds['amp']))
+                amps.append((len(rows), tds['amp']))
+            else:
+                logger.warning(f"{path} is not sampled like the standard reference, not compared")
+                row['resonance'] = None
+            rows.append(row)
+
+        groups = {}
+        for i, amp in amps:
+            groups.setdefault(len(amp), []).append(i)
+        comparable = dict(amps)
+        for idx in groups.values():
+            _, FFT = self.engine.batch(np.vstack([comparable[i] for i in idx]), self.dt)
+            passed, violations = self.kernel.evaluateBatch(FFT, allowed, maxViolations)
+            for k, i in enumerate(idx):
+                for j, (a, m) in enumerate(thresholds):
+                    rows[i][f"violations@{a:g}dB"] = int(violations[j, k])
+                    rows[i][f"qc@{a:g}dB/{m}"] = "PASS" if passed[j, k] else "FAIL"
+        return rows
+
+
+    def run(self, paths, thresholds = None, processes = None, chunkSize = 64):
+
+        """
+            Re-run the QC on many files across a process pool.
+
+            :type processes: int
+            :param processes: number of worker processes, None for all cores, 1 to run in this process
+            :type chunkSize: int
+            :param chunkSize: files evaluated per task
+
+            :return: report with one row per file, in the order of paths
+            :rtype: pandas DataFrame
+        """
+
+        if thresholds is None:
+            thresholds = self.thresholds()
+        chunks = [paths[i:i + chunkSize] for i in range(0, len(paths), chunkSize)]
+        rows = []
+        if processes == 1:
+            for chunk in chunks:
+                rows.extend(self.evaluateFiles(chunk, thresholds))
+        else:
+            with ProcessPoolExecutor(max_workers = processes, initializer = _initWorker, initargs = (self,)) as pool:
+                for result in pool.map(_evaluateChunk, chunks, [thresholds]*len(chunks)):
+                    rows.extend(result)
+        return pd.DataFrame(rows)
+
+
+    @staticmethod
+    def summary(report, thresholds):
+
+        """
+            Yield per threshold pair over the files classified as sensors.
+
+            :type report: pandas DataFrame
+            :param report: result of run
+            :type thresholds: list
+            :param thresholds: (allowedErrordB, maxViolations) pairs the report was made with
+
+            :return: one row per threshold pair
+            :rtype: pandas DataFrame
+        """
+
+        sensors = report[report['classification'] == "Sensor"] if len(report) else report
+        lines = []
+        for a, m in thresholds:
+            column = f"qc@{a:g}dB/{m}"
+            results = sensors[column].dropna() if column in sensors else pd.Series(dtype = object)
+            passed = int((results == "PASS").sum())
+            lines.append({'allowedErrordB': a, 'maxViolations': m, 'sensors': len(results),
+                          'pass': passed, 'fail': len(results) - passed,
+                          'yield': passed/len(results) if len(results) else None})
+        return pd.DataFrame(lines)
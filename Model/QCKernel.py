@@ -0,0 +1,468 @@
+import numpy as np
+from scipy.signal import find_peaks, peak_prominences, peak_widths
+from scipy.stats import norm
+
+
+class PulseClassifier:
+
+    """
+        Classify THz pulses as "Air" or "Sensor" by majority vote of three peak criteria inside
+        the inspection window:
+
+            distance   - the peak nearest to sample 250 of the peaks kept at the minimum distance lies beyond sample 260
+            threshold  - more than 3 peaks stand out from both neighbours by the threshold (Air)
+            prominence - more than 4 peaks have the minimum prominence (Air)
+
+        The local maxima and their thresholds, prominences and widths are computed in a single
+        find_peaks pass and every criterion is a selection from that one peak set, with the same
+        result as separate find_peaks calls per criterion. classifyBatch finds the local maxima
+        and thresholds of a whole stack of pulses at once, only the prominences and the distance
+        rule are evaluated per pulse.
+    """
+
+    def __init__(self, distance, prominence, threshold, width, inspectStart, inspectEnd):
+
+        self.distance = distance                           # minimum peak distance (samples)
+        self.prominence = prominence                       # minimum peak prominence
+        self.threshold = threshold                         # minimum height above both neighbours
+        self.width = width                                 # minimum peak width (samples), reported only
+        self.inspectStart = inspectStart                   # inspection window start (ps)
+        self.inspectEnd = inspectEnd                       # inspection window end (ps)
+        self._windows = {}                                 # (len, t0, dt) -> window start, end index
+
+
+    @classmethod
+    def fromConfig(cls, params):
+
+        """
+            :type params: dict
+            :param params: 'Classification' section of the config file
+        """
+
+        return cls(params['distance'], params['prominence'], params['threshold'], params['width'],
+                   params['tdsInspectStart'], params['tdsInspectEnd'])
+
+
+    def windowIndices(self, time):
+
+        """
+            :type time: numpy array
+            :param time: uniform time axis (ps)
+
+            :return: start and end index of the inspection window, nearest samples to its edges
+            :rtype: int, int
+        """
+
+        key = (len(time), float(time[0]), float(time[1] - time[0]))
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = (int(np.abs(time - self.inspectStart).argmin()),
+                                           int(np.abs(time - self.inspectEnd).argmin()))
+        return window
+
+
+    def selectByDistance(self, peaks, heights):
+
+        """
+            Keep the highest peaks at least self.distance samples apart (the find_peaks distance rule).
+
+            :return: kept peak indices in ascending order
+            :rtype: numpy array
+        """
+
+        distance = np.ceil(self.distance)
+        keep = np.ones(len(peaks), dtype = bool)
+        for i in np.argsort(heights)[::-1]:
+            if keep[i]:
+                lo = np.searchsorted(peaks, peaks[i] - distance, side = 'right')
+                hi = np.searchsorted(peaks, peaks[i] + distance, side = 'left')
+                keep[lo:i] = False
+                keep[i + 1:hi] = False
+        return peaks[keep]
+
+
+    def peaks(self, window):
+
+        """
+            Peaks of the inspection window selected by each criterion.
+
+            :type window: numpy array
+            :param window: pulse amplitude inside the inspection window
+
+            :return: peak indices per criterion ('distance', 'width', 'prominence', 'threshold')
+            :rtype: dict
+        """
+
+        peaks, props = find_peaks(window, threshold = (None, None), prominence = (None, None), width = (None, None))
+        return {'distance': self.selectByDistance(peaks, window[peaks]),
+                'width': peaks[props['widths'] >= self.width],
+                'prominence': peaks[props['prominences'] >= self.prominence],
+                'threshold': peaks[np.minimum(props['left_thresholds'], props['right_thresholds']) >= self.threshold]}
+
+
+    def classify(self, time, amp):
+
+        """
+            :type time: numpy array
+            :param time: time axis starting at 0 ps
+            :type amp: numpy array
+            :param amp: pulse amplitude
+
+            :return: classification, peaks per criterion and votes
+            :rtype: str, dict, dict
+        """
+
+        start, end = self.windowIndices(time)
+        peaks = self.peaks(np.asarray(amp)[start:end])
+        votes = {'isSensor': 0, 'isAir': 0}
+
+        if self.sensorByDistance(peaks['distance']):
+            votes['isSensor'] += 1
+        else:
+            votes['isAir'] += 1
+        if len(peaks['threshold']) > 3:
+            votes['isAir'] += 1
+        else:
+            votes['isSensor'] += 1
+        if len(peaks['prominence']) > 4:
+            votes['isAir'] += 1
+        else:
+            votes['isSensor'] += 1
+
+        classification = "Sensor" if votes['isAir'] < votes['isSensor'] else "Air"
+        return classification, peaks, votes
+
+
+    @staticmethod
+    def sensorByDistance(distancePeaks):
+
+        """
+            Distance criterion: the peak nearest to sample 250 lies beyond sample 260.
+
+            :type distancePeaks: numpy array
+            :param distancePeaks: ascending peak indices kept by the distance rule
+
+            :rtype: bool
+        """
+
+        nearest = np.searchsorted(distancePeaks, 250)
+        candidates = distancePeaks[max(nearest - 1, 0):nearest + 1]
+        return bool(len(candidates)) and bool(candidates[np.abs(candidates - 250).argmin()] > 260)   # checking array indices not values
+
+
+    @staticmethod
+    def localMaxima(windows):
+
+        """
+            Local maxima of every row, as find_peaks finds them: a flat peak is reported at the
+            middle (rounded down) of its plateau, the first and last samples are never peaks.
+
+            :type windows: numpy array
+            :param windows: 2-D stack of pulse windows, one per row
+
+            :return: row and index of every peak, in row order
+            :rtype: numpy array, numpy array
+        """
+
+        step = np.sign(np.diff(windows, axis = 1))
+        rows, cols = np.nonzero(step)                          # plateaus (no step) are skipped
+        sign = step[rows, cols]
+        peak = (sign[:-1] > 0) & (sign[1:] < 0) & (rows[:-1] == rows[1:])
+        return rows[:-1][peak], (cols[:-1][peak] + 1 + cols[1:][peak])//2
+
+
+    def classifyBatch(self, time, amps):
+
+        """
+            Classify a stack of pulses sharing one time axis, with the same result as classify
+            per pulse. The window indices are found once, the local maxima, thresholds and votes
+            are computed for the whole stack.
+
+            :type time: numpy array
+            :param time: time axis starting at 0 ps
+            :type amps: numpy array
+            :param amps: 2-D stack of pulses, one per row
+
+            :return: classification per pulse, peaks per criterion per pulse and votes per pulse
+            :rtype: list, list of dict, dict of numpy array
+        """
+
+        start, end = self.windowIndices(time)
+        windows = np.ascontiguousarray(np.atleast_2d(amps)[:, start:end], dtype = np.float64)
+        rows, peaks = self.localMaxima(windows)
+        heights = windows[rows, peaks]
+        thresholds = np.minimum(heights - windows[rows, peaks - 1], heights - windows[rows, peaks + 1])
+        bounds = np.searchsorted(rows, np.arange(len(windows) + 1))
+
+        peakSets = []
+        for i, window in enumerate(windows):
+            rowPeaks = peaks[bounds[i]:bounds[i + 1]]
+            prominences, leftBases, rightBases = peak_prominences(window, rowPeaks)
+            widths = peak_widths(window, rowPeaks, prominence_data = (prominences, leftBases, rightBases))[0]
+            peakSets.append({'distance': self.selectByDistance(rowPeaks, heights[bounds[i]:bounds[i + 1]]),
+                             'width': rowPeaks[widths >= self.width],
+                             'prominence': rowPeaks[prominences >= self.prominence],
+                             'threshold': rowPeaks[thresholds[bounds[i]:bounds[i + 1]] >= self.threshold]})
+
+        thresholdCounts = np.bincount(rows[thresholds >= self.threshold], minlength = len(windows))
+        prominenceCounts = np.array([len(p['prominence']) for p in peakSets], dtype = int)
+        byDistance = np.array([self.sensorByDistance(p['distance']) for p in peakSets], dtype = bool)
+        isAir = (~byDistance).astype(int) + (thresholdCounts > 3) + (prominenceCounts > 4)
+        votes = {'isSensor': 3 - isAir, 'isAir': isAir}
+        classification = np.where(votes['isAir'] < votes['isSensor'], "Sensor", "Air").tolist()
+        return classification, peakSets, votes
+
+
+class QCKernel:
+
+    """
+        Comparative QC against the standard reference spectrum, free of any Qt/ device state.
+
+        A spectrum fails when more than maxViolations bins in the QC band deviate from the
+        standard reference by more than allowedErrordB (10*ln of the magnitude, as in
+        TheaQC.compareToStdRef). The reference log magnitude and band indices are computed
+        once, and all comparisons work on stacks of spectra (one per row) as well as single
+        spectra, e.g. to re-judge an archived lot under new thresholds in one call.
+
+        For sequential decisions on intermediate averages the deviation of every bin is compared
+        to the threshold together with its noise. A bin counts as a certain violation, a certain
+        pass or undecided, and the verdict is settled once the undecided bins can no longer change
+        it. confidence is the confidence of the verdict: the per bin bound is Bonferroni corrected
+        over the bins of the QC band and the number of sequential decisions (looks) per sensor,
+        so a settled verdict differs from the one of the noise free spectrum with probability
+        at most 1 - confidence.
+    """
+
+    dbScale = 10                                           # deviation scale, 10*ln(|FFT|)
+
+    def __init__(self, refFFT, start_idx, end_idx, allowedErrordB, maxViolations, confidence = 0.999, looks = 1):
+
+        self.start_idx = start_idx                         # first bin of the QC band
+        self.end_idx = end_idx                             # end (exclusive) of the QC band
+        self.allowedErrordB = allowedErrordB               # allowed deviation per bin
+        self.maxViolations = maxViolations                 # allowed number of deviating bins
+        self.refLog = self.dbScale*np.log(np.abs(refFFT[start_idx:end_idx]))
+        self.setConfidence(confidence, looks)
+
+
+    @classmethod
+    def fromConfig(cls, freq, refFFT, qcConfig):
+
+        """
+            :type freq: numpy array
+            :param freq: frequency axis of the reference spectrum (THz)
+            :type refFFT: numpy array
+            :param refFFT: full length magnitude spectrum of the standard reference
+            :type qcConfig: dict
+            :param qcConfig: 'QC' section of the config file
+        """
+
+        start_idx = int(np.abs(freq - qcConfig['lowerFreqBound']).argmin())
+        end_idx = int(np.abs(freq - qcConfig['upperFreqBound']).argmin())
+        return cls(refFFT, start_idx, end_idx, qcConfig['allowedErrordB'], qcConfig['maxViolations'],
+                   confidence = qcConfig.get('confidence', 0.999), looks = cls.sequentialLooks(qcConfig))
+
+
+    @staticmethod
+    def sequentialLooks(qcConfig):
+
+        """
+            :type qcConfig: dict
+            :param qcConfig: 'QC' section of the config file
+
+            :return: sequential decisions per sensor, one per average from minAverages (at least 2) to qcAverages
+            :rtype: int
+        """
+
+        if not qcConfig.get('sequential', False):
+            return 1
+        return max(qcConfig['qcAverages'] - max(qcConfig.get('minAverages', 3), 2) + 1, 1)
+
+
+    def setConfidence(self, confidence, looks = None):
+
+        """
+            :type confidence: float
+            :param confidence: confidence of the settled verdict
+            :type looks: int
+            :param looks: sequential decisions per sensor, unchanged if None
+        """
+
+        if looks is not None:
+            self.looks = looks
+        self.confidence = confidence
+        nBins = max(self.end_idx - self.start_idx, 1)
+        self.z = norm.ppf(1 - (1 - confidence)/(2*nBins*self.looks))   # two sided bound per bin and look
+
+
+    def deviation(self, FFT):
+
+        """
+            :type FFT: numpy array
+            :param FFT: full length magnitude (or complex) spectrum, or a 2-D stack of them
+
+            :return: deviation from the standard reference in the QC band
+            :rtype: numpy array
+        """
+
+        band = np.abs(FFT[..., self.start_idx:self.end_idx])
+        return self.refLog - self.dbScale*np.log(band)
+
+
+    def violations(self, FFT, allowedErrordB = None):
+
+        """
+            Number of bins outside the allowed deviation.
+
+            :type FFT: numpy array
+            :param FFT: spectrum or 2-D stack of spectra
+            :type allowedErrordB: float or array
+            :param allowedErrordB: threshold(s), the configured threshold if None. An array of
+                                   thresholds adds a leading axis to the result.
+
+            :return: violation count per spectrum (per threshold)
+            :rtype: int or numpy array
+        """
+
+        if allowedErrordB is None:
+            allowedErrordB = self.allowedErrordB
+        absDeviation = np.abs(self.deviation(FFT))
+        thresholds = np.asarray(allowedErrordB, dtype = float)
+        counts = np.count_nonzero(absDeviation > thresholds.reshape(thresholds.shape + (1,)*absDeviation.ndim), axis = -1)
+        return int(counts) if counts.ndim == 0 else counts
+
+
+    def evaluate(self, FFT):
+
+        """
+            Apply the acceptance criterion.
+
+            :return: 'PASS' or 'FAIL' and the number of violating bins
+            :rtype: str, int
+        """
+
+        violations = self.violations(FFT)
+        return ("FAIL" if violations > self.maxViolations else "PASS"), violations
+
+
+    def evaluateBatch(self, FFTs, allowedErrordB = None, maxViolations = None):
+
+        """
+            Apply the acceptance criterion to a stack of spectra, optionally with new thresholds.
+
+            :type FFTs: numpy array
+            :param FFTs: 2-D stack of full length spectra, one per row
+            :type allowedErrordB: float or array
+            :param allowedErrordB: allowed deviation, or an array of them to sweep
+            :type maxViolations: int or array
+            :param maxViolations: allowed violating bins, or an array of them (paired with an allowedErrordB array)
+
+            :return: pass mask and violation counts, shape (rows,) or (thresholds, rows)
+            :rtype: numpy array, numpy array
+        """
+
+        if maxViolations is None:
+            maxViolations = self.maxViolations
+        violations = np.asarray(self.violations(np.atleast_2d(FFTs), allowedErrordB))
+        maxViolations = np.asarray(maxViolations)
+        if maxViolations.ndim == 1:
+            maxViolations = maxViolations[:, None]         # one row of verdicts per value
+        return violations <= maxViolations, violations
+
+
+    def evaluatePulses(self, amps, dt, engine, blockSize = 256, **thresholds):
+
+        """
+            Transform and judge a stack of pulses block by block, so only one block of
+            spectra is held in memory.
+
+            :type amps: numpy array
+            :param amps: 2-D stack of pulses, one per row
+            :type dt: float
+            :param dt: sampling interval (ps)
+            :type engine: SpectralEngine
+            :param engine: engine with the same pad length and window as the reference spectrum
+
+            :return: see evaluateBatch
+            :rtype: numpy array, numpy array
+        """
+
+        passed, violations = [], []
+        for i in range(0, len(amps), blockSize):
+            _, FFT = engine.batch(amps[i:i + blockSize], dt)
+            p, v = self.evaluateBatch(FFT, **thresholds)
+            passed.append(p)
+            violations.append(v)
+        return np.concatenate(passed, axis = -1), np.concatenate(violations, axis = -1)
+
+
+    @staticmethod
+    def magnitudeNoise(std, window, fftNorm, count):
+
+        """
+            Noise of the FFT magnitude of an averaged pulse, from the per sample noise of single pulses.
+            Samples are treated as white, independent noise, which gives the same noise for every
+            frequency bin. Timing jitter of the pulse adds correlated noise around the peak, which
+            this model spreads over all bins; on the example single shots (Resources) the measured
+            scatter (see magnitudeScatter) is below the model in most of the QC band.
+
+            :type std: numpy array
+            :param std: per sample standard deviation of a single pulse
+            :type window: numpy array
+            :param window: time window applied before the FFT
+            :type fftNorm: float
+            :param fftNorm: FFT normalisation (pad length/ 2)
+            :type count: float
+            :param count: (effective) number of averaged pulses
+
+            :return: standard deviation of |FFT| per bin
+            :rtype: float
+        """
+
+        complexVariance = np.sum((window*std[:len(window)])**2)/count
+        return np.sqrt(complexVariance/2)/fftNorm
+
+
+    def magnitudeScatter(self, FFTs, count = 1):
+
+        """
+            Measured noise of the FFT magnitude per bin of the QC band, from repeated single pulses.
+            Can replace the white noise model of magnitudeNoise in sequential().
+
+            :type FFTs: numpy array
+            :param FFTs: 2-D stack of full length spectra of repeated pulses of one sensor, one per row
+            :type count: float
+            :param count: (effective) number of averaged pulses the noise is wanted for
+
+            :return: standard deviation of |FFT| per bin of the QC band
+            :rtype: numpy array
+        """
+
+        band = np.abs(np.asarray(FFTs)[:, self.start_idx:self.end_idx])
+        return band.std(axis = 0, ddof = 1)/np.sqrt(count)
+
+
+    def sequential(self, FFT, magnitudeNoise):
+
+        """
+            Sequential verdict on an intermediate average.
+
+            :type FFT: numpy array
+            :param FFT: full length magnitude spectrum of the running average
+            :type magnitudeNoise: float or numpy array
+            :param magnitudeNoise: standard deviation of |FFT|, one value or one per band bin (see magnitudeNoise)
+
+            :return: settled verdict ('PASS', 'FAIL' or None while undecided), certain violations, undecided bins
+            :rtype: str, int, int
+        """
+
+        band = np.abs(FFT[self.start_idx:self.end_idx])
+        sigma = self.dbScale*magnitudeNoise/band              # first order noise of 10*ln|FFT|, the reference is fixed
+        margin = np.abs(self.deviation(FFT)) - self.allowedErrordB
+        certain = int(np.count_nonzero(margin > self.z*sigma))
+        undecided = int(np.count_nonzero(np.abs(margin) <= self.z*sigma))
+        if certain > self.maxViolations:
+            return "FAIL", certain, undecided
+        if certain + undecided <= self.maxViolations:
+            return "PASS", certain, undecided
+        return None, certain, undecided
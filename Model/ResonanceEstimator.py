@@ -0,0 +1,168 @@
+import numpy as np
+from SpectralEngine import defaultEngine
+
+
+class ZoomPlan:
+
+    """
+        Precomputed chirp-z (Bluestein) transform evaluating the spectrum of a pulse on a fine,
+        uniform frequency grid spanning only the band of interest.
+    """
+
+    def __init__(self, N, dt, fLo, fHi, points, window):
+
+        self.N = N                                             # samples in the pulse
+        self.freq = np.linspace(fLo, fHi, points)              # zoomed frequency grid (THz)
+        df = self.freq[1] - self.freq[0]
+        L = 1 << (N + points - 2).bit_length()                 # FFT length for the linear convolution
+        k = np.arange(max(N, points))
+        chirp = np.exp(-1j*np.pi*df*dt*k.astype(float)**2)     # W^(k^2/2), W = exp(-2 pi i df dt)
+        self.L = L
+        self.pre = window*np.exp(-2j*np.pi*fLo*dt*k[:N])*chirp[:N]
+        self.post = chirp[:points]
+        self.kernel = np.fft.fft(1/np.hstack((chirp[N-1:0:-1], chirp[:points])), L)
+
+
+    def transform(self, amps):
+
+        """
+            :type amps: numpy array
+            :param amps: pulse or 2-D stack of pulses, one per row
+
+            :return: complex spectrum on the zoomed grid, one row per pulse
+            :rtype: numpy array
+        """
+
+        x = np.fft.fft(np.atleast_2d(amps)*self.pre, self.L, axis = -1)
+        y = np.fft.ifft(x*self.kernel, axis = -1)[:, self.N - 1:self.N - 1 + len(self.post)]
+        return y*self.post
+
+
+class ResonanceEstimator:
+
+    """
+        Locate the resonance minimum of THz spectra inside a frequency band.
+
+        Only the band is evaluated. Band indices are computed once per frequency axis and the
+        grid minimum is refined to sub-bin precision with a parabola through the log magnitude
+        of the minimum and its two neighbours. estimateZoom evaluates the band on a finer grid
+        with a chirp-z transform of the pulse, without increasing the pad length of the main FFT.
+        All estimates accept a single spectrum/ pulse or a 2-D stack with one per row.
+    """
+
+    def __init__(self, fLo = 0.71, fHi = 0.81, zoomPoints = 256, engine = defaultEngine):
+
+        self.fLo = fLo                                         # lower band edge (THz)
+        self.fHi = fHi                                         # upper band edge (THz)
+        self.zoomPoints = zoomPoints                           # grid points of the zoomed band
+        self.engine = engine                                   # source of the pulse window
+        self._bands = {}                                       # (len, f0, df) -> band start, stop index
+        self._zoomPlans = {}                                   # (N, dt) -> ZoomPlan
+
+
+    def bandIndices(self, freq):
+
+        """
+            :type freq: numpy array
+            :param freq: uniform frequency axis (THz)
+
+            :return: start and stop index of the band, nearest bins to the band edges
+            :rtype: int, int
+        """
+
+        key = (len(freq), float(freq[0]), float(freq[1] - freq[0]))
+        band = self._bands.get(key)
+        if band is None:
+            df = key[2]
+            start = int(np.clip(np.rint((self.fLo - key[1])/df), 0, len(freq) - 1))
+            stop = int(np.clip(np.rint((self.fHi - key[1])/df), 0, len(freq) - 1))
+            band = self._bands[key] = (start, stop)
+        return band
+
+
+    def _refine(self, freq, logMag):
+
+        """
+            Parabolic interpolation of the minimum of each row of logMag on the grid freq.
+        """
+
+        rows = np.arange(logMag.shape[0])
+        idx = np.argmin(logMag, axis = 1)
+        inner = np.clip(idx, 1, logMag.shape[1] - 2)
+        y0 = logMag[rows, inner - 1]
+        y1 = logMag[rows, inner]
+        y2 = logMag[rows, inner + 1]
+        curvature = y0 - 2*y1 + y2
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            delta = np.where(curvature > 0, 0.5*(y0 - y2)/curvature, 0)
+        delta = np.where(idx == inner, np.clip(delta, -0.5, 0.5), 0)  # no refinement at the band edges
+        return freq[0] + (idx + delta)*(freq[1] - freq[0])
+
+
+    def estimate(self, freq, FFT):
+
+        """
+            Sub-bin resonance minimum from spectra on the regular FFT grid.
+
+            :type freq: numpy array
+            :param freq: frequency axis (THz)
+            :type FFT: numpy array
+            :param FFT: full length magnitude or complex spectrum, or a 2-D stack of them
+
+            :return: resonance frequency (THz), one per spectrum for a stack
+            :rtype: float or numpy array
+        """
+
+        start, stop = self.bandIndices(freq)
+        band = np.abs(np.atleast_2d(FFT)[:, start:stop])
+        result = self._refine(freq[start:stop], np.log(band))
+        return result[0] if np.ndim(FFT) == 1 else result
+
+
+    def zoomPlan(self, N, dt):
+
+        key = (N, float(dt))
+        plan = self._zoomPlans.get(key)
+        if plan is None:
+            window = self.engine.plan(N, dt).window
+            plan = self._zoomPlans[key] = ZoomPlan(N, float(dt), self.fLo, self.fHi, self.zoomPoints, window)
+        return plan
+
+
+    def zoom(self, time, amps):
+
+        """
+            Magnitude spectrum of the windowed pulse(s) on the zoomed band grid.
+
+            :type time: numpy array
+            :param time: time axis (ps)
+            :type amps: numpy array
+            :param amps: pulse amplitude, or 2-D stack of pulses
+
+            :return: zoomed frequency axis (THz) and magnitude spectrum
+            :rtype: numpy array, numpy array
+        """
+
+        amps = np.asarray(amps, dtype = float)
+        plan = self.zoomPlan(amps.shape[-1], time[1] - time[0])
+        mag = np.abs(plan.transform(amps))/(self.engine.plan(amps.shape[-1], time[1] - time[0]).norm)
+        return plan.freq, (mag[0] if amps.ndim == 1 else mag)
+
+
+    def estimateZoom(self, time, amps):
+
+        """
+            Resonance minimum from a chirp-z zoom over the band, refined with the same parabolic fit.
+
+            :type time: numpy array
+            :param time: time axis (ps)
+            :type amps: numpy array
+            :param amps: pulse amplitude, or 2-D stack of pulses
+
+            :return: resonance frequency (THz), one per pulse for a stack
+            :rtype: float or numpy array
+        """
+
+        freq, mag = self.zoom(time, amps)
+        result = self._refine(freq, np.log(np.atleast_2d(mag)))
+        return result[0] if np.ndim(amps) == 1 else result
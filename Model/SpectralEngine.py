@@ -0,0 +1,205 @@
+from collections import OrderedDict
+import numpy as np
+from scipy.signal.windows import tukey
+
+
+class SpectralPlan:
+
+    """
+        Cached resources for transforming pulses of one length and sampling interval.
+        A plan owns the Tukey window, the frequency axis and the zero padded work buffer,
+        so none of these are rebuilt when a new pulse arrives.
+    """
+
+    def __init__(self, N, dt, padLength, alpha):
+
+        self.N = N                                             # number of samples in the pulse
+        self.dt = dt                                           # sampling interval (ps)
+        self.padLength = padLength                             # length of the zero padded series
+        self.nBins = padLength//2                              # positive frequency bins kept (0 .. Nyquist excl.)
+        self.norm = padLength/2                                # FFT amplitude normalisation
+        self.window = tukey(N, alpha = alpha)
+        self.freq = np.fft.rfftfreq(padLength, dt)[:self.nBins]
+        self.freq.flags.writeable = False                      # shared between callers, never modified
+        self.work = np.zeros(padLength)                        # padded work buffer, tail stays zero
+        self.batchWork = None                                  # padded 2-D work buffer for batched transforms
+        self._bands = {}                                       # cached (start, stop) indices per frequency band
+
+
+    def load(self, amp):
+
+        """
+            Window the pulse into the padded work buffer.
+
+            :type amp: numpy array
+            :param amp: Pulse amplitude data of length N.
+
+            :return: padded work buffer
+            :rtype: numpy array
+        """
+
+        np.multiply(amp, self.window, out = self.work[:self.N])
+        return self.work
+
+
+    def bandIndices(self, fLo, fHi):
+
+        """
+            Indices of the frequency bins nearest to the band edges, computed once per band.
+
+            :type fLo: float
+            :param fLo: lower band edge (THz)
+            :type fHi: float
+            :param fHi: upper band edge (THz)
+
+            :return: start and stop index for slicing the spectrum
+            :rtype: int, int
+        """
+
+        band = self._bands.get((fLo, fHi))
+        if band is None:
+            band = (int(np.abs(self.freq - fLo).argmin()), int(np.abs(self.freq - fHi).argmin()))
+            self._bands[(fLo, fHi)] = band
+        return band
+
+
+    def loadBatch(self, amps):
+
+        """
+            Window a stack of pulses into the padded 2-D work buffer.
+
+            :type amps: numpy array
+            :param amps: 2-D array of pulses, one pulse of length N per row.
+
+            :return: padded work buffer with one row per pulse
+            :rtype: numpy array
+        """
+
+        rows = amps.shape[0]
+        if self.batchWork is None or self.batchWork.shape[0] < rows:
+            self.batchWork = np.zeros((rows, self.padLength))
+        work = self.batchWork[:rows]
+        np.multiply(amps, self.window, out = work[:, :self.N])
+        return work
+
+
+class SpectralEngine:
+
+    """
+        Reusable real input FFT engine for THz pulses.
+
+        Plans are cached per (N, dt, pad length) key so the window, frequency axis and work
+        buffers are only built once per pulse geometry. The engine is not thread safe, the
+        work buffers are shared between calls. Use one engine per thread/ process.
+    """
+
+    def __init__(self, padLength = 16384, alpha = 0.1, maxPlans = 8, blockSize = 64):
+
+        self.padLength = padLength                             # pad zeros on the time signal to reach this length
+        self.alpha = alpha                                     # Tukey window shape parameter
+        self.maxPlans = maxPlans                               # upper limit for cached plans
+        self.blockSize = blockSize                             # pulses transformed at once in batch mode
+        self._plans = OrderedDict()
+
+
+    def plan(self, N, dt):
+
+        """
+            Return the cached plan for a pulse geometry, building it on first use.
+
+            :type N: int
+            :param N: number of samples in the pulse
+            :type dt: float
+            :param dt: sampling interval (ps)
+
+            :return: plan for the requested geometry
+            :rtype: SpectralPlan
+        """
+
+        padLength = self.padLength
+        if N > padLength:
+            padLength = 1 << (N - 1).bit_length()              # never truncate, pad up to the next power of two
+        key = (N, float(dt), padLength)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = SpectralPlan(N, float(dt), padLength, self.alpha)
+            self._plans[key] = plan
+            if len(self._plans) > self.maxPlans:
+                self._plans.popitem(last = False)
+        else:
+            self._plans.move_to_end(key)
+        return plan
+
+
+    def spectrum(self, amp, dt):
+
+        """
+            Complex, normalised spectrum of a THz pulse.
+
+            :type amp: numpy array
+            :param amp: Pulse amplitude data.
+            :type dt: float
+            :param dt: sampling interval (ps)
+
+            :return: frequency axis (THz) and complex FFT
+            :rtype: numpy array, numpy array
+        """
+
+        plan = self.plan(len(amp), dt)
+        FFT = np.fft.rfft(plan.load(amp))[:plan.nBins]
+        FFT /= plan.norm
+        return plan.freq, FFT
+
+
+    def magnitude(self, amp, dt, out = None):
+
+        """
+            Magnitude spectrum of a THz pulse.
+
+            :type amp: numpy array
+            :param amp: Pulse amplitude data.
+            :type dt: float
+            :param dt: sampling interval (ps)
+            :type out: numpy array
+            :param out: optional preallocated array of plan.nBins elements to write the result into.
+
+            :return: frequency axis (THz) and FFT magnitude
+            :rtype: numpy array, numpy array
+        """
+
+        plan = self.plan(len(amp), dt)
+        if out is None:
+            out = np.empty(plan.nBins)
+        FFT = np.fft.rfft(plan.load(amp))
+        np.abs(FFT[:plan.nBins], out = out)
+        out /= plan.norm
+        return plan.freq, out
+
+
+    def batch(self, amps, dt):
+
+        """
+            Complex, normalised spectra of a stack of equal length THz pulses.
+            Pulses are transformed in blocks of blockSize rows to bound the work buffer.
+
+            :type amps: numpy array
+            :param amps: 2-D array of pulses, one pulse per row.
+            :type dt: float
+            :param dt: sampling interval (ps)
+
+            :return: frequency axis (THz) and complex FFT with one row per pulse
+            :rtype: numpy array, numpy array
+        """
+
+        amps = np.atleast_2d(np.asarray(amps, dtype = float))
+        M, N = amps.shape
+        plan = self.plan(N, dt)
+        FFT = np.empty((M, plan.nBins), dtype = complex)
+        for i in range(0, M, self.blockSize):
+            block = amps[i:i + self.blockSize]
+            FFT[i:i + len(block)] = np.fft.rfft(plan.loadBatch(block), axis = 1)[:, :plan.nBins]
+        FFT /= plan.norm
+        return plan.freq, FFT
+
+
+defaultEngine = SpectralEngine()    # shared engine for the live pulse processing
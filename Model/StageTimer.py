@@ -0,0 +1,124 @@
+import collections
+import contextlib
+import time
+
+
+class StageTimer:
+
+    """
+        Wall clock time per stage of a repeated work cycle e.g. the QC loop
+        (detect, acquire, compare, persist, move).
+
+        Stages may overlap - a stage can be started and left running while others are timed.
+        The cycle time is measured separately, so in a pipelined loop the sum of the stage
+        times exceeds the cycle time by the overlapped part.
+    """
+
+    def __init__(self):
+
+        self.reset()
+
+
+    def reset(self):
+
+        self.durations = collections.OrderedDict()            # stage -> list of durations (s)
+        self.cycles = []                                       # duration of each completed cycle (s)
+        self._open = {}                                        # stage -> start time of the running interval
+        self._cycleStart = None
+
+
+    def start(self, stage):
+
+        now = time.perf_counter()
+        if self._cycleStart is None:
+            self._cycleStart = now
+        self._open[stage] = now
+
+
+    def stop(self, stage):
+
+        """
+            :return: duration of the stage interval (s), None if it was not started
+            :rtype: float
+        """
+
+        start = self._open.pop(stage, None)
+        if start is None:
+            return None
+        duration = time.perf_counter() - start
+        self.durations.setdefault(stage, []).append(duration)
+        return duration
+
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+
+        """
+            Time a block of code, usable in coroutines as well:
+
+                with timer.stage('acquire'):
+                    await experiment.startAveraging()
+        """
+
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop(stage)
+
+
+    def cycle(self):
+
+        """
+            Mark the end of one cycle, the next one starts now.
+
+            :return: duration of the completed cycle (s)
+            :rtype: float
+        """
+
+        now = time.perf_counter()
+        duration = None
+        if self._cycleStart is not None:
+            duration = now - self._cycleStart
+            self.cycles.append(duration)
+        self._cycleStart = now
+        return duration
+
+
+    def summary(self):
+
+        """
+            :return: count, mean, max and total time per stage, and the cycle time with the resulting
+                     rate per hour. The stage with the longest mean time is flagged as the bottleneck.
+            :rtype: list of dict
+        """
+
+        rows = []
+        for stage, durations in self.durations.items():
+            rows.append({'stage': stage, 'count': len(durations), 'mean': sum(durations)/len(durations),
+                         'max': max(durations), 'total': sum(durations), 'bottleneck': False})
+        if rows:
+            max(rows, key = lambda row: row['mean'])['bottleneck'] = True
+        if self.cycles:
+            mean = sum(self.cycles)/len(self.cycles)
+            rows.append({'stage': 'cycle', 'count': len(self.cycles), 'mean': mean, 'max': max(self.cycles),
+                         'total': sum(self.cycles), 'bottleneck': False, 'perHour': 3600/mean if mean else None})
+        return rows
+
+
+    def report(self):
+
+        """
+            :return: human readable summary, one line per stage
+            :rtype: str
+        """
+
+        lines = []
+        for row in self.summary():
+            line = f"{row['stage']:>10}: {row['count']:4d} x {row['mean']:7.3f} s (max {row['max']:7.3f} s)"
+            if row['bottleneck']:
+                line += "  <- bottleneck"
+            if row.get('perHour'):
+                line += f"  = {row['perHour']:.0f} per hour"
+            lines.append(line)
+        return "\n".join(lines)
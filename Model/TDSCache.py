@@ -0,0 +1,280 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from MenloParser import parseTDS, parseTDSBinary, binaryExtension
+
+logger = logging.getLogger(__name__)
+
+
+_magic = b"TDSC\x00\x00\x00\x01"        # cache entry format marker and version
+
+class TDSCache:
+
+    """
+        Binary sidecar cache for parsed Menlo TDS files.
+
+        Each source file gets a binary entry in a hidden directory next to it, holding the
+        time axis, amplitude, parsed header metadata and optionally the computed spectrum.
+        Entries are keyed on a content hash of the source file. The cheap size/ mtime check
+        validates warm loads, the hash is only recomputed when the file stat changes.
+        The total size of each cache directory is bounded, least recently used entries
+        are evicted first. A folder the cache cannot write to (read only or full share) is
+        logged once and its files are loaded uncached.
+    """
+
+    def __init__(self, maxBytes = 512*1024**2, dirName = ".tdscache"):
+
+        self.maxBytes = maxBytes                # size limit per cache directory
+        self.dirName = dirName                  # cache directory created next to the source files
+        self.hits = 0                           # warm loads
+        self.misses = 0                         # loads that had to parse the source file
+        self._dirBytes = {}                     # running size estimate per cache directory
+        self._unwritable = set()                # cache directories that failed to write, not retried
+
+
+    def cachePath(self, path):
+
+        """
+            Path of the cache entry for a source file.
+        """
+
+        folder, name = os.path.split(os.path.abspath(path))
+        return os.path.join(folder, self.dirName, name + ".tdsc")
+
+
+    def _hash(self, raw):
+
+        return hashlib.blake2b(raw, digest_size = 16).hexdigest()
+
+
+    def _read(self, cacheFile):
+
+        """
+            Read a cache entry. Arrays are zero copy views into the file buffer.
+
+            :return: header fields and arrays, or None for a missing/ corrupt entry
+            :rtype: dict, dict
+        """
+
+        try:
+            with open(cacheFile, 'rb') as f:
+                raw = f.read()
+            if raw[:8] != _magic:
+                return None
+            headerLength = int.from_bytes(raw[8:16], 'little')
+            header = json.loads(raw[16:16 + headerLength].decode())
+            arrays = {}
+            for name, (dtype, shape, offset) in header.pop('arrays').items():
+                count = int(np.prod(shape))
+                arrays[name] = np.frombuffer(raw, dtype = dtype, count = count, offset = offset).reshape(shape)
+            return header, arrays
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+    def _write(self, cacheFile, header, arrays):
+
+        """
+            Write a cache entry: magic, header length, JSON header, then the raw arrays 8 byte aligned.
+        """
+
+        folder = os.path.dirname(cacheFile)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        relative = {}
+        offset = 0
+        for name, arr in arrays.items():
+            relative[name] = offset
+            offset += -(-arr.nbytes//8)*8
+        dataStart = 0
+        while True:                             # offsets are stored in the header, grow until it fits
+            layout = {name: [arr.dtype.str, list(arr.shape), relative[name] + dataStart] for name, arr in arrays.items()}
+            headerBytes = json.dumps(dict(header, arrays = layout), default = str).encode()
+            required = -(-(16 + len(headerBytes))//8)*8
+            if required <= dataStart:
+                break
+            dataStart = required
+        headerBytes = headerBytes.ljust(dataStart - 16)
+        tmpFile = cacheFile + ".tmp"
+        previousSize = os.path.getsize(cacheFile) if os.path.isfile(cacheFile) else 0
+        with open(tmpFile, 'wb') as f:
+            f.write(_magic)
+            f.write(len(headerBytes).to_bytes(8, 'little'))
+            f.write(headerBytes)
+            for name, arr in arrays.items():
+                f.seek(layout[name][2])
+                f.write(np.ascontiguousarray(arr).tobytes())
+        os.replace(tmpFile, cacheFile)          # readers never see a partial entry
+        if folder not in self._dirBytes:
+            self.evict(folder)
+        else:
+            self._dirBytes[folder] += os.path.getsize(cacheFile) - previousSize
+            if self._dirBytes[folder] > self.maxBytes:
+                self.evict(folder)
+
+
+    def _store(self, cacheFile, header, arrays):
+
+        """
+            Write a cache entry if its directory is writable. A failure only costs the caching.
+
+            :return: True if the entry was written
+            :rtype: bool
+        """
+
+        folder = os.path.dirname(cacheFile)
+        if folder in self._unwritable:
+            return False
+        try:
+            self._write(cacheFile, header, arrays)
+            return True
+        except OSError as e:
+            self._unwritable.add(folder)
+            logger.warning(f"TDS cache disabled for {folder}, files there are loaded uncached ({e})")
+            try:
+                os.remove(cacheFile + ".tmp")
+            except OSError:
+                pass
+            return False
+
+
+    def _encodeMeta(self, meta):
+
+        meta = dict(meta)
+        if isinstance(meta.get('timestamp'), datetime.datetime):
+            meta['timestamp'] = meta['timestamp'].isoformat()
+        return meta
+
+
+    def _decodeMeta(self, meta):
+
+        meta = dict(meta)
+        if meta.get('timestamp') is not None:
+            meta['timestamp'] = datetime.datetime.fromisoformat(meta['timestamp'])
+        return meta
+
+
+    def load(self, path, dtype = np.float64):
+
+        """
+            Load a TDS file through the cache.
+
+            :type path: str
+            :param path: path to the source .txt (or binary) file
+            :type dtype: numpy dtype
+            :param dtype: float32 or float64 output
+
+            :return: time axis, amplitude and metadata as returned by MenloParser.readTDS,
+                     plus 'freq' and 'c_FFT' when a spectrum has been cached.
+            :rtype: dict
+        """
+
+        st = os.stat(path)
+        cacheFile = self.cachePath(path)
+        entry = self._read(cacheFile)
+        if entry is not None and (entry[0]['size'] != st.st_size or entry[0]['mtime'] != st.st_mtime_ns):
+            header, arrays = entry
+            with open(path, 'rb') as f:
+                raw = f.read()
+            if header['hash'] == self._hash(raw):   # touched but unchanged, refresh the stat key
+                header['size'] = st.st_size
+                header['mtime'] = st.st_mtime_ns
+                self._store(cacheFile, header, arrays)
+            else:
+                entry = None
+        if entry is None:
+            self.misses += 1
+            with open(path, 'rb') as f:
+                raw = f.read()
+            tds = parseTDSBinary(raw, path) if path.endswith(binaryExtension) else parseTDS(raw.decode(), path)
+            header = {'meta': self._encodeMeta(tds['meta']),
+                      'hash': self._hash(raw),
+                      'size': st.st_size,
+                      'mtime': st.st_mtime_ns}
+            arrays = {'time': tds['time'], 'amp': tds['amp']}
+            self._store(cacheFile, header, arrays)
+        else:
+            header, arrays = entry
+            self.hits += 1
+            try:
+                os.utime(cacheFile)             # recency for eviction
+            except OSError:
+                pass                            # read only share, the entry is still valid
+
+        tds = {'time': arrays['time'].astype(dtype),
+               'amp': arrays['amp'].astype(dtype),
+               'meta': self._decodeMeta(header['meta'])}
+        if 'c_FFT' in arrays:
+            tds['freq'] = arrays['freq']
+            tds['c_FFT'] = arrays['c_FFT']
+            tds['specKey'] = tuple(header['specKey'])
+        return tds
+
+
+    def saveSpectrum(self, path, freq, c_FFT, specKey):
+
+        """
+            Add the computed spectrum to the cache entry of a source file.
+
+            :type path: str
+            :param path: path to the source .txt file
+            :type freq: numpy array
+            :param freq: frequency axis (THz)
+            :type c_FFT: numpy array
+            :param c_FFT: complex spectrum
+            :type specKey: tuple
+            :param specKey: (pad length, window alpha) the spectrum was computed with
+        """
+
+        cacheFile = self.cachePath(path)
+        entry = self._read(cacheFile)
+        if entry is None:
+            return
+        header, arrays = entry
+        header['specKey'] = list(specKey)
+        arrays = dict(arrays, freq = np.asarray(freq), c_FFT = np.asarray(c_FFT))
+        self._store(cacheFile, header, arrays)
+
+
+    def evict(self, folder):
+
+        """
+            Remove least recently used entries until the cache directory is within maxBytes.
+
+            :type folder: str
+            :param folder: cache directory
+        """
+
+        entries = []
+        total = 0
+        with os.scandir(folder) as it:
+            for e in it:
+                if e.name.endswith(".tdsc"):
+                    st = e.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, e.path))
+                    total += st.st_size
+        entries.sort()
+        for _, size, cacheFile in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(cacheFile)
+                total -= size
+            except OSError:
+                pass
+        self._dirBytes[folder] = total
+
+
+    def clear(self, folder):
+
+        """
+            Remove all cache entries for the source files in folder.
+        """
+
+        cacheDir = os.path.join(folder, self.dirName)
+        if os.path.isdir(cacheDir):
+            for name in os.listdir(cacheDir):
+                os.remove(os.path.join(cacheDir, name))
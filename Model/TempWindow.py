@@ -122,7 +122,7 @@ class TempTimelapseWindow(QMainWindow):
             Connect GUI object and validator signals to respective methods.
         """
       
-        self.tempSensorModel.serial.readyRead.connect(self.receive)
+        self.tempSensorModel.serialLink.lineReceived.connect(self.receive)
         self.tempSensorModel.nextScan.connect(self.plotTemp)
         self.livePlot_2.scene().sigMouseMoved.connect(self.mouseMoved2)
         self.btnStartTemp.clicked.connect(self.startObs)
@@ -173,23 +173,18 @@ class TempTimelapseWindow(QMainWindow):
         self.lblTempBig.setText("Cold Finger temp. (C): --")
 
 
-    @asyncSlot()
-    async def receive(self):
-
-        """Receive messages on serial port and redirect to message box"""
+    def receive(self, line):
 
+        """Receive messages on serial port and redirect to message box
         
-        while self.tempSensorModel.serial.canReadLine():
-            
-            codec = QTextCodec.codecForName("UTF-8")
-            line = codec.toUnicode(self.tempSensorModel.serial.readLine()).strip()
-            print(line)
-            
-            if "deg C" in line:
-                self.tempSensorModel.nextScan.emit(line)
-                
-            self.tempSensorModel.lastMessage = line
-            await asyncio.sleep(0)
+            :type line: str
+            :param line: line parsed by the SerialCommandLink
+        """
+
+        logger.debug(line)
+        if "deg C" in line:
+            self.tempSensorModel.nextScan.emit(line)
+        self.tempSensorModel.lastMessage = line
 
 
     @asyncSlot()
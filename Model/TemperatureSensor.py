@@ -10,6 +10,7 @@ sys.path.append(configDir)
 from Model.experiment import *
 from Resources import ur
 from PyQt5 import QtSerialPort
+from Controller.SerialCommandLink import SerialCommandLink
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -53,6 +54,7 @@ class MAXSerialTemp(QWidget):
         self.config = None
         self.configLoaded = None
         self.serial = None
+        self.serialLink = None                 # command/ ACK layer on the serial port, shared with the robot if any
         self.baudrate = None
         self.lastMessage = None
         self.ackTask = None
@@ -102,6 +104,7 @@ class MAXSerialTemp(QWidget):
             self.serial = QtSerialPort.QSerialPort(self.port)
             self.serial.setBaudRate(self.baudrate)
             self.serial.open(QIODevice.ReadWrite)
+            self.serialLink = SerialCommandLink(self.serial, timeout = self.timeout, name = "temperature")
             print("SERIAL PORT OPENED")
         except:
             print("Could not open serial device")
@@ -117,16 +120,17 @@ class MAXSerialTemp(QWidget):
         print("Clearing . . .")
 
 
-    async def waitOnSerial(self):
+    async def waitOnSerial(self, future):
 
-        """Reusable block of code to log timeout for Ack
+        """Wait for the ACK to a command, log timeout for Ack
+
+            :type future: asyncio.Future
+            :param future: response future returned when the command was sent
         """
         
-        logger.info(f"last message : {self.lastMessage}")
-        self.lastMessage = " "      #  clear previous ACK if any
         try:
-            self.ackTask = asyncio.create_task(self.waitForAck())
-            await asyncio.wait_for(self.ackTask, timeout = self.timeout)
+            self.ackTask = asyncio.ensure_future(self.serialLink.wait(future, timeout = self.timeout))
+            await self.ackTask
         except asyncio.exceptions.TimeoutError:
             logger.error(f"[ERROR]: ACK not received")
             logger.warning(f"CHECK CONNECTIONS AND TEMPERATURE PROBE")
@@ -134,26 +138,13 @@ class MAXSerialTemp(QWidget):
             raise e
             
 
-    async def waitForAck(self):
-
-        """Wait for ACK from Serial
-        """
-
-        while self.lastMessage != 'ACK':
-            logger.info("Waiting for ACK")
-            await asyncio.sleep(1)
-        logger.info("ACK received")
-
-
     async def readTemp(self):
 
         """
         Send command on serial to insert cartridge
         """
 
-        txt = "readTemp\n"
-        self.serial.write(txt.encode())
-        await self.waitOnSerial()
+        await self.waitOnSerial(self.serialLink.send("readTemp", owner = self))
         
         
 
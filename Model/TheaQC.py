@@ -16,8 +16,10 @@ from Model.experiment import *
 from Model.QCSM import *
 from Resources import ur
 from MenloLoader import MenloLoader
+from QCKernel import QCKernel, PulseClassifier
+from StageTimer import StageTimer
+from Controller.SerialCommandLink import SerialCommandLink
 from PyQt5 import QtSerialPort
-from scipy.signal import find_peaks
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -68,6 +70,7 @@ class TheaQC(Experiment):
         
         self.serial = QtSerialPort.QSerialPort(self.port)
         self.serial.setBaudRate(self.baudrate)
+        self.robotLink = SerialCommandLink(self.serial, timeout = self.config['Robots']['timeout'], name = "robot")
         
 
     def loadRobotConfig(self):
@@ -106,6 +109,7 @@ class TheaQC(Experiment):
         self.port = None                                      # Serial port name
         self.baudrate = None                                  # baudrate for serial communication  
         self.serial = None                                    # Serial object to communicate with robots
+        self.robotLink = None                                 # command/ ACK layer on the robot serial port
         self.lastMessage = None                               # Store the last message received from the robot
         
 
@@ -139,6 +143,7 @@ class TheaQC(Experiment):
         self.classificationProminence = None
         self.classificationWidth = None
         self.classificationThreshold = None
+        self.pulseClassifier = None                # Air/ Sensor vote on the peaks of the latest pulse
         self.stdRef = None                         # Standard reference TDS pulse data
         self.qcAvgResult = None                    # Store QC averagining result 
         self.qcStep = None
@@ -150,6 +155,13 @@ class TheaQC(Experiment):
         self.qcAvgTask = None                       # QC averaging task
         self.qcLoopTask = None                      # QC test loop
         self.sessionName = None                     # Name of report
+        self.qcKernel = None                        # comparison against the standard reference
+        self.sequentialQC = False                   # stop averaging once the verdict is statistically settled
+        self.minQcAverages = None                   # averages before the first sequential decision
+        self.qcSequentialState = None               # last sequential decision (verdict, certain violations, undecided bins)
+        self.stageTimer = StageTimer()              # per stage timing of the QC loop
+        self.alignCommands = []                     # table positions visited in turn, e.g. ['ALIGN1', 'ALIGN2']
+        self.alignIndex = 0                         # position of the sensor being measured
         
         
     def loadDcBkg(self):
@@ -175,17 +187,21 @@ class TheaQC(Experiment):
         self.classificationProminence = self.config['Classification']['prominence']
         self.classificationThreshold = self.config['Classification']['threshold']
         self.classificationWidth = self.config['Classification']['width']
+        self.pulseClassifier = PulseClassifier.fromConfig(self.config['Classification'])
         self.qcParams ={'fLB':self.config['QC']['lowerFreqBound'],
                         'fUB':self.config['QC']['upperFreqBound'],
                         'errTh':self.config['QC']['allowedErrordB'],
                         'nErrV':self.config['QC']['maxViolations']}
         self.qcNumAvgs = self.config['QC']['qcAverages']
+        self.sequentialQC = self.config['QC'].get('sequential', False)
+        self.minQcAverages = self.config['QC'].get('minAverages', 3)
         self.chipsPerWafer = self.config['QC']['chipsPerWafer']
         self.stdRefDir = self.config['QC']['stdRefDir']
         self.lotNum = self.config['QC']['lotNum']
         qcSaveDir = self.config['QC']['qcSaveDir']
         self.reportsDir = self.config['QC']['ReportsDir']
         self.timeout = self.config['Robots']['timeout']
+        self.alignCommands = self.config['Robots'].get('alignCommands') or []
 
         if qcSaveDir is None or not os.path.isdir(qcSaveDir):
             self.qcSaveDir = os.path.join(baseDir, "qcData")
@@ -230,44 +246,10 @@ class TheaQC(Experiment):
         """
             Classify the latest pulse data as "logger.infoor "Sensor".
         """
-        await asyncio.sleep(0.5)
-        self.pulsePeaks = {}
-        isAir, isSensor = [0 for i in range(2)]
-        start = self.find_nearest(self.timeAxis, self.config["Classification"]["tdsInspectStart"])[0]
-        end =  self.find_nearest(self.timeAxis, self.config["Classification"]["tdsInspectEnd"])[0]
-        self.pulsePeaks['distance'] = find_peaks(self.pulseAmp[start:end], distance = self.classificationDistance)
-        self.pulsePeaks['width'] = find_peaks(self.pulseAmp[start:end], width = self.classificationWidth)
-        
-        self.pulsePeaks['prominence'] = find_peaks(self.pulseAmp[start:end], prominence = self.classificationProminence)
-        self.pulsePeaks['threshold'] = find_peaks(self.pulseAmp[start:end], threshold = self.classificationThreshold)
-        
-        if self.find_nearest(self.pulsePeaks['distance'][0], 250)[1]  > 260: # checking array indices not values
-            isSensor += 1 
-            logger.debug("CLASSIFICATION DISTANCE : SENSOR")
-        else:
-            isAir += 1   
-            logger.debug("CLASSIFICATION DISTANCE : AIR")
-        
-        if len(self.pulsePeaks['threshold'][0]) > 3:
-            isAir += 1     
-            logger.debug("CLASSIFICATION THRESHOLD : AIR")
-        else:
-            isSensor += 1
-            logger.debug("CLASSIFICATION THRESHOLD : SENSOR")
-        if len(self.pulsePeaks['prominence'][0]) > 4:
-            isAir += 1    
-            logger.debug("CLASSIFICATION PROMINENCE : AIR")
-        else:
-            isSensor +=1  
-            logger.debug("CLASSIFICATION PROMINENCE : SENSOR")
-        sensorUpdate = {'isSensor': isSensor, 'isAir': isAir}
-
-        if sensorUpdate['isAir'] < sensorUpdate['isSensor']:
-            self.classification = "Sensor"
-            logger.debug("CLASSIFICATION RESULT <<<<<<<<<< SENSOR")
-        if sensorUpdate['isAir'] > sensorUpdate['isSensor']:
-            self.classification = "Air"
-            logger.debug("CLASSIFICATION RESULT <<<<<<<<<< AIR")
+        await self.device.pulsesProcessed()          # classify the latest pulse, not one still queued
+        self.classification, self.pulsePeaks, sensorUpdate = self.pulseClassifier.classify(self.timeAxis, self.pulseAmp)
+        logger.debug(f"CLASSIFICATION VOTES : {sensorUpdate}")
+        logger.debug(f"CLASSIFICATION RESULT <<<<<<<<<< {self.classification.upper()}")
         self.sensorUpdateReady.emit()  
 
 
@@ -278,8 +260,6 @@ class TheaQC(Experiment):
         
         logger.info("Begin quick scan")
         await self.startAveraging(1)
-        while not self.device.isAveragingDone():
-            await asyncio.sleep(0.5)
         
         self.device.avgTask = None         
         await self.classifyTDS()
@@ -287,39 +267,17 @@ class TheaQC(Experiment):
         
         
 
-    def findResonanceMinima(self,data):
-
-        """
-            Find the resonance minima in between 0.71 - 0.81 THz.
-            
-            data: this is the unsliced FFT array from the measurement
-
-            :return: resonance minima in THz.
-            :rtype: float
-        """
-
-        f1 = 0.71
-        f2 = 0.81
-        x = self.freq
-        fStartId = self.mLoader.find_nearest(x, f1)[0]
-        fEndId = self.mLoader.find_nearest(x, f2)[0]
-        f = x[fStartId:fEndId]    
-        y = 20*np.log(np.abs(data))[fStartId:fEndId]
-        rMinima = f[np.argmin(y)]
-        return rMinima
-
-
     def generateReport(self):
 
-        """Dump results from QC session as a csv"""
+        """Dump results from QC session as a csv, written in the background by the export service"""
 
         df = pd.DataFrame(self.qcResultsList + [self.qcParams])
         logger.info("Exporting QC report to Reports dir")
-        try:       
-            df.to_csv(os.path.join(self.reportsDir,f'{self.sessionName}.csv'))
-
-        except Exception as e:
-            raise e
+        logger.info(f"QC stage timing:\n{self.stageTimer.report()}")
+        fsync = self.config['Export'].get('fsync')
+        self.exportService.toCsv(df, os.path.join(self.reportsDir,f'{self.sessionName}.csv'), fsync = fsync)
+        self.exportService.toCsv(pd.DataFrame(self.stageTimer.summary()),
+                                 os.path.join(self.reportsDir,f'{self.sessionName}_stages.csv'), fsync = fsync, index = False)
 
 ##################################### AsyncSlot coroutines #######################################
     
@@ -332,36 +290,35 @@ class TheaQC(Experiment):
 
         """Send command on serial to eject cartridge"""
 
-        txt = "EJECT\n"
-        self.serial.write(txt.encode())
+        return self.robotLink.send("EJECT")
 
   
     def insertCartridge(self):
 
         """Send command on serial to insert cartridge"""
 
-        txt = "INSERT\n"
-        self.serial.write(txt.encode())
+        return self.robotLink.send("INSERT")
 
 
     def homeRobot(self):
 
         """Send command on serial to insert cartridge"""
 
-        # await asyncio.sleep(0.1)
-        txt = "HOME\n"
-        self.serial.write(txt.encode())
+        return self.robotLink.send("HOME")
         
   
-    async def waitOnRobot(self):
+    async def waitOnRobot(self, future):
 
-        """Reusable block of code to log timeout for Ack"""
+        """Wait for the ACK to a robot command, log timeout for Ack
+
+            :type future: asyncio.Future
+            :param future: response future returned when the command was sent
+        """
         
-        logger.info(f"last message : {self.lastMessage}")
-        self.lastMessage = " "      #  clear previous ACK if any
         try:
-            self.ackTask = asyncio.create_task(self.waitForAck())
-            await asyncio.wait_for(self.ackTask, timeout = self.timeout)
+            self.ackTask = asyncio.ensure_future(self.robotLink.wait(future, timeout = self.timeout))
+            await self.ackTask
+            logger.info("ACK received")
 
         except asyncio.exceptions.TimeoutError:
             logger.error(f"[ERROR]: ACK not received")
@@ -369,14 +326,38 @@ class TheaQC(Experiment):
             self.cancelTasks()
 
 
+    def nextMoveCommands(self):
+
+        """
+            Robot commands that bring the next sensor in: eject the measured cartridge and, with
+            a two position table, move to the other ALIGN position.
+
+            :return: commands in order, each one is acknowledged before the next is sent
+            :rtype: list
+        """
+
+        commands = ["EJECT"]
+        if self.alignCommands:
+            self.alignIndex = (self.alignIndex + 1) % len(self.alignCommands)
+            commands.append(self.alignCommands[self.alignIndex])
+        return commands
+
+
+    async def moveToNextSensor(self):
+
+        """Send the commands for the next sensor and wait for each ACK (timed as the 'move' stage)"""
+
+        with self.stageTimer.stage('move'):
+            for command in self.nextMoveCommands():
+                await self.waitOnRobot(self.robotLink.send(command))
+
+
     async def doQuickScan(self):
 
         """Reusable call to do a quick scan wrapped in ensure future"""
 
         self.quickScanTask = asyncio.ensure_future(self.quickScan())
-        asyncio.gather(self.quickScanTask)
-        while not self.quickScanTask.done():
-            await asyncio.sleep(0.5)
+        await self.quickScanTask
 
 
     async def checkForSensor(self):
@@ -393,13 +374,11 @@ class TheaQC(Experiment):
             if self.classification == 'Air':
                 self.state = 0
             
-                self.insertCartridge()
-                await self.waitOnRobot()
+                await self.waitOnRobot(self.insertCartridge())
                 await self.doQuickScan()
                 logger.info("Verification scan completed")
 
                 try:
-                    await asyncio.sleep(1)
                     assert self.classification == "Sensor"
                     self.state = 1
                 except AssertionError as a:
@@ -424,31 +403,39 @@ class TheaQC(Experiment):
 
         if self.qcRunning:
             try:    
-                self.homeRobot()
-                await self.waitOnRobot()
+                await self.waitOnRobot(self.homeRobot())
                 logger.info("Homing complete. . .")
+                if self.alignCommands:
+                    self.alignIndex = 0
+                    await self.waitOnRobot(self.robotLink.send(self.alignCommands[0]))
+                self.stageTimer.reset()
 
                 while not self.qcComplete:                    
                     
                     self.qcUpdateReady.emit()
-                    await self.checkForSensor()
+                    with self.stageTimer.stage('detect'):
+                        await self.checkForSensor()
         
-                    self.qcAvgTask = asyncio.ensure_future(self.startAveraging(self.qcNumAvgs))
-                    asyncio.gather(self.qcAvgTask)
-                    while not self.qcAvgTask.done():
-                        await asyncio.sleep(0.5)
+                    with self.stageTimer.stage('acquire'):
+                        self.qcAvgTask = asyncio.ensure_future(self.startAveraging(self.qcNumAvgs))
+                        await self.qcAvgTask
+                        await self.device.stop()
 
+                    ## mechanical loop, the next sensor is brought in while this one is analysed and saved
+                    moveTask = asyncio.ensure_future(self.moveToNextSensor())
+                    await asyncio.sleep(0)                    # send the move command before the analysis blocks the loop
                     if self.qcAvgTask.done():
                         logger.info("Averaging check - True")
-                        self.compareToStdRef()
-                        self.saveAverageData(data = self.qcAvgResult, path = self.qcSaveDir, headerType = 'qc') 
-                        await self.device.stop()
-                    ## mechanical loop
-                    self.ejectCartridge()
-                    await self.waitOnRobot()
+                        with self.stageTimer.stage('compare'):
+                            self.compareToStdRef()
+                        with self.stageTimer.stage('persist'):
+                            self.saveAverageData(data = self.qcAvgResult, path = self.qcSaveDir, headerType = 'qc') 
+                    await moveTask
                     self.sensorUpdateReady.emit()
                     self.sensorId += 1
                     self.qcResult = None
+                    self.stageTimer.cycle()
+                    logger.debug(f"QC stage timing:\n{self.stageTimer.report()}")
             
             except Exception as e:
                 logger.error("Something went wrong")
@@ -464,30 +451,60 @@ class TheaQC(Experiment):
         self.qcAvgResult = self.device.avgResult
         
         _ , self.qcAvgFFT = self.calculateFFT(self.timeAxis, self.qcAvgResult['amplitude'][0])
-        diff =  10*np.log(np.abs(self.stdRefFFT)) - 10*np.log(np.abs(self.qcAvgFFT[self.start_idx:self.end_idx]))
-        err = 0
-        
-        for j in diff:
-            if abs(j) > self.config['QC']['allowedErrordB']:                # <<<<<<<<< QC criterion
-                err+=1
-        if err > self.config['QC']['maxViolations']:                  # <<<<<<<<< QC criterion
-            print("QC FAIL")
-            self.qcResult = "FAIL"
-            
-        else:
-            print("QC PASS")
-            self.qcResult = "PASS"
+        self.qcResult, err = self.qcKernel.evaluate(self.qcAvgFFT)         # <<<<<<<<< QC criterion
+        averagesUsed = self.qcAvgResult.get('count', self.qcNumAvgs)
+        print(f"QC {self.qcResult} ({averagesUsed} averages)")
 
-        resonanceMin = self.findResonanceMinima(self.qcAvgFFT)
+        resonanceMin = self.findResonanceMinima(self.qcAvgFFT, self.qcAvgResult['amplitude'][0])
         self.qcResultsList.append({'sensorId':self.sensorId,
                                         'waferId': self.waferId,
                                         'qcResult': self.qcResult,
-                                        'resonance': resonanceMin})
+                                        'resonance': resonanceMin,
+                                        'averages': averagesUsed})
+        self.appendToDataset({'timestamp': datetime.now(),
+                              'sensorId': self.sensorId,
+                              'waferId': self.waferId,
+                              'lotNum': str(self.lotNum),
+                              'qcResult': self.qcResult,
+                              'resonance': resonanceMin,
+                              'violations': err,
+                              'averages': averagesUsed,
+                              'time': self.timeAxis,
+                              'freq': self.freq,
+                              'amp': self.qcAvgResult['amplitude'][0][:len(self.timeAxis)],
+                              'FFT': self.qcAvgFFT})
 
         self.qcUpdateReady.emit()
         self.qcRunNum += 1
         
 
+    def qcSettled(self, averager):
+
+        """
+            Sequential QC decision on the running client side average. Called for every pulse
+            during QC averaging, ends the averaging once the verdict can no longer change at
+            the configured confidence (of the verdict, over all decisions from minAverages to qcAverages).
+
+            :type averager: StreamingAverager
+            :param averager: running average and per sample noise of the current sensor
+
+            :return: True if the verdict is settled
+            :rtype: bool
+        """
+
+        if not self.qcRunning or averager.count < max(self.minQcAverages, 2) or self.timeAxis is None:
+            return False
+        dt = self.timeAxis[1] - self.timeAxis[0]
+        plan = self.spectralEngine.plan(len(averager.mean), dt)
+        _, FFT = self.calculateFFT(self.timeAxis, averager.mean)
+        noise = QCKernel.magnitudeNoise(averager.std, plan.window, plan.norm, averager.effectiveCount)
+        self.qcSequentialState = self.qcKernel.sequential(FFT, noise)
+        verdict, certain, undecided = self.qcSequentialState
+        if verdict is not None:
+            logger.info(f"QC settled after {averager.count} averages: {verdict} ({certain} violations, {undecided} undecided bins)")
+        return verdict is not None
+
+
     @asyncSlot()
     async def startQC(self):
 
@@ -509,6 +526,15 @@ class TheaQC(Experiment):
             _, self._stdRefFFT = self.calculateFFT(self.stdRef.time[0], self.stdRefAmp)
             self.stdRefFFT = self._stdRefFFT[self.start_idx: self.end_idx]
             self.fRange = self.stdRef.freq[0][self.start_idx: self.end_idx]
+            self.qcKernel = QCKernel(self._stdRefFFT, self.start_idx, self.end_idx, self.config['QC']['allowedErrordB'],
+                                     self.config['QC']['maxViolations'], confidence = self.config['QC'].get('confidence', 0.999),
+                                     looks = QCKernel.sequentialLooks(self.config['QC']))
+            if self.sequentialQC:
+                if self.device.averager is None:
+                    self.device.useStreamingAverager()          # sequential decisions need the per sample noise
+                self.device.stopCondition = self.qcSettled
+            self.openDataset(f"QC_{self.sessionName}", attrs = {'lotNum': self.lotNum, 'waferId': self.waferId,
+                                                                  'stdRef': self.config['QC']['stdRefFileName']})
             self.qcLoopTask = asyncio.ensure_future(self.doQC())
             asyncio.gather(self.qcLoopTask)
         else:
@@ -523,8 +549,10 @@ class TheaQC(Experiment):
 
         self.qcRunning = False
         self.qcComplete = True
+        self.device.stopCondition = None
         self.stopUpstream.emit()
         self.generateReport()
+        self.closeDataset()
         await asyncio.sleep(3)
            
 
@@ -547,17 +575,6 @@ class TheaQC(Experiment):
         self.avgProgVal = self.device.scanControl.currentAverages/\
                                  self.device.scanControl.desiredAverages*100
         
-        await asyncio.sleep(0.1)
-            
-
-    async def waitForAck(self):
-
-        """Wait for ACK from Robot"""
-
-        while self.lastMessage != 'ACK':
-            logger.info("Waiting for ACK")
-            await asyncio.sleep(1)
-        logger.info("ACK received")
             
 
     @asyncSlot()
@@ -570,17 +587,19 @@ class TheaQC(Experiment):
         await self.startAveraging(self.qcNumAvgs)
 
         if self.device.isAveragingDone():
-            self.saveAverageData(data = self.device.avgResult, path = self.stdRefDir, headerType = 'stdRef')
+            export = self.saveAverageData(data = self.device.avgResult, path = self.stdRefDir, headerType = 'stdRef')
             self.stopUpstream.emit()
+            if export is not None:
+                await self.exportService.wait(export)          # loadQcConfig reads the new reference
         self.config['QC']['stdRefFileName'] = self.lastFile
         
-        with open(self.config_file, 'w') as f:
-            f.write(yaml.dump(self.config, default_flow_style = False))
-            print(self.config)
-            f.close()
-            self.loadConfig()
-            self.loadQcConfig()
-            logger.info(f"Standard reference updated: {self.config['QC']['stdRefFileName']}")            
+        await self.exportService.wait(self.exportService.writeText(self.config_file,
+                                                                   yaml.dump(self.config, default_flow_style = False),
+                                                                   fsync = True))
+        print(self.config)
+        self.loadConfig()
+        self.loadQcConfig()
+        logger.info(f"Standard reference updated: {self.config['QC']['stdRefFileName']}")            
 
 
     @asyncSlot()
@@ -598,14 +617,11 @@ class TheaQC(Experiment):
                 self.device.setDesiredAverages(numAvgs)
                 logger.info(f"special averaginig: {numAvgs}")
                     
-            await asyncio.sleep(1)
             self.device.keepRunning = True
             self.device.avgTask = asyncio.ensure_future(self.device.doAvgTask())
-            await asyncio.gather(self.device.avgTask)
-            while not self.device.isAveragingDone():
-                await asyncio.sleep(1)
-            if self.device.isAveragingDone():
-                logger.info(f"Scan completed: {self.device.scanControl.currentAverages}/{self.device.scanControl.desiredAverages}")
+            await self.device.avgTask                    # resolved by the averaging progress notifications
+            await self.device.pulsesProcessed()
+            logger.info(f"Scan completed: {self.device.scanControl.currentAverages}/{self.device.scanControl.desiredAverages}")
         
         except asyncio.CancelledError:
             logger.warning("Averaging interrupted")        
@@ -651,6 +667,8 @@ class TheaQC(Experiment):
                 logger.info("Cancelling Ack timer")
                 self.ackTask.cancel()   
                 self.ackTask.cancelled()
+            if self.robotLink is not None:
+                self.robotLink.clear()
 
             await self.device.stop()
             await asyncio.sleep(2)
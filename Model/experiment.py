@@ -1,4 +1,5 @@
 from datetime import datetime
+import glob
 import numpy as np
 import os
 import sys
@@ -9,7 +10,6 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from pyqtgraph import PlotWidget, graphicsItems, TextItem
 from pyqtgraph.graphicsItems.PlotDataItem import PlotDataItem, PlotCurveItem
-from scipy import signal as sgnl
 import signal
 
 baseDir =  os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -25,6 +25,11 @@ sys.path.append(configDir)
 sys.path.append(uiDir)
 
 from Controller.TQC_controller import *
+from SpectralEngine import defaultEngine
+from ResonanceEstimator import ResonanceEstimator
+from PulseDataset import PulseDataset, StreamingDatasetWriter
+from ExportService import defaultExportService
+from MenloParser import binaryExtension
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -49,6 +54,9 @@ class Experiment(QWidget):
 
     configReady = pyqtSignal()
     stopUpstream = pyqtSignal() #  signal to app to stop the controller
+    spectralEngine = defaultEngine    # cached FFT plans shared by all experiments
+    resonanceEstimator = ResonanceEstimator(0.71, 0.81)    # resonance band (THz) and cached band indices
+    exportService = defaultExportService    # background writer for the file exports
     
     def __init__(self, loop, config_file): 
 
@@ -64,6 +72,7 @@ class Experiment(QWidget):
             self.device.resetAveraging()  # Always begin with averaging buffer cleared
             self.stdRefDir = None         # path to std ref dir
             self.lastFile = None          # Full path of the last file being saved
+            self.dataset = None           # columnar dataset writer for the running session
         except AttributeError as a:
             logger.error("Scan Control not found. Please ensure Menlo ScanControl is ON")
             raise a
@@ -88,6 +97,7 @@ class Experiment(QWidget):
         if kind == 'qc':
             header = f"""THEA QC - RAM Group GmbH, powered by Menlo Systems\nProgram Version 1.05\nAverage over {self.numAvgs} waveforms. Start: {self.config['TScan']['begin']} ps, Timestamp: {currentDatetime.strftime('%Y-%m-%dT%H:%M:%S')}
             User time axis shift: {self.config['TScan']['begin']*-1}, QC Parameters: {self.qcParams}
+            Lot number: {self.lotNum}, wafer num: {self.waferId}
             Time [ps]              THz Signal [mV]"""
         filename = f"""{currentDatetime.strftime("%y-%m-%dT%H%M%S")}_T_NIL_RH_NIL_PID_NIL_SN_{self.sensorId}_{self.qcResult}_Reference.txt"""    
         return header, filename
@@ -128,6 +138,10 @@ class Experiment(QWidget):
         self.device.resetAveraging()
         self.device.setBegin(self.config['TScan']['begin'])
         self.device.setEnd(float(self.config['TScan']['begin']) + float(self.config['TScan']['window']))
+        clientAveraging = self.config['TScan'].get('clientAveraging', False)
+        if clientAveraging:
+            self.device.useStreamingAverager(mode = 'cumulative' if clientAveraging is True else clientAveraging,
+                                             snrTarget = self.config['TScan'].get('snrTarget'))
         # self.device.setDesiredAverages(1) # default to single shot unless in averaging task
         
 
@@ -140,6 +154,8 @@ class Experiment(QWidget):
             :type data: dict
             :param data: THz data (TDS and FFT)
 
+            :return: export of the file, written by the export service in the background
+            :rtype: concurrent.futures.Future
         """
 
         if headerType in ['default', 'stdRef']:
@@ -158,7 +174,6 @@ class Experiment(QWidget):
         try:
             avgAmp = data['amplitude'][0]
             time = data['timeaxis'] - data['timeaxis'][0]  
-            tds = np.vstack([time, avgAmp]).T
         except TypeError:
             logger.error("No data to save")
             return
@@ -169,53 +184,197 @@ class Experiment(QWidget):
             dataFolder = path
         try:
             todayFolder = f'{datetime.today():%Y-%m-%d}'
-            savingFolder = os.path.join(dataFolder, todayFolder)
-            if not os.path.isdir(savingFolder):
-                os.makedirs(savingFolder)
+            savingFolder = os.path.join(dataFolder, todayFolder)     # created by the export service
         
-            dataFile = os.path.join(savingFolder, f'{filename}')
+            dataFile = self.tdsPath(os.path.join(savingFolder, f'{filename}'))
             if headerType == 'stdRef':
                 self.lastFile = dataFile.split(self.stdRefDir)[1][1:]
             else:
-                self.lastFile = filename
-            np.savetxt(dataFile, tds, delimiter = '\t' , header = header)
+                self.lastFile = os.path.basename(dataFile)
+            return self.exportTDS(dataFile, time, avgAmp, header)
         except:
             logger.error("Invalid file path to export averaging data")
 
 
-    def calculateFFT(self, time, amp):
+    def tdsPath(self, path):
+
+        """
+            :type path: str
+            :param path: TDS file path, with or without extension
+            :return: path with the extension of the configured export format (Export: format, txt or npz)
+            :rtype: str
+        """
+
+        base, ext = os.path.splitext(path)
+        if self.config['Export'].get('format', 'txt') == 'npz':
+            return base + binaryExtension
+        return base + ".txt" if ext in ("", binaryExtension) else path
+
+
+    def exportTDS(self, path, time, amp, header):
+
+        """
+            Write one averaged pulse in the configured export format, in the background.
+            The binary format keeps the header and exact values in about a quarter of the
+            space, MenloParser.binaryToText (tdsToText.py) restores the text file.
+
+            :type path: str
+            :param path: file path, see tdsPath
+            :type header: str
+            :param header: Menlo header text
+
+            :return: export of the file
+            :rtype: concurrent.futures.Future
+        """
+
+        path = self.tdsPath(path)
+        fsync = self.config['Export'].get('fsync')
+        if path.endswith(binaryExtension):
+            return self.exportService.saveTDSBinary(path, time, amp, header, fsync = fsync)
+        return self.exportService.savetxt(path, np.vstack([time, amp]).T, fsync = fsync, delimiter = '\t', header = header)
+
+
+    def openDataset(self, name, attrs = None, resume = None):
+
+        """
+            Open a columnar pulse dataset for the current session, if enabled in the config
+            (Export: dataset: True, or a directory path). Datasets are written to
+            <dataset dir>/<name>, by default a 'datasets' folder inside saveDir.
+            Rows are written by a background thread and committed in chunks of
+            Export: chunkFrames rows (default 1).
+
+            :type name: str
+            :param name: dataset (session) name
+            :type attrs: dict
+            :param attrs: session metadata stored in the dataset index
+            :type resume: str
+            :param resume: name pattern of earlier datasets of this session e.g. '*_scan1'. The latest
+                           one that was not closed (a crashed run) is continued from its last complete chunk.
+
+            :return: dataset writer, or None when disabled
+            :rtype: StreamingDatasetWriter
+        """
+
+        self.closeDataset()
+        datasetDir = self.config['Export'].get('dataset', False)
+        if not datasetDir:
+            return None
+        if datasetDir is True:
+            datasetDir = os.path.join(self.config['Export']['saveDir'], "datasets")
+        path = os.path.join(datasetDir, name)
+        if resume is not None:
+            path = self.findIncompleteDataset(datasetDir, resume) or path
+        try:
+            self.dataset = StreamingDatasetWriter(path, commitEvery = self.config['Export'].get('chunkFrames', 1),
+                                                  attrs = attrs)
+            if len(self.dataset):
+                logger.info(f"Resuming pulse dataset after {len(self.dataset)} rows: {self.dataset.path}")
+            else:
+                logger.info(f"Writing pulse dataset: {self.dataset.path}")
+        except OSError as e:
+            logger.error(f"Invalid dataset path, dataset export disabled ({e})")
+            self.dataset = None
+        return self.dataset
+
+
+    @staticmethod
+    def findIncompleteDataset(datasetDir, pattern):
+
+        """
+            :return: path of the most recent dataset matching pattern that was not closed, None if there is none
+            :rtype: str
+        """
+
+        for path in sorted(glob.glob(os.path.join(datasetDir, pattern)), key = os.path.getmtime, reverse = True):
+            try:
+                if not PulseDataset(path).complete:
+                    return path
+            except (OSError, ValueError, KeyError):
+                continue
+        return None
+
+
+    def appendToDataset(self, row):
+
+        """
+            Append one pulse to the session dataset. The time and frequency axis are stored
+            once as shared arrays, the remaining values become one column each.
+
+            :type row: dict
+            :param row: column values, may include 'time' and 'freq'
+        """
+
+        if self.dataset is None:
+            return
+        row = dict(row)
+        try:
+            for axis in ['time', 'freq']:
+                if axis in row:
+                    value = row.pop(axis)
+                    if axis not in self.dataset.shared:
+                        self.dataset.setShared(axis, value)
+            self.dataset.append(row)
+        except (OSError, ValueError) as e:
+            logger.error(f"Dataset export failed, rows up to the last complete chunk are kept ({e})")
+            self.closeDataset()
+
+
+    def closeDataset(self):
+
+        """
+            Commit and close the session dataset.
+        """
+
+        if self.dataset is not None:
+            try:
+                self.dataset.close()
+            except (OSError, ValueError) as e:
+                logger.error(f"Closing the dataset failed ({e})")
+            self.dataset = None
+
+
+    def calculateFFT(self, time, amp, out = None):
         
         """
-            Calculate FFT of THz pulse.
+            Calculate FFT of THz pulse. The window, frequency axis and padded 
+            buffers are cached by the shared spectral engine.
 
             :type time: numpy array
             :param time: timeaxis data of THz pulse
             :type amp: numpy array
             :param amp: Pulse amplitude data.
+            :type out: numpy array
+            :param out: optional preallocated array to write the FFT magnitude into.
 
             :return: frequency axis data and FFT data
             :rtype: numpy array, numpy array
         """        
 
-        t_ser_len = 16384
         T = time[1]-time[0] 
-        N = len(time)     
-        w = sgnl.tukey(N, alpha = 0.1)   
-        amp = w*amp                                        
-        pad = t_ser_len - N  
-        time = np.append(time, np.zeros(pad))          
-        amp = np.append(amp, np.zeros(pad))
-      
-        N0 = len(time)
-        freq = np.fft.fftfreq(N0, T)
-        zero_THz_idx = self.find_nearest(freq, 0)[0]
-        freq= freq[zero_THz_idx:int(len(freq)/2)]
-        FFT = np.fft.fft(amp)/(N0/2)   
-        FFT = FFT[zero_THz_idx:int(len(FFT)/2)]     
-        FFT = np.abs(FFT)
-        return freq, FFT
+        return self.spectralEngine.magnitude(amp, T, out = out)
 
         
+    def findResonanceMinima(self, data, amp = None):
+
+        """
+            Find the resonance minima in between 0.71 - 0.81 THz. With the pulse amplitude the band is
+            re-evaluated on a fine grid by a chirp-z transform, otherwise the minimum of the FFT
+            is refined between the bins by parabolic interpolation.
+
+            :type data: numpy array
+            :param data: unsliced FFT array from the measurement, or a 2-D stack of FFTs
+            :type amp: numpy array
+            :param amp: pulse amplitude (or stack of pulses) on self.timeAxis
+
+            :return: resonance minima in THz.
+            :rtype: float or numpy array
+        """
+
+        if amp is not None:
+            return self.resonanceEstimator.estimateZoom(self.timeAxis, amp)
+        return self.resonanceEstimator.estimate(self.freq, data)
+
+
     def find_nearest(self, array, value):        
 
         """
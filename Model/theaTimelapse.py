@@ -20,6 +20,8 @@ sys.path.append(uiDir)
 from Model.experiment import *
 from Resources import ur
 from MenloLoader import MenloLoader
+from FrameStore import FrameStore
+from FrameScheduler import FrameScheduler
 import pandas as pd
 
 
@@ -69,7 +71,10 @@ class TheaTimelapse(Experiment):
             self.mLoader = MenloLoader([])          # fileLoader object
             self.TdsWin = self.config['TScan']['window']
             self.maxStorage = self.config['Timelapse']['maxStorage']
-            self.filesize =  self.config['Timelapse']['_filesize']
+            if self.config['Export'].get('format', 'txt') == 'npz':
+                self.filesize = self.config['Timelapse']['_npzFilesize']
+            else:
+                self.filesize =  self.config['Timelapse']['_filesize']
             self.exportPath = self.config['Export']['saveDir']
             self.checkSessionStorage()
 
@@ -112,14 +117,15 @@ class TheaTimelapse(Experiment):
         self.scanName = None                       # Name for dataframe to be saved
         self.currentFrame = None                   # current frame to be saved
         self.numData = None                        # progress ctr for timelapse         
-        self.filesize = None                       # filesize in kB , +1 kB for safety 
+        self.filesize = None                       # filesize in kB of the export format, +1 kB for safety 
         self.maxStorage = None                     # maximum allocated data storage loaded from config file
         self.maxFrames = None                      # Upper limit for frames viz maxStorage
         self.numFramesDone = 0                     # variable to mark timelapse progress 
         self.timelapseTask = None
+        self.scheduler = None                      # absolute frame start times of the running timelapse
         self.continueTimelapse = None              # flag to control/ suspend aqcuisition
         self.timelapseDone = False                 # flag to control progress
-        self.results = pd.DataFrame()                      # this will be the resulting dataFrame
+        self.frames = self.newFrameStore()         # frames of the session, as a DataFrame via frames.toDataFrame()
         self.GIFSourceNames = []                   # names of files to make a GIF out of
         self.tempSensorModel = None                # temperature sensor model
         self.port = None                           # serial communication port
@@ -144,37 +150,49 @@ class TheaTimelapse(Experiment):
         self.maxFrames = int(ur(self.maxStorage).m_as('kB')/ur(self.filesize).m_as('kB'))
 
 
-    def initTemperatureSensor(self, loop, configFileName):
-        
+    def newFrameStore(self, capacity = 0, ring = False):
+
         """
-            Initialise MAX31855 sensor object
+            Empty frame store for a session of up to capacity frames.
+
+            :type capacity: int
+            :param capacity: expected number of frames, the store grows beyond it if needed
+            :type ring: bool
+            :param ring: keep only the last capacity frames, when the session is streamed to a dataset
+            :rtype: FrameStore
         """
 
-        self.tempSensorModel = MAXSerialTemp(loop, configFileName)
+        return FrameStore(capacity, axes = ('time', 'freq'), arrays = ('amp', 'FFT'),
+                          scalars = {'frameNum': 'i8', 'datetime': 'M8[us]', 'startTemp': 'f8',
+                                     'endTemp': 'f8', 'resonance': 'f8'}, ring = ring)
 
 
-    def findResonanceMinima(self,data):
+    def newScheduler(self):
 
         """
-            Find the resonance minima in between 0.71 - 0.81 THz.
-            
-            data: this is the unsliced FFT array from the measurement
+            Frame scheduler for the requested frames. Timelapse: schedule selects uniform (every interval),
+            log (log spaced from firstInterval over the uniform span) or burst (burstFrames frames every
+            firstInterval, then every interval).
 
-            :return: resonance minima in THz.
-            :rtype: float
+            :rtype: FrameScheduler
         """
 
-        minList = []
-        f1 = 0.71
-        f2 = 0.81
-        x = self.freq
-        fStartId = self.mLoader.find_nearest(x, f1)[0]
-        fEndId = self.mLoader.find_nearest(x, f2)[0]
-        f = x[fStartId:fEndId]    
-        y = 20*np.log(np.abs(data))[fStartId:fEndId]
-        rMinima = f[np.argmin(y)]
-        return rMinima
+        firstInterval = self.config['Timelapse'].get('firstInterval')
+        if firstInterval is not None:
+            firstInterval = ur(str(firstInterval)).m_as("second")
+        return FrameScheduler.fromConfig(self.config['Timelapse'].get('schedule', 'uniform'), self.interval,
+                                         self.numRequestedFrames, firstInterval = firstInterval,
+                                         burstFrames = self.config['Timelapse'].get('burstFrames', 0))
+
+
+    def initTemperatureSensor(self, loop, configFileName):
         
+        """
+            Initialise MAX31855 sensor object
+        """
+
+        self.tempSensorModel = MAXSerialTemp(loop, configFileName)
+
 
 ##################################### AsyncSlot coroutines #######################################
 
@@ -198,7 +216,6 @@ class TheaTimelapse(Experiment):
         self.avgProgVal = int(self.device.scanControl.currentAverages/\
                                  self.device.scanControl.desiredAverages*100)
         
-        await asyncio.sleep(0.1)
         
  
     @asyncSlot()
@@ -207,7 +224,6 @@ class TheaTimelapse(Experiment):
         """
             AsyncSlot coroutine to initiate the averaging task. Buttons are partially disabled during the process. 
         """                
-        await asyncio.sleep(0.1)
         
         if numAvgs == None:            
             self.device.setDesiredAverages(self.numAvgs)
@@ -216,18 +232,15 @@ class TheaTimelapse(Experiment):
             self.device.setDesiredAverages(numAvgs)
             logger.info(f"special averaginig: {numAvgs}")
                 
-        await asyncio.sleep(1)
         self.device.keepRunning = True
         self.device.avgTask = asyncio.ensure_future(self.device.doAvgTask())
         temp1 = self.currentTemp
-        await asyncio.gather(self.device.avgTask)
-        while not self.device.isAveragingDone():
-            await asyncio.sleep(1)
+        await self.device.avgTask                    # resolved by the averaging progress notifications
+        await self.device.pulsesProcessed()
         if self.device.isAveragingDone():
             temp2 = self.currentTemp
             logger.info(f"{self.device.scanControl.currentAverages}/{self.device.scanControl.desiredAverages}")
             logger.info("Averaging completed")
-            rawExportData = np.vstack([self.timeAxis, self.pulseAmp]).T
             currentDatetime = datetime.now()
 
             header = f"""THEA TIMELAPSE - RAM Group GmbH, powered by Menlo Systems\nProgram Version 0.2\nAverage over {self.numAvgs} waveforms. Start: {self.config['TScan']['begin']} ps, Timestamp: {currentDatetime.strftime('%Y-%m-%dT%H:%M:%S')}
@@ -235,22 +248,30 @@ class TheaTimelapse(Experiment):
     Time [ps]              THz Signal [mV]"""
             base_name = f"""{currentDatetime.strftime("%d%m%yT%H%M%S")}_{self.scanName}_{temp1}C_{temp2}C_data{self.numFramesDone+1:04d}"""
             exportPath = os.path.join(self.exportPath, base_name)
-            data_file = os.path.join(exportPath.replace("/","\\") +'.txt')
+            data_file = self.tdsPath(os.path.join(exportPath.replace("/","\\") +'.txt'))
             logger.info(f"EXPORTED: {data_file}")
-            df = pd.DataFrame.from_dict({'frameNum': f"data{self.numFramesDone+1:04d}" , 
-                                         'datetime': currentDatetime, 
-                                         'time':self.timeAxis, 
-                                         'amp':self.pulseAmp, 
-                                         'freq' : self.freq, 
-                                         'FFT': self.FFT, 
-                                         'startTemp':temp1,
-                                         "endTemp":temp2},
-                                          orient='index')
-            df = df.transpose()
-            self.results = pd.concat([self.results, df], axis = 0).reset_index(drop = True)
-            #np.savetxt(data_file, rawExportData, header = header, delimiter = '\t' )  
+            resonance = self.findResonanceMinima(self.FFT, self.pulseAmp)
+            self.frames.append(frameNum = self.numFramesDone+1,
+                               datetime = currentDatetime,
+                               time = self.timeAxis,
+                               amp = self.pulseAmp,
+                               freq = self.freq,
+                               FFT = self.FFT,
+                               startTemp = temp1,
+                               endTemp = temp2,
+                               resonance = resonance)
+            self.appendToDataset({'frameNum': self.numFramesDone+1,
+                                  'timestamp': currentDatetime,
+                                  'time': self.timeAxis,
+                                  'freq': self.freq,
+                                  'amp': self.pulseAmp,
+                                  'FFT': self.FFT,
+                                  'startTemp': temp1,
+                                  'endTemp': temp2,
+                                  'resonance': resonance})
+            #self.exportTDS(data_file, self.timeAxis, self.pulseAmp, header)
             self.numFramesDone +=1
-            print(self.results.tail())
+            logger.debug(f"Frame {self.numFramesDone}: {temp1} - {temp2} C, resonance {resonance:.4f} THz")
 
 
     @asyncSlot()
@@ -266,40 +287,62 @@ class TheaTimelapse(Experiment):
     async def timelapseStart(self):
 
         try:
-            self.results = pd.DataFrame()
+            if self.numRequestedFrames == 0:     
+                self.numRequestedFrames = self.maxFrames
+            resume = f"*_{self.scanName}" if self.config['Export'].get('resume', False) else None
+            self.openDataset(f"{datetime.now():%y-%m-%dT%H%M%S}_{self.scanName}",
+                             attrs = {'scanName': self.scanName, 'interval': self.interval, 'numAvgs': self.numAvgs,
+                                      'frames': self.numRequestedFrames,
+                                      'schedule': self.config['Timelapse'].get('schedule', 'uniform')}, resume = resume)
             self.timelapseDone = False
             self.continueTimelapse = True
             self.GIFSourceNames = [] 
             self.timelapseFinished.emit()   # emit this to check validity of the btn states
 
-            if self.numRequestedFrames == 0:     
-                self.numRequestedFrames = self.maxFrames
-            for i in range(self.numRequestedFrames):
+            if self.dataset is not None:    # frames are streamed to disk, only the displayed ones are kept
+                self.frames = self.newFrameStore(self.config['Timelapse'].get('numDisplayDataSeries', 5), ring = True)
+                self.numFramesDone = len(self.dataset)
+            else:
+                self.frames = self.newFrameStore(self.numRequestedFrames)
+                self.numFramesDone = 0
+            self.scheduler = self.newScheduler()
+            if self.numFramesDone < self.numRequestedFrames:
+                self.scheduler.start(self.numFramesDone)
+            for i in range(self.numFramesDone, self.numRequestedFrames):
                 if self.continueTimelapse:       
+                    delay = self.scheduler.delay(i)
+                    if delay > 0:
+                        logger.info(f"[TIMELAPSE]: AWAITING FRAME {i+1} . . . {delay:.1f} seconds ")
+                    await self.scheduler.wait(i)
                     logger.info(f"[TIMELAPSE]: FRAME {i+1}/{self.numRequestedFrames}")
+                    self.scheduler.frameStarted(i)
                     self.timelapseTask =  asyncio.ensure_future(self.newScan())
-                    asyncio.gather(self.timelapseTask)
                     self.nextScan.emit()
-                    while not self.timelapseTask.done():
-                        await asyncio.sleep(1)
+                    await self.timelapseTask
+                    jitter = self.scheduler.frameFinished(i)
                     self.tlapseProgVal = int((i+1)/self.numRequestedFrames*100)
                     
-                    logger.info(f"[TIMELAPSE]: {self.tlapseProgVal}% - FRAME {i+1}/{self.numRequestedFrames}")
-                    if i+1 < self.numRequestedFrames:
-                        logger.info(f"[TIMELAPSE]: AWAITING INTERVAL TIMEOUT . . . {self.interval} seconds ")
-                        await asyncio.sleep(self.interval) 
-                    logger.info(f"[TIMELAPSE]: {self.tlapseProgVal}% FINISHED - FRAMES {i+1}/{self.numRequestedFrames} DONE")
+                    logger.info(f"[TIMELAPSE]: {self.tlapseProgVal}% FINISHED - FRAMES {i+1}/{self.numRequestedFrames} DONE, "
+                                f"{jitter:+.3f} s from schedule")
                     self.nextScan.emit()
-            await asyncio.sleep(2)
+            jitter = self.scheduler.summary()
+            if jitter['frames']:
+                logger.info(f"[TIMELAPSE]: SCHEDULE JITTER over {jitter['frames']} frames: mean {jitter['mean']:+.3f} s, "
+                            f"std {jitter['std']:.3f} s, max {jitter['max']:.3f} s, acquisition {jitter['acquisitionTime']:.1f} s")
             self.cancelTasks()
             self.device.stop()
             self.timelapseDone = True
             self.numFramesDone = 0 # reset counter for new timelapse if initiated through the GUI
-            df = self.results 
-            df.to_pickle(f"{self.scanName}_{self.interval}s_{self.numRequestedFrames}.pkl")
-            logger.info("TIMELAPSE FINISHED - DATAFRAME EXPORTED")
+            if self.dataset is not None:
+                logger.info(f"TIMELAPSE FINISHED - {len(self.dataset)} FRAMES IN {self.dataset.path}")
+                self.closeDataset()
+            else:
+                df = self.frames.toDataFrame()
+                self.exportService.toPickle(df, f"{self.scanName}_{self.interval}s_{self.numRequestedFrames}.pkl")
+                logger.info("TIMELAPSE FINISHED - DATAFRAME EXPORTED")
         except asyncio.exceptions.CancelledError:
             logger.info("CANCELLED TIMELAPSE")        
+            self.closeDataset()
             self.timelapseFinished.emit()
      
 
@@ -84,11 +84,11 @@ class TqcMainWindow(QWidget, Machine):
         """
         
         self.experiment.device.scanControl.statusChanged.connect(self._statusChanged)
-        self.experiment.serial.readyRead.connect(self.receive)
-        self.experiment.device.pulseReady.connect(self.processPulses)
-        self.experiment.device.pulseReady.connect(self.experiment.processPulses)
+        self.experiment.robotLink.lineReceived.connect(self.receive)
+        self.experiment.device.subscribe(self.experiment.processPulses, policy = 'lossless')    # feeds the averaging result
+        self.experiment.device.subscribe(self.processPulses, policy = 'latest')                 # plots only need the newest pulse
         self.experiment.device.dataUpdateReady.connect(self.experiment.device.done)
-        self.experiment.device.pulseReady.connect(self.startAveraging)
+        self.experiment.device.subscribe(self.startAveraging, policy = 'latest')
         self.experiment.qcUpdateReady.connect(self.qcResult)
         self.experiment.sensorUpdateReady.connect(self.checkNextSensor)     
         self.livePlot.scene().sigMouseMoved.connect(self.mouseMoved)
@@ -482,17 +482,16 @@ class TqcMainWindow(QWidget, Machine):
 ##################################### AsyncSlot coroutines #######################################
 
 
-    @asyncSlot()
-    async def receive(self):
+    def receive(self, line):
 
-        """Receive messages on serial port and redirect to message box"""
+        """Redirect messages received on the serial port to message box
+        
+            :type line: str
+            :param line: line parsed by the robot SerialCommandLink
+        """
 
-        await asyncio.sleep(0.1)
-        while self.experiment.serial.canReadLine():
-            codec = QTextCodec.codecForName("UTF-8")
-            line = codec.toUnicode(self.experiment.serial.readLine()).strip()
-            self.message(line)
-            self.experiment.lastMessage = line
+        self.message(line)
+        self.experiment.lastMessage = line
 
 
     @asyncSlot()
@@ -85,11 +85,11 @@ class PolSweepMainWindow(QMainWindow):
         """
 
         self.experiment.freezerStatus.connect(self.updateFreezerStatus)
-        self.experiment.serial.readyRead.connect(self.receive)
+        self.experiment.robotLink.lineReceived.connect(self.receive)   # same port as the temperature sensor
         self.experiment.device.scanControl.statusChanged.connect(self._statusChanged)
         self.experiment.nextScan.connect(self.updateGraphics)
-        self.experiment.device.pulseReady.connect(self.processPulses)
-        self.experiment.device.pulseReady.connect(self.experiment.processPulses)
+        self.experiment.device.subscribe(self.experiment.processPulses, policy = 'lossless')    # feeds the averaging result
+        self.experiment.device.subscribe(self.processPulses, policy = 'latest')                 # plots only need the newest pulse
         self.experiment.device.dataUpdateReady.connect(self.experiment.device.done)
         self.experiment.polSweepFinished.connect(self.enableAnimation)
         self.experiment.polSweepFinished.connect(self.makeGIF)
@@ -110,7 +110,6 @@ class PolSweepMainWindow(QMainWindow):
         self.lEditFrames.editingFinished.connect(self.validateFrames)
         self.lEditTdsAvgs.textChanged.connect(self.avgsChanged)
         self.livePlot.scene().sigMouseMoved.connect(self.mouseMoved)
-        self.experiment.tempSensorModel.serial.readyRead.connect(self.receive)
         self.experiment.tempSensorModel.nextScan.connect(self.plotTemp)
         self.livePlot_2.scene().sigMouseMoved.connect(self.mouseMoved2)
         self.btnStartTemp.clicked.connect(self.startObs)
@@ -308,22 +307,18 @@ class PolSweepMainWindow(QMainWindow):
             print("Using default name - data")
 
 
-    @asyncSlot()
-    async def receive(self):
-
-        """Receive messages on serial port and redirect to message box"""
+    def receive(self, line):
 
+        """Receive messages on serial port and redirect to message box
         
-        while self.experiment.serial.canReadLine():
-            
-            codec = QTextCodec.codecForName("UTF-8")
-            line = codec.toUnicode(self.experiment.serial.readLine()).strip()
-            if "deg C" in line:
-                self.experiment.tempSensorModel.nextScan.emit(line) 
-            self.experiment.tempSensorModel.lastMessage = line
-            
-            self.experiment.lastMessage = line
-            await asyncio.sleep(0.1)
+            :type line: str
+            :param line: line parsed by the SerialCommandLink shared by the robot and the temperature sensor
+        """
+
+        if "deg C" in line:
+            self.experiment.tempSensorModel.nextScan.emit(line) 
+        self.experiment.tempSensorModel.lastMessage = line
+        self.experiment.lastMessage = line
 
 
     def openSerial(self):
@@ -351,22 +346,25 @@ class PolSweepMainWindow(QMainWindow):
         if self.checkBoxCreateGIF.isChecked():
             
             self.savingFolder = os.path.join(self.experiment.exportPath, "Images")
-            if not os.path.isdir(self.savingFolder):
-                os.makedirs(self.savingFolder)
-            if len(self.experiment.results) > 0:    
-                dt =  str(self.experiment.results.iloc[-1]['datetime']).replace(' ','_').split('.')[0].replace(':','-')
-                name = f"{dt}_{self.experiment.results.iloc[-1]['frameNum']}.png"
+            if len(self.experiment.frames) > 0:    
+                lastFrame = self.experiment.frames.row(-1)
+                dt =  str(lastFrame['datetime']).replace('T','_').split('.')[0].replace(':','-')
+                name = f"{dt}_data{lastFrame['frameNum']:04d}.png"
                 if name not in self.experiment.GIFSourceNames:
                     self.experiment.GIFSourceNames.append(name)
-                    self.exporter.export(os.path.join(self.savingFolder, name))
+                    image = self.exporter.export(toBytes = True)      # rendered here, written by the export service
+                    self.imageExports.append(self.experiment.exportService.saveImage(image, os.path.join(self.savingFolder, name)))
 
 
-    def makeGIF(self):
+    @asyncSlot()
+    async def makeGIF(self):
 
         """Make GIF using result data"""
 
         if self.checkBoxCreateGIF.isChecked() and len(self.experiment.GIFSourceNames) > 0 and not self.experiment.continuePolSweep:
             self.experiment.polSweepDone = False
+            await asyncio.gather(*[self.experiment.exportService.wait(f) for f in self.imageExports], return_exceptions = True)
+            self.imageExports = []
             dfListGIF = [os.path.join(self.savingFolder, image) for image in self.experiment.GIFSourceNames]
             for imgPath in dfListGIF:
                 if not os.path.isfile(imgPath):
@@ -381,8 +379,9 @@ class PolSweepMainWindow(QMainWindow):
 
             frame_one = self.gifList[0]
             self.gifName = f"{self.experiment.GIFSourceNames[0].split('.')[0].split('.png')[0]}_{self.experiment.GIFSourceNames[-1].split('.')[0].split('.png')[0]}"
-            frame_one.save(f"{os.path.join(self.savingFolder, self.gifName)}.gif", format="GIF", append_images=self.gifList,
-                save_all=True, duration=100, loop=0)
+            gifExport = self.experiment.exportService.submit(f"{os.path.join(self.savingFolder, self.gifName)}.gif",
+                lambda tmpFile: frame_one.save(tmpFile, format="GIF", append_images=self.gifList, save_all=True, duration=100, loop=0))
+            await self.experiment.exportService.wait(gifExport)
             if not self.checkBox_keepSrcImgs.isChecked(): 
                     print("DELETING SOURCE IMAGES")
                     self.filesToRemove = [os.path.join(self.savingFolder, img) for img in self.experiment.GIFSourceNames]
@@ -640,6 +639,7 @@ class PolSweepMainWindow(QMainWindow):
         self.livePlotLineWidth = 1
         self.averagePlotLineWidth = 1.5
         self.plotDataContainer = {'livePulseFft': None}       # Dictionary for plot items
+        self.imageExports = []                                # pending plot image exports for the GIF
         self.lEditTdsEnd.setReadOnly(True)
         self.btnStartTemp.setEnabled(True)
         self.scanName = None
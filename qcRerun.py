@@ -0,0 +1,82 @@
+import sys
+import os
+import argparse
+import logging
+from datetime import datetime
+
+topDir = os.path.dirname(os.path.abspath(__file__))
+modelDir =  os.path.join(topDir, "Model")
+sys.path.append(topDir)
+sys.path.append(modelDir)
+
+import yaml
+from MenloLoader import MenloLoader
+from ArchiveIndex import ArchiveIndex
+from QCBatch import QCBatch
+
+
+def parseArgs():
+
+    parser = argparse.ArgumentParser(description = "Re-run the TheaQC classification, standard reference comparison "
+                                                   "and resonance extraction on archived TDS files.")
+    parser.add_argument("paths", nargs = "*", help = "QC data directories or files (default: config QC:qcSaveDir)")
+    parser.add_argument("--config", default = os.path.join(modelDir, "theaConfig.yml"), help = "TheaQC config file")
+    parser.add_argument("--stdRef", help = "standard reference file (default: config QC:stdRefFileName)")
+    parser.add_argument("--allowed", type = float, nargs = "+", help = "allowed deviation(s) per bin to evaluate")
+    parser.add_argument("--max-violations", type = int, nargs = "+", help = "allowed number(s) of deviating bins")
+    parser.add_argument("--pattern", default = "*.txt", help = "file name pattern in directories")
+    parser.add_argument("--recursive", action = "store_true", help = "also search sub directories")
+    parser.add_argument("--index", help = "ArchiveIndex database, select files with --lot/ --wafer/ --since/ --until")
+    parser.add_argument("--lot")
+    parser.add_argument("--wafer")
+    parser.add_argument("--since", type = datetime.fromisoformat)
+    parser.add_argument("--until", type = datetime.fromisoformat)
+    parser.add_argument("--processes", type = int, help = "worker processes (default: all cores)")
+    parser.add_argument("--cache", action = "store_true", help = "load the files through the TDS cache")
+    parser.add_argument("--out", help = "report CSV (default: QC:ReportsDir/qcRerun_<timestamp>.csv)")
+    return parser.parse_args()
+
+
+def selectFiles(args, config):
+
+    if args.index is not None:
+        index = ArchiveIndex(args.index)
+        try:
+            if args.paths:
+                index.update(args.paths, args.pattern, args.recursive)
+            return index.paths(lot = args.lot, wafer = args.wafer, since = args.since, until = args.until)
+        finally:
+            index.close()
+    paths = []
+    for path in args.paths or [config['QC']['qcSaveDir']]:
+        if os.path.isdir(path):
+            paths.extend(MenloLoader.discover(path, args.pattern, args.recursive))
+        else:
+            paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = "%(levelname)s %(name)s: %(message)s")
+    args = parseArgs()
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+
+    paths = selectFiles(args, config)
+    if not paths:
+        sys.exit("No files selected")
+    batch = QCBatch(config, stdRefPath = args.stdRef, cache = args.cache or None)
+    thresholds = batch.thresholds(args.allowed, args.max_violations)
+    print(f"Re-running QC on {len(paths)} file(s) against {batch.stdRefPath}")
+    report = batch.run(paths, thresholds, processes = args.processes)
+    summary = QCBatch.summary(report, thresholds)
+
+    out = args.out
+    if out is None:
+        name = f"qcRerun_{datetime.now().strftime('%y-%m-%dT%H%M%S')}.csv"
+        out = os.path.join(config['QC']['ReportsDir'], name)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok = True)
+    report.to_csv(out, index = False)
+    summary.to_csv(os.path.splitext(out)[0] + "_summary.csv", index = False)
+    print(summary.to_string(index = False))
+    print(f"Report saved to {out}")
@@ -0,0 +1,46 @@
+import sys
+import os
+import argparse
+
+topDir = os.path.dirname(os.path.abspath(__file__))
+modelDir =  os.path.join(topDir, "Model")
+sys.path.append(topDir)
+sys.path.append(modelDir)
+
+from MenloLoader import MenloLoader
+from MenloParser import binaryToText, binaryExtension
+
+
+def parseArgs():
+
+    parser = argparse.ArgumentParser(description = "Convert binary TDS exports (Export: format: npz) back to the "
+                                                   "Menlo tab separated text layout.")
+    parser.add_argument("paths", nargs = "+", help = "binary TDS files or directories")
+    parser.add_argument("--recursive", action = "store_true", help = "also search sub directories")
+    parser.add_argument("--out", help = "output directory (default: next to each file)")
+    parser.add_argument("--delete", action = "store_true", help = "remove each binary file once converted")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths.extend(MenloLoader.discover(path, f"*{binaryExtension}", args.recursive))
+        else:
+            paths.append(path)
+    if not paths:
+        sys.exit("No binary TDS files found")
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok = True)
+
+    for path in paths:
+        out = None
+        if args.out is not None:
+            out = os.path.join(args.out, os.path.splitext(os.path.basename(path))[0] + ".txt")
+        out = binaryToText(path, out)
+        if args.delete:
+            os.remove(path)
+        print(f"{path} -> {out}")
+    print(f"Converted {len(paths)} file(s)")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(topDir)
+sys.path.append(os.path.join(topDir, "Model"))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")       # the Qt experiments need no display
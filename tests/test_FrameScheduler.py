@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from FrameScheduler import FrameScheduler
+
+
+class _Clock:
+
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+
+def _run(scheduler, clock, acquisitionTime, start = 0):
+
+    scheduler.start(start)
+    for i in range(start, len(scheduler)):
+        delay = scheduler.delay(i)
+        if delay > 0:
+            clock.t += delay
+        scheduler.frameStarted(i)
+        clock.t += acquisitionTime
+        scheduler.frameFinished(i)
+
+
+def test_first_frame_is_left_out_of_the_jitter():
+
+    clock = _Clock()
+    scheduler = FrameScheduler.uniform(10, 5, clock = clock)
+    _run(scheduler, clock, 2.0)
+    jitter = scheduler.jitter()
+    assert np.isnan(jitter[0])
+    assert np.allclose(jitter[1:], 0)
+    summary = scheduler.summary()
+    assert summary['frames'] == 4
+    assert summary['max'] == pytest.approx(0)
+    assert summary['acquisitionTime'] == pytest.approx(2.0)
+
+
+def test_resumed_session_leaves_out_its_first_frame():
+
+    clock = _Clock()
+    scheduler = FrameScheduler.uniform(10, 6, clock = clock)
+    _run(scheduler, clock, 2.0, start = 3)
+    jitter = scheduler.jitter()
+    assert np.isnan(jitter[:4]).all()
+    assert np.allclose(jitter[4:], 0)
+
+
+def test_uncentred_frames_are_all_kept():
+
+    clock = _Clock()
+    scheduler = FrameScheduler.uniform(10, 3, centre = False, clock = clock)
+    _run(scheduler, clock, 2.0)
+    assert np.allclose(scheduler.jitter(), 1.0)
@@ -0,0 +1,41 @@
+import os
+import shutil
+import numpy as np
+import pytest
+
+from MenloLoader import MenloLoader
+
+topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+exampleDir = os.path.join(topDir, "Resources", "SensorExample")
+
+
+@pytest.fixture
+def exportDir(tmp_path):
+
+    for i, name in enumerate(sorted(os.listdir(exampleDir))[:5]):          # QC result from the file name, as for QC exports
+        result = "PASS" if i % 2 else "FAIL"
+        shutil.copy(os.path.join(exampleDir, name), tmp_path / f"22-04-20T14432{i}_T_NIL_RH_NIL_PID_NIL_SN_{i}_{result}_Reference.txt")
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_fromDirectory_keeps_metadata(exportDir, processes):
+
+    paths = MenloLoader.discover(exportDir)
+    direct = MenloLoader(paths)
+    pooled = MenloLoader.fromDirectory(exportDir, processes = processes, chunkSize = 2)
+
+    assert len(pooled.meta) == len(pooled.data) == len(paths)
+    assert pooled.meta == direct.meta
+    assert pooled.dtlist == direct.dtlist
+    assert list(pooled.data['sensor_id']) == list(direct.data['sensor_id'])
+
+
+def test_pooled_load_writes_dataset_metadata(exportDir, tmp_path):
+
+    pooled = MenloLoader.fromDirectory(exportDir, processes = 1, chunkSize = 2)
+    dataset = pooled.toDataset(str(tmp_path / "dataset"))
+    qcResults = [meta['qcResult'] for meta in pooled.meta]
+    assert sorted(qcResults) == ["FAIL"]*3 + ["PASS"]*2
+    assert list(dataset['qcResult'].astype(str)) == qcResults
+    assert np.array_equal(dataset['amp'][0], pooled.data['amp'].iloc[0])
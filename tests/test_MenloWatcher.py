@@ -0,0 +1,64 @@
+import asyncio
+import os
+import shutil
+import threading
+import numpy as np
+import pytest
+
+from MenloWatcher import MenloWatcher
+
+topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+exampleDir = os.path.join(topDir, "Resources", "SensorExample")
+
+
+@pytest.fixture
+def exportDir(tmp_path):
+
+    for i, name in enumerate(["F1_5avg.txt", "F1_10avg.txt", "F1_40avg.txt"]):
+        result = "PASS" if i else "FAIL"
+        shutil.copy(os.path.join(exampleDir, name), tmp_path / f"22-04-20T14432{i}_T_NIL_RH_NIL_PID_NIL_SN_{i}_{result}_Reference.txt")
+    return tmp_path
+
+
+def _collectThreads(watcher):
+
+    threads = []
+    collect = watcher._collect
+
+    def recorded():
+        threads.append(threading.current_thread())
+        return collect()
+
+    watcher._collect = recorded
+    return threads
+
+
+def test_async_poll_loads_off_the_loop(exportDir):
+
+    watcher = MenloWatcher(str(exportDir), settle = 0)
+    threads = _collectThreads(watcher)
+    ingested = asyncio.run(watcher.pollAsync())
+
+    reference = MenloWatcher(str(exportDir), settle = 0)
+    assert sorted(ingested) == sorted(reference.poll())
+    assert threads and all(thread is not threading.main_thread() for thread in threads)
+    assert watcher.count == reference.count == 3
+    assert np.allclose(watcher.meanSpectrum[1], reference.meanSpectrum[1])
+    assert watcher.passRate == pytest.approx(2/3)
+
+
+def test_async_rebuild_after_a_dropped_spectrum(exportDir):
+
+    watcher = MenloWatcher(str(exportDir), settle = 0, keepSpectra = 1)
+    threads = _collectThreads(watcher)
+    asyncio.run(watcher.pollAsync())
+    first = sorted(exportDir.glob("*.txt"))[0]
+    with open(first, 'a') as f:
+        f.write("\n")
+    os.utime(first, ns = (0, 0))
+    asyncio.run(watcher.pollAsync())
+
+    assert len(threads) == 3                                   # poll, poll that needs the rebuild, rebuild
+    assert all(thread is not threading.main_thread() for thread in threads)
+    assert watcher.count == 3
+    assert sum(watcher.qcCounts.values()) == 3
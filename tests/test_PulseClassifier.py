@@ -0,0 +1,51 @@
+import glob
+import os
+import numpy as np
+import pytest
+import yaml
+from scipy.signal import find_peaks
+
+from QCKernel import PulseClassifier
+from MenloParser import readTDS
+
+topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope = "module")
+def classifier():
+
+    with open(os.path.join(topDir, "Model", "theaConfig.yml")) as f:
+        return PulseClassifier.fromConfig(yaml.safe_load(f)['Classification'])
+
+
+@pytest.fixture(scope = "module")
+def pulses():
+
+    paths = sorted(glob.glob(os.path.join(topDir, "Resources", "SensorExample", "*.txt")) +
+                   glob.glob(os.path.join(topDir, "Resources", "AirExample", "*.txt")))
+    tds = [readTDS(path) for path in paths]
+    time = tds[0]['time'] - tds[0]['time'][0]                  # live time axis starts at 0 ps
+    assert all(len(t['amp']) == len(time) for t in tds)
+    return time, np.array([t['amp'] for t in tds])
+
+
+def test_classifyBatch_matches_classify(classifier, pulses):
+
+    time, amps = pulses
+    classification, peaks, votes = classifier.classifyBatch(time, amps)
+    assert set(classification) == {"Sensor", "Air"}
+    for i, amp in enumerate(amps):
+        single, singlePeaks, singleVotes = classifier.classify(time, amp)
+        assert classification[i] == single
+        assert {key: int(value[i]) for key, value in votes.items()} == singleVotes
+        for criterion, indices in singlePeaks.items():
+            assert np.array_equal(peaks[i][criterion], indices)
+
+
+def test_localMaxima_matches_find_peaks_on_plateaus():
+
+    rng = np.random.default_rng(3)
+    windows = np.round(rng.normal(0, 1, (20, 300)), 0)         # coarse steps give many flat peaks
+    rows, peaks = PulseClassifier.localMaxima(windows)
+    for i, window in enumerate(windows):
+        assert np.array_equal(peaks[rows == i], find_peaks(window)[0])
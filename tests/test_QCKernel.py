@@ -0,0 +1,87 @@
+import glob
+import os
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+from QCKernel import QCKernel
+from MenloParser import readTDS
+from SpectralEngine import SpectralEngine
+
+topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+qcConfig = {'lowerFreqBound': 0.5, 'upperFreqBound': 0.9, 'allowedErrordB': 1.25, 'maxViolations': 7,
+            'confidence': 0.95, 'sequential': True, 'minAverages': 2, 'qcAverages': 15}
+
+
+def _kernel(confidence):
+
+    refFFT = np.ones(600)
+    return QCKernel(refFFT, 100, 318, qcConfig['allowedErrordB'], qcConfig['maxViolations'],
+                    confidence = confidence, looks = QCKernel.sequentialLooks(qcConfig))
+
+
+def _falseSettles(kernel, trials, rng, sigma = 0.02):
+
+    """
+        Sensors with maxViolations + 1 bins just beyond the threshold (true verdict FAIL), averaged
+        pulse by pulse from minAverages to qcAverages. Counts the sensors settled as PASS.
+    """
+
+    nBins = kernel.end_idx - kernel.start_idx
+    trueDeviation = np.zeros(nBins)
+    trueDeviation[::nBins//(kernel.maxViolations + 1)][:kernel.maxViolations + 1] = kernel.allowedErrordB + 0.02
+    trueBand = np.exp(-trueDeviation/kernel.dbScale)
+    FFT = np.ones(600)
+    wrong = 0
+    for _ in range(trials):
+        pulses = rng.normal(0, sigma, (qcConfig['qcAverages'], nBins))
+        means = np.cumsum(pulses, axis = 0)/np.arange(1, qcConfig['qcAverages'] + 1)[:, None]
+        for count in range(qcConfig['minAverages'], qcConfig['qcAverages'] + 1):
+            FFT[kernel.start_idx:kernel.end_idx] = trueBand + means[count - 1]
+            verdict, _, _ = kernel.sequential(FFT, sigma/np.sqrt(count))
+            if verdict is not None:
+                wrong += verdict == "PASS"
+                break
+    return wrong/trials
+
+
+def test_looks_follow_the_config():
+
+    assert QCKernel.sequentialLooks(qcConfig) == 14
+    assert QCKernel.sequentialLooks(dict(qcConfig, sequential = False)) == 1
+
+
+def test_false_settle_rate_is_within_the_confidence():
+
+    rng = np.random.default_rng(1)
+    kernel = _kernel(qcConfig['confidence'])
+    assert _falseSettles(kernel, 1000, rng) <= 1 - qcConfig['confidence']
+
+    kernel.z = norm.ppf(0.5 + qcConfig['confidence']/2)         # uncorrected per bin bound
+    assert _falseSettles(kernel, 1000, rng) > 1 - qcConfig['confidence']
+
+
+def test_clean_sensor_settles_early():
+
+    kernel = _kernel(0.999)
+    FFT = np.ones(600)
+    FFT[kernel.start_idx:kernel.end_idx] += np.random.default_rng(2).normal(0, 0.02/np.sqrt(3), kernel.end_idx - kernel.start_idx)
+    assert kernel.sequential(FFT, 0.02/np.sqrt(3))[0] == "PASS"
+
+
+@pytest.mark.parametrize("pattern", ["SensorExample/F1_singleshot*.txt", "AirExample/Air_singleshot*.txt"])
+def test_white_noise_model_is_conservative(pattern):
+
+    pulses = [readTDS(path) for path in sorted(glob.glob(os.path.join(topDir, "Resources", pattern)))]
+    amps = np.array([pulse['amp'] for pulse in pulses])
+    dt = pulses[0]['time'][1] - pulses[0]['time'][0]
+    engine = SpectralEngine()
+    freq, FFTs = engine.batch(amps, dt)
+    plan = engine.plan(amps.shape[1], dt)
+    kernel = QCKernel.fromConfig(freq, np.abs(FFTs).mean(axis = 0), qcConfig)
+
+    model = QCKernel.magnitudeNoise(amps.std(axis = 0, ddof = 1), plan.window, plan.norm, 1)
+    measured = kernel.magnitudeScatter(FFTs)
+    assert len(measured) == kernel.end_idx - kernel.start_idx
+    assert np.median(measured/model) < 1
@@ -0,0 +1,111 @@
+import asyncio
+import re
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from Controller.SerialCommandLink import SerialCommandLink
+
+
+class _Signal:
+
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+
+class _Port:
+
+    """
+        In memory serial port: written commands are recorded, feed() makes lines readable.
+    """
+
+    def __init__(self):
+        self.readyRead = _Signal()
+        self.written = []
+        self.lines = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def canReadLine(self):
+        return bool(self.lines)
+
+    def readLine(self):
+        return self.lines.pop(0)
+
+    def feed(self, *lines):
+        self.lines.extend(f"{line}\n".encode() for line in lines)
+        for slot in self.readyRead.slots:
+            slot()
+
+
+@pytest.fixture
+def loop():
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def test_responses_answer_the_oldest_command(loop):
+
+    port = _Port()
+    link = SerialCommandLink(port, timeout = 1)
+    home = link.send("home")
+    pos = link.send("pos", expect = lambda line: re.fullmatch(r"[-+]?\d+(\.\d*)?", line))
+    port.feed("Current position: ", "12.5")
+    assert not home.done() and not pos.done()      # the oldest command waits for its ACK
+    port.feed("ACK", "12.5")
+    assert home.result() == "ACK"
+    assert pos.result() == "12.5"
+
+
+def test_unanswered_commands_are_dropped(loop):
+
+    port = _Port()
+    link = SerialCommandLink(port, timeout = 1)
+    lift = link.send("lift", timeout = 0.01)
+    loop.run_until_complete(asyncio.sleep(0.02))
+    contact = link.send("contact")
+    port.feed("ACK")
+    assert lift.cancelled()
+    assert contact.result() == "ACK"
+    assert link.send("eject", reply = False) is None
+    port.feed("ACK")
+    assert not link._pending
+
+
+def test_timeout_discards_the_command(loop):
+
+    port = _Port()
+    link = SerialCommandLink(port, timeout = 1)
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(link.request("pos", expect = None, timeout = 0.01))
+    home = link.send("home")
+    port.feed("ACK")
+    assert home.result() == "ACK"
+
+
+def test_shared_link_waits_and_clears_per_owner(loop):
+
+    port = _Port()
+    link = SerialCommandLink(port, timeout = 1)
+    robot, sensor = object(), object()
+    contact = link.send("contact", owner = robot)
+    readTemp = link.send("readTemp", owner = sensor)        # sent while the robot waits for its ACK
+    waiting = loop.create_task(link.wait(contact, timeout = 1))
+    port.feed("ACK")
+    assert loop.run_until_complete(waiting) == "ACK"
+    assert not readTemp.done()
+
+    eject = link.send("eject", owner = robot)
+    link.clear(owner = robot)
+    assert eject.cancelled()
+    assert not readTemp.done()
+    port.feed("ACK")
+    assert readTemp.result() == "ACK"
@@ -0,0 +1,49 @@
+import logging
+import os
+import shutil
+import numpy as np
+import pytest
+
+from TDSCache import TDSCache
+from MenloLoader import MenloLoader
+from MenloParser import readTDS
+
+topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+exampleDir = os.path.join(topDir, "Resources", "SensorExample")
+
+
+@pytest.fixture
+def exportDir(tmp_path):
+
+    for name in ["F1_5avg.txt", "F1_10avg.txt"]:
+        shutil.copy(os.path.join(exampleDir, name), tmp_path)
+    return tmp_path
+
+
+def test_unwritable_folder_loads_uncached(exportDir, caplog):
+
+    (exportDir / ".tdscache").write_text("")                   # the cache directory cannot be created
+    cache = TDSCache()
+    paths = [str(exportDir / "F1_5avg.txt"), str(exportDir / "F1_10avg.txt")]
+    with caplog.at_level(logging.WARNING, logger = "TDSCache"):
+        loaded = [cache.load(path) for path in paths]
+        loader = MenloLoader(paths, cache = cache)
+    for path, tds in zip(paths, loaded):
+        assert np.array_equal(tds['amp'], readTDS(path)['amp'])
+    assert len(loader.data) == 2
+    assert cache.hits == 0
+    assert len([r for r in caplog.records if "TDS cache disabled" in r.getMessage()]) == 1
+
+
+def test_rewritten_entries_keep_the_directory_size(exportDir):
+
+    cache = TDSCache()
+    path = str(exportDir / "F1_5avg.txt")
+    cache.load(path)
+    folder = os.path.dirname(cache.cachePath(path))
+    freq = np.linspace(0, 5, 1000)
+    for _ in range(3):
+        cache.saveSpectrum(path, freq, np.ones(1000, dtype = complex), (16384, 0.1))
+    os.utime(path, ns = (0, 0))                                # touched, the stat key is refreshed
+    cache.load(path)
+    assert cache._dirBytes[folder] == sum(e.stat().st_size for e in os.scandir(folder))
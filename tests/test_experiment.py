@@ -0,0 +1,38 @@
+import re
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("qasync")
+
+from Model.experiment import Experiment
+from MenloParser import parseHeader
+
+
+def _experiment():
+
+    return SimpleNamespace(config = {'TScan': {'begin': -20}}, numAvgs = 100, lotNum = "L7", waferId = "W3",
+                           qcParams = {'peaks': 2}, sensorId = "12", qcResult = "PASS")
+
+
+def test_qc_header_keeps_its_original_lines():
+
+    header, filename = Experiment.makeHeader(_experiment(), 'qc')
+    lines = [line.strip() for line in header.splitlines()]
+    assert lines[0] == "THEA QC - RAM Group GmbH, powered by Menlo Systems"
+    assert lines[1] == "Program Version 1.05"
+    assert re.fullmatch(r"Average over 100 waveforms\. Start: -20 ps, Timestamp: \d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}", lines[2])
+    assert lines[3] == "User time axis shift: 20, QC Parameters: {'peaks': 2}"
+    assert lines[4] == "Lot number: L7, wafer num: W3"
+    assert lines[5] == "Time [ps]              THz Signal [mV]"
+    assert filename.endswith("_SN_12_PASS_Reference.txt")
+
+
+def test_qc_header_metadata_is_parsed():
+
+    header, filename = Experiment.makeHeader(_experiment(), 'qc')
+    meta = parseHeader(header.splitlines(), filename)
+    assert (meta['lot'], meta['wafer']) == ("L7", "W3")
+    assert meta['averages'] == 100
+    assert meta['qcParams'] == {'peaks': 2}
+    assert meta['qcResult'] == "PASS"
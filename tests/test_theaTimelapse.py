@@ -0,0 +1,103 @@
+import asyncio
+import os
+import numpy as np
+import pytest
+import yaml
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("qasync")
+pytest.importorskip("pyqtgraph")
+
+from PyQt5.QtWidgets import QApplication
+from Model.experiment import Experiment
+from Model.theaTimelapse import TheaTimelapse
+from PulseDataset import PulseDataset
+
+topDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _ScanControl:
+
+    currentAverages = 4
+    desiredAverages = 4
+
+
+class _Device:
+
+    """
+        Stands in for the ScanControl device: every averaging task produces one synthetic pulse.
+    """
+
+    def __init__(self, experiment):
+
+        self.experiment = experiment
+        self.scanControl = _ScanControl()
+        self.avgTask = None
+        self.keepRunning = False
+
+    async def stop(self):
+        pass
+
+    def resetAveraging(self):
+        pass
+
+    def setDesiredAverages(self, desiredAvgs):
+        pass
+
+    def isAveragingDone(self):
+        return True
+
+    async def pulsesProcessed(self):
+        pass
+
+    async def doAvgTask(self):
+
+        experiment = self.experiment
+        time = np.arange(1200)*0.05
+        amp = np.exp(-((time - 10)/0.3)**2) - 0.5*np.exp(-((time - 10.6)/0.4)**2)
+        experiment.timeAxis = time
+        experiment.pulseAmp = amp
+        experiment.freq, experiment.FFT = experiment.calculateFFT(time, amp)
+
+
+@pytest.fixture
+def timelapse(tmp_path, monkeypatch):
+
+    app = QApplication.instance() or QApplication([])
+    with open(os.path.join(topDir, "config", "timelapseConfig.yml")) as f:
+        config = yaml.safe_load(f)
+    config['Export']['saveDir'] = str(tmp_path)
+    config['Export']['dataset'] = True
+    config['Export']['chunkFrames'] = 2
+    configFile = tmp_path / "timelapseConfig.yml"
+    configFile.write_text(yaml.dump(config))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Experiment, 'loadDevice', lambda self: setattr(self, 'device', _Device(self)))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    experiment = TheaTimelapse(loop, str(configFile))
+    experiment.scanName = "test"
+    experiment.interval = 0
+    experiment.numAvgs = 4
+    experiment.numRequestedFrames = 5
+    yield experiment, loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def test_timelapse_streams_frames_to_dataset(timelapse, tmp_path):
+
+    experiment, loop = timelapse
+    loop.run_until_complete(TheaTimelapse.timelapseStart.__wrapped__(experiment))
+    loop.run_until_complete(asyncio.sleep(0))
+
+    datasets = os.listdir(tmp_path / "datasets")
+    assert len(datasets) == 1
+    dataset = PulseDataset(str(tmp_path / "datasets" / datasets[0]))
+    assert len(dataset) == 5
+    assert dataset.complete
+    assert list(dataset['frameNum']) == [1, 2, 3, 4, 5]
+    assert len(dataset.chunks) == 3
+    assert len(experiment.frames) == min(5, experiment.config['Timelapse']['numDisplayDataSeries'])
+    assert experiment.frames.row(-1)['frameNum'] == 5
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".pkl")]